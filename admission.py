@@ -0,0 +1,183 @@
+"""Admission control for expensive requests."""
+
+import functools
+import threading
+import time
+
+from flask import g, request
+
+
+class Overloaded(Exception):
+    """Exception raised when a request cannot be admitted in time.
+
+    Attributes:
+        retry_after -- seconds the client should wait before retrying
+    """
+
+    def __init__(self, retry_after):
+        Exception.__init__(self)
+        self.retry_after = retry_after
+
+
+# WSGI environ key of the time (time.time()) a request reached the app
+REQUEST_START_KEY = "afids.request_start"
+
+# X-Request-Start values further in the past are taken to be bogus
+MAX_REQUEST_AGE = 3600
+
+
+class RequestTimer:
+    """WSGI middleware recording when each request reached the app.
+
+    Wrap the app with it last, so the time is taken before any other
+    middleware runs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        environ.setdefault(REQUEST_START_KEY, time.time())
+        return self.app(environ, start_response)
+
+
+def parse_request_start(value):
+    """Parse an X-Request-Start header into a time.time() timestamp.
+
+    Proxies send it as seconds (nginx, ``t=1600000000.123``),
+    milliseconds (Heroku's router) or microseconds (Apache), all since
+    the epoch. Returns None if the value cannot be parsed.
+    """
+    if value.startswith("t="):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+
+    if started > 1e14:
+        return started / 1e6
+    if started > 1e11:
+        return started / 1e3
+    return started
+
+
+def request_arrival(environ):
+    """When a request arrived, as a time.time() timestamp, or None.
+
+    The earliest of the proxy's X-Request-Start header and the time taken
+    by RequestTimer, so time queued in the proxy, the server's backlog
+    and the server itself counts. Header times in the future or long ago
+    are ignored, in case of clock skew.
+    """
+    now = time.time()
+    candidates = [environ.get(REQUEST_START_KEY)]
+    header = environ.get("HTTP_X_REQUEST_START")
+    if header:
+        started = parse_request_start(header)
+        if started is not None and now - MAX_REQUEST_AGE <= started <= now:
+            candidates.append(started)
+
+    candidates = [started for started in candidates if started is not None]
+    return min(candidates) if candidates else None
+
+
+class Deadline:
+    """A time budget for one request.
+
+    The budget is counted from ``started``, a time.time() timestamp, or
+    from now if it is None.
+    """
+
+    __slots__ = ("expires",)
+
+    def __init__(self, budget, started=None):
+        elapsed = 0.0 if started is None else max(0.0, time.time() - started)
+        self.expires = time.monotonic() + budget - elapsed
+
+    def remaining(self):
+        """Seconds left before the deadline, never negative."""
+        return max(0.0, self.expires - time.monotonic())
+
+
+class AdmissionController:
+    """Bound the number of requests of one kind in flight in a worker.
+
+    Requests wait at most ``queue_timeout`` seconds for a slot; after
+    that they are rejected with Overloaded, so they fail fast instead of
+    queueing behind slow ones. Admitted requests get a Deadline of
+    ``deadline`` seconds, counted from when they arrived, see
+    request_arrival.
+    """
+
+    def __init__(self, max_inflight, queue_timeout, deadline, retry_after):
+        self.max_inflight = max_inflight
+        self.queue_timeout = queue_timeout
+        self.deadline = deadline
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    def acquire(self, started=None):
+        """Wait for a slot, returning the request's Deadline.
+
+        started is when the request arrived, as a time.time() timestamp;
+        now if None.
+        """
+        deadline = Deadline(self.deadline, started)
+        with self._lock:
+            self.waiting += 1
+        try:
+            admitted = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+        with self._lock:
+            if not admitted:
+                self.rejected += 1
+                raise Overloaded(self.retry_after)
+            self.in_flight += 1
+
+        return deadline
+
+    def release(self):
+        """Give back a slot taken by acquire."""
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def stats(self):
+        """Current and maximum in-flight counts, for autoscaling."""
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_inflight": self.max_inflight,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+            }
+
+    def limit(self, methods=("POST",)):
+        """Decorate a view so that requests with these methods are limited.
+
+        The admitted request's Deadline is available as ``g.deadline``.
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method not in methods:
+                    return view(*args, **kwargs)
+
+                g.deadline = self.acquire(request_arrival(request.environ))
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    self.release()
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,215 @@
+"""Inter-rater statistics over many stored AFIDs sets.
+
+Every function takes coordinates as an ``(N, 32, 3)`` array, typically the
+memory-mapped array of a population.PopulationStore, and reads it in
+blocks of ``block_size`` sets. Pairwise distances are computed one
+``(block_size, block_size, 32)`` block at a time, so summaries over all
+N² pairs never hold more than one block in memory. Missing coordinates
+(NaN) are left out of every statistic.
+"""
+
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 128
+
+
+def _read_block(coords, start, block_size):
+    """Read a block of sets into memory as float64."""
+    return np.asarray(coords[start : start + block_size], dtype=np.float64)
+
+
+def iter_distance_blocks(coords, other=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Yield blocks of per-AFID distances between sets.
+
+    Parameters
+    ----------
+    coords : array_like, shape (N, 32, 3)
+        Coordinates of the sets.
+    other : array_like, shape (M, 32, 3), optional
+        Coordinates to compare against. If None, sets are compared with
+        each other and only blocks on or above the diagonal are yielded.
+    block_size : int, optional
+        Number of sets per block side.
+
+    Yields
+    ------
+    row : int
+        Index of the block's first set in coords.
+    col : int
+        Index of the block's first set in other.
+    distances : numpy.ndarray, shape (<=block_size, <=block_size, 32)
+        Euclidean distance between each pair of corresponding AFIDs.
+    """
+    symmetric = other is None
+    if symmetric:
+        other = coords
+
+    for row in range(0, len(coords), block_size):
+        block = _read_block(coords, row, block_size)
+        for col in range(row if symmetric else 0, len(other), block_size):
+            other_block = (
+                block
+                if col == row and symmetric
+                else _read_block(other, col, block_size)
+            )
+            diff = block[:, np.newaxis] - other_block[np.newaxis]
+            yield row, col, np.sqrt(np.einsum("ijkl,ijkl->ijk", diff, diff))
+
+
+def distance_matrix(coords, out=None, block_size=DEFAULT_BLOCK_SIZE):
+    """Per-AFID distances between every pair of sets.
+
+    Parameters
+    ----------
+    coords : array_like, shape (N, 32, 3)
+        Coordinates of the sets.
+    out : array_like, shape (N, N, 32), optional
+        Array to fill, e.g. a numpy.lib.format.open_memmap for matrices
+        larger than memory. A new array is allocated if None.
+    block_size : int, optional
+        Number of sets per block side.
+
+    Returns
+    -------
+    numpy.ndarray, shape (N, N, 32)
+    """
+    num_sets = len(coords)
+    if out is None:
+        out = np.empty((num_sets, num_sets, coords.shape[1]))
+
+    for row, col, distances in iter_distance_blocks(
+        coords, block_size=block_size
+    ):
+        rows = slice(row, row + distances.shape[0])
+        cols = slice(col, col + distances.shape[1])
+        out[rows, cols] = distances
+        out[cols, rows] = distances.transpose(1, 0, 2)
+
+    return out
+
+
+def pairwise_distance_summary(coords, block_size=DEFAULT_BLOCK_SIZE):
+    """Summarize the per-AFID distance between every pair of sets.
+
+    Means and variances of the blocks are merged pairwise (Chan et al.),
+    which stays accurate over many blocks.
+
+    Parameters
+    ----------
+    coords : array_like, shape (N, 32, 3)
+        Coordinates of the sets.
+    block_size : int, optional
+        Number of sets per block side.
+
+    Returns
+    -------
+    dict of numpy.ndarray, each of shape (32,)
+        ``count`` of pairs, and the ``mean``, ``std`` and ``max`` of
+        their distances, for each AFID.
+    """
+    num_afids = coords.shape[1]
+    count = np.zeros(num_afids)
+    mean = np.zeros(num_afids)
+    sum_sq = np.zeros(num_afids)
+    maximum = np.full(num_afids, -np.inf)
+
+    for row, col, distances in iter_distance_blocks(
+        coords, block_size=block_size
+    ):
+        if row == col:
+            # Each pair once, and not a set with itself
+            distances = distances[np.triu_indices(len(distances), 1)]
+        else:
+            distances = distances.reshape(-1, num_afids)
+
+        valid = ~np.isnan(distances)
+        block_count = valid.sum(axis=0)
+        block_mean = np.where(valid, distances, 0).sum(axis=0) / np.maximum(
+            block_count, 1
+        )
+        block_sum_sq = np.where(valid, distances - block_mean, 0)
+        block_sum_sq = (block_sum_sq ** 2).sum(axis=0)
+
+        total = count + block_count
+        weight = block_count / np.maximum(total, 1)
+        delta = block_mean - mean
+        mean = mean + delta * weight
+        sum_sq = sum_sq + block_sum_sq + delta ** 2 * count * weight
+        maximum = np.maximum(
+            maximum, np.where(valid, distances, -np.inf).max(axis=0)
+        )
+        count = total
+
+    pairs = count > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt(sum_sq / count)
+
+    return {
+        "count": count.astype(np.int64),
+        "mean": np.where(pairs, mean, np.nan),
+        "std": std,
+        "max": np.where(pairs, maximum, np.nan),
+    }
+
+
+def icc(coords, subjects, block_size=DEFAULT_BLOCK_SIZE):
+    """One-way random effects ICC(1,1) of each AFID coordinate.
+
+    Sets of the same subject, placed by different raters, are the
+    repeated measurements; the ICC is the share of the coordinate's
+    variance that is between subjects. Only per-subject sums are kept,
+    so memory grows with the number of subjects, not of sets. Unequal
+    numbers of sets per subject are allowed.
+
+    Parameters
+    ----------
+    coords : array_like, shape (N, 32, 3)
+        Coordinates of the sets.
+    subjects : array_like, shape (N,)
+        Subject of each set.
+    block_size : int, optional
+        Number of sets read at a time.
+
+    Returns
+    -------
+    numpy.ndarray, shape (32, 3)
+        ICC of the x, y and z coordinate of each AFID; NaN where it is
+        undefined, e.g. with fewer than two subjects.
+    """
+    subject_ids, subject_index = np.unique(
+        np.asarray(subjects), return_inverse=True
+    )
+    shape = (len(subject_ids),) + tuple(coords.shape[1:])
+    counts = np.zeros(shape)
+    sums = np.zeros(shape)
+    sums_sq = np.zeros(shape)
+
+    for start in range(0, len(coords), block_size):
+        block = _read_block(coords, start, block_size)
+        index = subject_index[start : start + block_size]
+        valid = ~np.isnan(block)
+        block = np.where(valid, block, 0)
+        np.add.at(counts, index, valid)
+        np.add.at(sums, index, block)
+        np.add.at(sums_sq, index, block ** 2)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        num_sets = counts.sum(axis=0)
+        num_subjects = (counts > 0).sum(axis=0)
+        grand_mean = sums.sum(axis=0) / num_sets
+        subject_means = sums / counts
+
+        between = np.nansum(counts * (subject_means - grand_mean) ** 2, axis=0)
+        within = sums_sq.sum(axis=0) - np.nansum(
+            counts * subject_means ** 2, axis=0
+        )
+        ms_between = between / (num_subjects - 1)
+        ms_within = within / (num_sets - num_subjects)
+        # Average group size, adjusted for unequal groups
+        group_size = (num_sets - (counts ** 2).sum(axis=0) / num_sets) / (
+            num_subjects - 1
+        )
+
+        return (ms_between - ms_within) / (
+            ms_between + (group_size - 1) * ms_within
+        )
@@ -0,0 +1,317 @@
+"""ASGI entry point for the validation and JSON API endpoints.
+
+Run with any ASGI server, e.g. ``uvicorn asgi:app``. Uploads are read
+from the connection without holding a thread, so one process can hold
+many slow clients; parsing and plotting run in a process pool, and
+database queries in a small thread pool bounded like a connection pool.
+
+Endpoints
+---------
+POST /api/validate
+    The AFIDs file is the request body, optionally gzip-compressed (sent
+    with Content-Encoding: gzip, or named *.gz). Query arguments: filename
+    (its extension picks the format), template, protocol, store (save the
+    set when validation passes) and plots (also render the figures).
+GET /api/sets
+    Stored sets, with the filters of the /sets page.
+GET /api/templates
+    Names of the available templates.
+"""
+
+import asyncio
+import concurrent.futures
+import io
+import json
+import urllib.parse
+
+from controller import (
+    allowed_file,
+    app as flask_app,
+    db,
+    find_sets,
+    FiducialSet,
+    template_store,
+)
+from compression import MAX_COMPRESSION_RATIO, MAX_DECOMPRESSED_SIZE
+from model_auto import InvalidFcsvError, parse_upload
+from qc_metrics import afids_metrics
+from visualizations import (
+    figure_process_pool,
+    generate_3d_scatter,
+    generate_histogram,
+)
+
+
+class HTTPError(Exception):
+    """Exception raised to answer a request with an error.
+
+    Attributes:
+        status -- HTTP status code
+        message -- explanation sent to the client
+    """
+
+    def __init__(self, status, message):
+        Exception.__init__(self)
+        self.status = status
+        self.message = message
+
+
+def validate_upload(
+    data,
+    filename,
+    protocol,
+    template_afids,
+    plots,
+    content_encoding=None,
+    limits=(MAX_DECOMPRESSED_SIZE, MAX_COMPRESSION_RATIO),
+):
+    """Parse an upload and compare it to a template, in a worker process.
+
+    Errors are returned rather than raised, so nothing unpicklable has to
+    cross the process boundary. Gzip uploads are decompressed as they are
+    parsed, within the (size, ratio) limits.
+
+    Returns
+    -------
+    afids : model_auto.AfidsSet or None
+        The parsed AFIDs, or None if the file is invalid.
+    result : dict
+        The JSON response body.
+    """
+    try:
+        afids = parse_upload(
+            io.BytesIO(data), filename, protocol, content_encoding, *limits
+        )
+    except InvalidFcsvError as err:
+        return None, {"valid": False, "error": err.message}
+
+    result = {
+        "valid": True,
+        "protocol": afids.protocol.key,
+        "metrics": afids_metrics(afids),
+    }
+    if template_afids is not None:
+        result["distances"] = dict(
+            zip(
+                template_afids.protocol.abbrevs,
+                [
+                    round(float(diff), 5)
+                    for diff in afids.distances_to(template_afids)
+                ],
+            )
+        )
+        if plots:
+            result["figures"] = {
+                "scatter": generate_3d_scatter(template_afids, afids),
+                "histogram": generate_histogram(template_afids, afids),
+            }
+
+    return afids, result
+
+
+def store_upload(afids, template, filename):
+    """Store a validated set, in a database thread."""
+    with flask_app.app_context():
+        try:
+            columns = FiducialSet.columns_from_afids(
+                afids, template=template, source=filename[:255]
+            )
+            return FiducialSet.insert_new([columns])[0]
+        finally:
+            db.session.remove()
+
+
+def query_sets(args):
+    """Run find_sets, in a database thread."""
+    with flask_app.app_context():
+        try:
+            fiducial_sets, next_after = find_sets(args)
+        finally:
+            db.session.remove()
+
+    return {"sets": fiducial_sets, "after": next_after}
+
+
+async def read_body(receive, max_size):
+    """Read a request body, without blocking a thread while it arrives."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise HTTPError(400, "Client disconnected")
+
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPError(
+                413, "Upload larger than {size} bytes".format(size=max_size)
+            )
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def send_json(send, status, data):
+    """Send a complete JSON response."""
+    body = json.dumps(data).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin1")),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class AsgiApp:
+    """ASGI application sharing the Flask app's configuration and models.
+
+    Attributes:
+        cpu_executor -- executor for parsing and plotting
+        db_executor -- executor for database queries
+        max_upload_size -- largest accepted request body, in bytes
+    """
+
+    def __init__(self, cpu_executor=None, db_executor=None):
+        config = flask_app.config
+        self.cpu_executor = cpu_executor
+        self.db_executor = db_executor
+        self.cpu_workers = config.get("ASGI_CPU_WORKERS")
+        self.db_threads = config.get("ASGI_DB_THREADS", 8)
+        self.max_upload_size = config.get("ASGI_MAX_UPLOAD_SIZE", 1 << 20)
+        self.decompression_limits = (
+            config.get("UPLOAD_MAX_DECOMPRESSED_SIZE", MAX_DECOMPRESSED_SIZE),
+            config.get("UPLOAD_MAX_COMPRESSION_RATIO", MAX_COMPRESSION_RATIO),
+        )
+        self.routes = {
+            ("POST", "/api/validate"): self.validate,
+            ("GET", "/api/sets"): self.sets,
+            ("GET", "/api/templates"): self.templates,
+        }
+
+    def _executors(self):
+        """Create the executors on first use, in the serving process.
+
+        The process pool starts its workers like the figure pool, so
+        they are not forked from this process's threads and event loop.
+        """
+        if self.cpu_executor is None:
+            self.cpu_executor = figure_process_pool(self.cpu_workers)
+        if self.db_executor is None:
+            self.db_executor = concurrent.futures.ThreadPoolExecutor(
+                self.db_threads
+            )
+        return self.cpu_executor, self.db_executor
+
+    def shutdown(self):
+        """Stop the executors."""
+        for executor in (self.cpu_executor, self.db_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        args = {
+            key: values[0]
+            for key, values in urllib.parse.parse_qs(
+                scope.get("query_string", b"").decode("latin1")
+            ).items()
+        }
+        headers = {
+            name.decode("latin1").lower(): value.decode("latin1")
+            for name, value in scope.get("headers", [])
+        }
+        handler = self.routes.get((scope["method"], scope["path"]))
+        try:
+            if handler is None:
+                if any(path == scope["path"] for _, path in self.routes):
+                    raise HTTPError(405, "Method not allowed")
+                raise HTTPError(404, "Not found")
+            status, data = await handler(args, headers, receive)
+        except HTTPError as err:
+            status, data = err.status, {"error": err.message}
+
+        await send_json(send, status, data)
+
+    async def lifespan(self, receive, send):
+        """Start the executors with the server, and stop them with it."""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._executors()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def validate(self, args, headers, receive):
+        """Validate an uploaded file, and compare it to a template."""
+        filename = args.get("filename", "upload.fcsv")
+        if not allowed_file(filename):
+            raise HTTPError(400, "Invalid file: extension not allowed")
+
+        template = args.get("template")
+        template_afids = None
+        if template is not None:
+            template_afids = template_store.get(template)
+            if template_afids is None:
+                raise HTTPError(
+                    400, "Unknown template {name}".format(name=template)
+                )
+
+        # The body is kept compressed; the worker decompresses it as it
+        # parses, so the decompressed file is never held whole
+        body = await read_body(receive, self.max_upload_size)
+        protocol = args.get("protocol", "auto")
+        cpu_executor, db_executor = self._executors()
+        loop = asyncio.get_event_loop()
+        afids, result = await loop.run_in_executor(
+            cpu_executor,
+            validate_upload,
+            body,
+            filename,
+            None if protocol == "auto" else protocol,
+            template_afids,
+            args.get("plots") == "1",
+            headers.get("content-encoding"),
+            self.decompression_limits,
+        )
+        if afids is None:
+            return 422, result
+
+        if args.get("store") == "1" and template is not None:
+            result["stored"] = await loop.run_in_executor(
+                db_executor, store_upload, afids, template, filename
+            )
+
+        return 200, result
+
+    async def sets(self, args, headers, receive):
+        """Query stored sets."""
+        loop = asyncio.get_event_loop()
+        try:
+            result = await loop.run_in_executor(
+                self._executors()[1], query_sets, args
+            )
+        except ValueError as err:
+            raise HTTPError(400, str(err))
+
+        return 200, result
+
+    async def templates(self, args, headers, receive):
+        """List the available templates."""
+        return 200, {"templates": template_store.names()}
+
+
+app = AsgiApp()
@@ -0,0 +1,80 @@
+"""Time the validator's plot stage, serially and on a FigurePool.
+
+Run from the repository root:
+
+    python -m benchmarks.figures --repeat 50
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from model_auto import parse_fcsv
+from visualizations import FigurePool, generate_3d_scatter, generate_histogram
+
+TEMPLATE = "afids-templates/human/sub-MNI2009cAsym_afids.fcsv"
+USER = "test/resources/valid.fcsv"
+
+
+def time_calls(render, repeat):
+    """Median wall-clock seconds of render(), after one warm-up call."""
+    render()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    with open(TEMPLATE, "r") as template_file:
+        ref_afids = parse_fcsv(template_file, "human")
+    with open(USER, "r") as user_file:
+        user_afids = parse_fcsv(user_file)
+
+    calls = (
+        (generate_3d_scatter, ref_afids, user_afids),
+        (generate_histogram, ref_afids, user_afids),
+    )
+    timings = [
+        (
+            call[0].__name__,
+            time_calls(lambda call=call: call[0](*call[1:]), args.repeat),
+        )
+        for call in calls
+    ]
+    timings.append(
+        (
+            "serial",
+            time_calls(
+                lambda: [call[0](*call[1:]) for call in calls], args.repeat
+            ),
+        )
+    )
+
+    pool = FigurePool(args.workers)
+    try:
+        timings.append(
+            (
+                "FigurePool({workers})".format(workers=args.workers),
+                time_calls(lambda: pool.render(*calls), args.repeat),
+            )
+        )
+    finally:
+        pool.shutdown()
+
+    print("{cpus} CPUs".format(cpus=os.cpu_count()))
+    for name, seconds in timings:
+        print("{name:<24} {ms:8.2f} ms".format(name=name, ms=seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
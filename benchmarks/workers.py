@@ -0,0 +1,297 @@
+"""Compare gunicorn worker models under a mix of page views and validations.
+
+Each deployment is started with gunicorn.conf.py against a throwaway SQLite
+database, then loaded by concurrent clients for a fixed time. Throughput,
+latency and the total resident memory of the master, its workers and
+their figure pools are reported. Run from the repository root:
+
+    python -m benchmarks.workers --duration 20 --clients 8
+"""
+
+import argparse
+import concurrent.futures
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+TEMPLATE = "MNI2009cAsym"
+USER = "test/resources/valid.fcsv"
+
+
+def free_port():
+    """A TCP port nothing is listening on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def validation_request(base_url, upload):
+    """A multipart POST of an upload to the validator."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (("fid_template", TEMPLATE), ("protocol", "auto")):
+        parts.append(
+            "--{boundary}\r\n"
+            'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            "{value}\r\n".format(boundary=boundary, name=name, value=value)
+        )
+    parts.append(
+        "--{boundary}\r\n"
+        'Content-Disposition: form-data; name="filename";'
+        ' filename="{filename}"\r\n'
+        "Content-Type: text/csv\r\n\r\n".format(
+            boundary=boundary, filename=os.path.basename(USER)
+        )
+    )
+    body = (
+        "".join(parts).encode("utf-8")
+        + upload
+        + "\r\n--{boundary}--\r\n".format(boundary=boundary).encode("utf-8")
+    )
+    return urllib.request.Request(
+        base_url + "/validator.html",
+        data=body,
+        headers={
+            "Content-Type": "multipart/form-data; boundary={boundary}".format(
+                boundary=boundary
+            )
+        },
+    )
+
+
+def descendants(pid):
+    """Ids of a process and all of its descendants."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{pid}/stat".format(pid=entry), "r") as stat:
+                # The command name is in parentheses and may contain spaces
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids = [pid]
+    for parent in pids:
+        pids.extend(children.get(parent, []))
+    return pids
+
+
+def rss_kib(pid):
+    """Total resident memory of a process tree, in KiB."""
+    total = 0
+    for child in descendants(pid):
+        try:
+            with open("/proc/{pid}/status".format(pid=child), "r") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total
+
+
+def wait_ready(base_url, server, timeout=60):
+    """Wait until the server answers, or raise RuntimeError."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            urllib.request.urlopen(base_url + "/", timeout=1).read()
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not start")
+
+
+def run_load(base_url, upload, clients, duration, validate_share):
+    """Send requests from concurrent clients for duration seconds.
+
+    Returns the latencies of successful requests, in seconds, by kind,
+    and the number of failed requests.
+    """
+    latencies = {"page": [], "validate": []}
+    failures = [0]
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client(index):
+        sent = 0
+        while time.monotonic() < stop:
+            # Spread validations evenly over every client's requests
+            validate = (sent * validate_share + index / clients) % 1 < (
+                validate_share
+            )
+            sent += 1
+            kind = "validate" if validate else "page"
+            request = (
+                validation_request(base_url, upload)
+                if validate
+                else base_url + "/"
+            )
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(request, timeout=60).read()
+            except (urllib.error.URLError, OSError):
+                with lock:
+                    failures[0] += 1
+                continue
+            with lock:
+                latencies[kind].append(time.perf_counter() - start)
+
+    with concurrent.futures.ThreadPoolExecutor(clients) as executor:
+        list(executor.map(client, range(clients)))
+
+    return latencies, failures[0]
+
+
+def benchmark(name, settings, args, env, upload):
+    """Start one deployment, load it and print a line of results."""
+    port = free_port()
+    base_url = "http://127.0.0.1:{port}".format(port=port)
+    env = dict(env, PORT=str(port), **settings)
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            "gunicorn.conf.py",
+            "controller:app",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(base_url, server)
+        # Warm up every worker's caches and figure pool
+        run_load(base_url, upload, args.clients, 2, args.validate_share)
+
+        peak = [rss_kib(server.pid)]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(0.5):
+                peak[0] = max(peak[0], rss_kib(server.pid))
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        try:
+            latencies, failures = run_load(
+                base_url,
+                upload,
+                args.clients,
+                args.duration,
+                args.validate_share,
+            )
+        finally:
+            done.set()
+            sampler.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    num_requests = sum(len(kind) for kind in latencies.values())
+    print(
+        "{name:<22} {rps:8.1f} {page:9.1f} {validate:9.1f} {failures:6d}"
+        " {rss:9.1f}".format(
+            name=name,
+            rps=num_requests / args.duration,
+            page=statistics.median(latencies["page"] or [0]) * 1000,
+            validate=statistics.median(latencies["validate"] or [0]) * 1000,
+            failures=failures,
+            rss=peak[0] / 1024,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument(
+        "--validate-share",
+        type=float,
+        default=0.25,
+        help="share of requests that are validations",
+    )
+    args = parser.parse_args()
+
+    with open(USER, "rb") as user_file:
+        upload = user_file.read()
+
+    db_dir = tempfile.mkdtemp()
+    env = dict(
+        os.environ,
+        APP_SETTINGS="config.ProductionConfig",
+        DATABASE_URL="sqlite:///" + os.path.join(db_dir, "benchmark.db"),
+    )
+    try:
+        subprocess.check_call(
+            [
+                sys.executable,
+                "-c",
+                "import controller; controller.db.create_all()",
+            ],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+
+        # The same number of request threads, in processes or threads
+        total = args.workers * args.threads
+        deployments = [
+            ("sync", args.workers, 1),
+            ("sync", total, 1),
+            ("gthread", 1, total),
+            ("gthread", args.workers, args.threads),
+        ]
+
+        print(
+            "{cpus} CPUs, {clients} clients, {share:.0%} validations".format(
+                cpus=os.cpu_count(),
+                clients=args.clients,
+                share=args.validate_share,
+            )
+        )
+        print(
+            "{0:<22} {1:>8} {2:>9} {3:>9} {4:>6} {5:>9}".format(
+                "deployment",
+                "req/s",
+                "page ms",
+                "valid ms",
+                "failed",
+                "RSS MiB",
+            )
+        )
+        for worker_class, workers, threads in deployments:
+            name = "{worker_class} {workers}x{threads}".format(
+                worker_class=worker_class, workers=workers, threads=threads
+            )
+            settings = {
+                "GUNICORN_WORKER_CLASS": worker_class,
+                "WEB_CONCURRENCY": str(workers),
+                "GUNICORN_THREADS": str(threads),
+            }
+            benchmark(name, settings, args, env, upload)
+    finally:
+        shutil.rmtree(db_dir, True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Bulk import of AFIDs files into the database."""
+
+import io
+import multiprocessing
+import os
+import tarfile
+import zipfile
+
+from compression import DecompressionError, gzip_text_reader
+from controller import db, FiducialSet
+from model_auto import InvalidFcsvError, iter_long_csv, parse_upload
+
+FCSV_EXTENSIONS = (".fcsv", ".csv", ".mrk.json")
+
+
+def _is_fcsv(name):
+    """Does name look like an AFIDs file, possibly gzip-compressed?"""
+    name = name.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return name.endswith(FCSV_EXTENSIONS)
+
+
+def iter_sources(source):
+    """Yield (name, path, data) for each AFIDs file in a source.
+
+    Parameters
+    ----------
+    source : str
+        A directory (searched recursively), or a zip or tar archive.
+
+    Yields
+    ------
+    name : str
+        The file's path, relative to the source.
+    path : str or None
+        The file's path on disk, for directory sources.
+    data : bytes or None
+        The file's content, for archive sources.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if _is_fcsv(name):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, source), path, None
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and _is_fcsv(info.filename):
+                    yield info.filename, None, archive.read(info)
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            for member in archive:
+                if member.isfile() and _is_fcsv(member.name):
+                    yield member.name, None, archive.extractfile(member).read()
+    else:
+        raise ValueError(
+            "{source} is not a directory or archive".format(source=source)
+        )
+
+
+def parse_source(item, protocol=None):
+    """Parse one AFIDs file, without raising on invalid content.
+
+    Returns
+    -------
+    name : str
+        The file's name.
+    afids : model_auto.AfidsSet or None
+        The parsed AFIDs, or None if the file is invalid.
+    error : str or None
+        Why the file is invalid, or None if it is valid.
+    """
+    name, path, data = item
+    try:
+        if path is not None:
+            with open(path, "rb") as in_file:
+                afids = parse_upload(in_file, name, protocol)
+        else:
+            afids = parse_upload(io.BytesIO(data), name, protocol)
+    except InvalidFcsvError as err:
+        return name, None, err.message
+    except OSError as err:
+        return name, None, str(err)
+
+    return name, afids, None
+
+
+def _parse_source_star(args):
+    """Unpack arguments for parse_source in a process pool."""
+    return parse_source(*args)
+
+
+def insert_batch(batch):
+    """Insert (name, columns) pairs, returning the names of duplicates."""
+    if not batch:
+        return []
+
+    inserted = FiducialSet.insert_new([columns for _, columns in batch])
+    return [name for (name, _), is_new in zip(batch, inserted) if not is_new]
+
+
+def store_sets(results, batch_size=1000, progress=None):
+    """Store valid parse results in batches, collecting the rejected ones.
+
+    Parameters
+    ----------
+    results : iterable of tuple
+        (name, afids, error) tuples, as from parse_source.
+    batch_size : int, optional
+        Number of sets to insert per statement.
+    progress : callable, optional
+        Called after each batch with a dict of counts so far.
+
+    Returns
+    -------
+    num_imported : int
+        Number of sets stored.
+    rejected : list of tuple of str
+        (name, reason) for every invalid or already stored result.
+    """
+    num_imported = 0
+    rejected = []
+    batch = []
+
+    def flush():
+        duplicates = insert_batch(batch)
+        rejected.extend(
+            (name, "Duplicate of a stored set") for name in duplicates
+        )
+        return len(batch) - len(duplicates)
+
+    for name, afids, error in results:
+        if error is not None:
+            rejected.append((name, error))
+            continue
+
+        batch.append(
+            (name, FiducialSet.columns_from_afids(afids, source=name[:255]))
+        )
+        if len(batch) >= batch_size:
+            num_imported += flush()
+            batch = []
+            if progress is not None:
+                progress(
+                    {
+                        "num_imported": num_imported,
+                        "num_rejected": len(rejected),
+                    }
+                )
+
+    num_imported += flush()
+
+    return num_imported, rejected
+
+
+def is_long_csv(source):
+    """Is a source a single long-format csv, rather than many files?"""
+    return source.lower().endswith((".csv", ".csv.gz")) and os.path.isfile(
+        source
+    )
+
+
+def iter_long_csv_results(path, protocol=None, name=None):
+    """Yield (name, afids, error) for every subject in a long-format csv.
+
+    The file is streamed in a single pass, see model_auto.iter_long_csv,
+    and decompressed as it is read if it is gzipped. Results are named
+    ``<name>:<subject>``, where name is the file's path unless given; a
+    file that is not a valid long-format csv, or not valid gzip data,
+    gives an error named after the file.
+    """
+    if name is None:
+        name = path
+    with open(path, "rb") as in_file:
+        if path.lower().endswith(".gz"):
+            # Cohorts can be large, so only the ratio is limited
+            in_csv = gzip_text_reader(in_file, max_size=None)
+        else:
+            in_csv = io.TextIOWrapper(in_file, encoding="utf-8", newline="")
+        try:
+            for subject, afids, error in iter_long_csv(in_csv, protocol):
+                yield (
+                    "{name}:{subject}".format(name=name, subject=subject),
+                    afids,
+                    error,
+                )
+        except InvalidFcsvError as err:
+            yield name, None, err.message
+        except DecompressionError as err:
+            yield name, None, err.message
+
+
+def iter_results(source, protocol=None, pool=None, name=None):
+    """Yield (name, afids, error) for every AFIDs set in a source.
+
+    Parameters
+    ----------
+    source : str
+        A directory, a zip or tar archive of AFIDs files, or a
+        long-format csv.
+    protocol : str, optional
+        Protocol key to validate against; detected per file if None.
+    pool : multiprocessing.Pool, optional
+        Pool to parse files across; files are parsed in this process if
+        None. Long-format csvs are always streamed in this process.
+    name : str, optional
+        Name of a long-format csv in result names, instead of its path.
+    """
+    if is_long_csv(source):
+        return iter_long_csv_results(source, protocol, name)
+
+    tasks = ((item, protocol) for item in iter_sources(source))
+    if pool is None:
+        return map(_parse_source_star, tasks)
+    return pool.imap_unordered(_parse_source_star, tasks, chunksize=64)
+
+
+def import_fcsv(
+    source,
+    batch_size=1000,
+    jobs=None,
+    protocol=None,
+    progress=None,
+    name=None,
+):
+    """Validate every AFIDs set in a source, and store the valid ones.
+
+    Files are parsed across a process pool, and valid sets are inserted
+    in batches of multi-row inserts rather than one commit per set. A
+    source that is a single csv file is read as a long-format,
+    multi-subject file instead.
+
+    Parameters
+    ----------
+    source : str
+        A directory, a zip or tar archive of AFIDs files, or a
+        long-format csv.
+    batch_size : int, optional
+        Number of sets to insert per statement.
+    jobs : int, optional
+        Number of parser processes; defaults to the number of CPUs. With
+        1, files are parsed in this process.
+    protocol : str, optional
+        Protocol key to validate against; detected per file if None.
+    progress : callable, optional
+        Called after each batch with a dict of counts so far.
+    name : str, optional
+        Name of a long-format csv in result names, instead of its path.
+
+    Returns
+    -------
+    num_imported : int
+        Number of sets stored.
+    rejected : list of tuple of str
+        (name, reason) for every invalid file or subject.
+    """
+    if jobs == 1 or is_long_csv(source):
+        return store_sets(
+            iter_results(source, protocol, name=name), batch_size, progress
+        )
+
+    with multiprocessing.Pool(jobs) as pool:
+        return store_sets(
+            iter_results(source, protocol, pool), batch_size, progress
+        )
@@ -0,0 +1,220 @@
+"""Gzip compression of text responses, and decompression of uploads."""
+
+import gzip
+import io
+import zlib
+
+from flask import current_app, request
+from werkzeug.wsgi import LimitedStream
+
+# Decompressed uploads may be at most this large, and at most this many
+# times larger than the compressed data read so far. AFIDs files compress
+# about tenfold; decompression bombs, a thousandfold.
+MAX_DECOMPRESSED_SIZE = 16 << 20
+MAX_COMPRESSION_RATIO = 100
+
+COMPRESSIBLE_MIMETYPES = set(
+    [
+        "text/html",
+        "text/css",
+        "text/plain",
+        "text/csv",
+        "application/javascript",
+        "application/json",
+    ]
+)
+
+
+def accepts_gzip():
+    """Does the client accept gzip-encoded responses?"""
+    return "gzip" in request.headers.get("Accept-Encoding", "").lower()
+
+
+def gzip_bytes(data, level=6):
+    """Gzip a byte string with a fixed mtime, so output is reproducible."""
+    # gzip.compress only takes an mtime from Python 3.8
+    buf = io.BytesIO()
+    with gzip.GzipFile(
+        fileobj=buf, mode="wb", compresslevel=level, mtime=0
+    ) as gzip_file:
+        gzip_file.write(data)
+    return buf.getvalue()
+
+
+def compress_response(response):
+    """Gzip a response body, if the client and the response allow it.
+
+    Meant to be registered with ``app.after_request``.
+    """
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or not 200 <= response.status_code < 300
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or not accepts_gzip()
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < current_app.config.get("COMPRESS_MIN_SIZE", 500):
+        return response
+
+    response.set_data(
+        gzip_bytes(data, current_app.config.get("COMPRESS_LEVEL", 6))
+    )
+    response.headers["Content-Encoding"] = "gzip"
+
+    return response
+
+
+class DecompressionError(Exception):
+    """Exception raised when gzip data cannot be decompressed.
+
+    Attributes:
+        message -- explanation of the error
+        too_large -- whether the data was rejected by the size guard
+    """
+
+    def __init__(self, message, too_large=False):
+        Exception.__init__(self)
+        self.message = message
+        self.too_large = too_large
+
+
+class GzipReader(io.RawIOBase):
+    """Decompress a gzip stream as it is read, guarding against bombs.
+
+    Compressed data is read ``chunk_size`` bytes at a time and output is
+    produced no faster than it is consumed, so neither is ever held in
+    memory whole. Reading fails with DecompressionError once the output
+    exceeds ``max_size`` bytes, or ``max_ratio`` times the compressed
+    bytes read so far; either guard is off if None.
+    """
+
+    def __init__(
+        self,
+        source,
+        max_size=MAX_DECOMPRESSED_SIZE,
+        max_ratio=MAX_COMPRESSION_RATIO,
+        chunk_size=16 << 10,
+    ):
+        io.RawIOBase.__init__(self)
+        self.source = source
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.chunk_size = chunk_size
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._pending = b""
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _read_source(self):
+        chunk = self.source.read(self.chunk_size)
+        self.bytes_in += len(chunk)
+        return chunk
+
+    def readinto(self, buffer):
+        while not self._eof:
+            if not self._pending:
+                self._pending = self._read_source()
+                if not self._pending:
+                    raise DecompressionError("Truncated gzip data")
+
+            try:
+                data = self._decompressor.decompress(
+                    self._pending, len(buffer)
+                )
+            except zlib.error as err:
+                raise DecompressionError("Invalid gzip data") from err
+            self._pending = self._decompressor.unconsumed_tail
+
+            if self._decompressor.eof:
+                # Another gzip member may follow
+                self._pending = (
+                    self._decompressor.unused_data or self._read_source()
+                )
+                if self._pending:
+                    self._decompressor = zlib.decompressobj(
+                        16 + zlib.MAX_WBITS
+                    )
+                else:
+                    self._eof = True
+
+            if data:
+                self._check(len(data))
+                buffer[: len(data)] = data
+                return len(data)
+
+        return 0
+
+    def _check(self, num_bytes):
+        """Count decompressed bytes, failing if a guard is exceeded."""
+        self.bytes_out += num_bytes
+        if self.max_size is not None and self.bytes_out > self.max_size:
+            raise DecompressionError(
+                "Decompressed upload larger than {max_size} bytes".format(
+                    max_size=self.max_size
+                ),
+                too_large=True,
+            )
+        if (
+            self.max_ratio is not None
+            and self.bytes_out > self.max_ratio * self.bytes_in
+        ):
+            raise DecompressionError(
+                "Upload compressed more than {max_ratio} times".format(
+                    max_ratio=self.max_ratio
+                ),
+                too_large=True,
+            )
+
+
+def gzip_text_reader(
+    source, max_size=MAX_DECOMPRESSED_SIZE, max_ratio=MAX_COMPRESSION_RATIO
+):
+    """Read a binary gzip stream as UTF-8 text, decompressing as it goes."""
+    return io.TextIOWrapper(
+        io.BufferedReader(GzipReader(source, max_size, max_ratio)),
+        encoding="utf-8",
+        newline="",
+    )
+
+
+class DecompressRequests:
+    """WSGI middleware decoding request bodies sent gzip-encoded.
+
+    Requests with ``Content-Encoding: gzip`` reach the app with the
+    decompressed body, which is decoded as the app reads it.
+    """
+
+    def __init__(
+        self,
+        wsgi_app,
+        max_size=MAX_DECOMPRESSED_SIZE,
+        max_ratio=MAX_COMPRESSION_RATIO,
+    ):
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "")
+        if encoding.strip().lower() == "gzip":
+            source = environ["wsgi.input"]
+            content_length = environ.pop("CONTENT_LENGTH", "")
+            if content_length.isdigit():
+                # Never read past the body, into the next request
+                source = LimitedStream(source, int(content_length))
+            environ["wsgi.input"] = io.BufferedReader(
+                GzipReader(source, self.max_size, self.max_ratio)
+            )
+            environ["wsgi.input_terminated"] = True
+            del environ["HTTP_CONTENT_ENCODING"]
+
+        return self.wsgi_app(environ, start_response)
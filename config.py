@@ -1,6 +1,7 @@
 """Configuration classes for flask/heroku."""
 
 import os
+import tempfile
 
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -10,8 +11,71 @@ class Config:
     DEBUG = False
     TESTING = False
     CSRF_ENABLED = True
-    SECRET_KEY = "this-really-needs-to-be-changed"
-    SQLALCHEMY_DATABASE_URI = os.environ["DATABASE_URL"]
+    SECRET_KEY = os.environ.get(
+        "SECRET_KEY", "this-really-needs-to-be-changed"
+    )
+    # Required in deployments: Postgres, or a sqlite:/// URL on a single
+    # node with a persistent disk
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
+    # Seconds a SQLite connection waits for another process's write
+    SQLITE_BUSY_TIMEOUT = 30
+
+    # Per-request profiling, enabled by sending PROFILE_HEADER
+    PROFILING_ENABLED = False
+    PROFILE_HEADER = "X-AFIDs-Profile"
+    PROFILE_DIR = os.path.join(basedir, "profiles")
+    PROFILE_TOP = 25
+
+    # Gzip text responses larger than COMPRESS_MIN_SIZE bytes
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+
+    # Static files are linked by content hash; set ASSET_URL_PREFIX to the
+    # URL of a CDN mirroring /assets to serve them from there instead
+    ASSET_URL_PREFIX = os.environ.get("ASSET_URL_PREFIX")
+
+    # Rendered GET pages are cached; their files are re-checked this often
+    PAGE_CACHE_ENABLED = True
+    PAGE_CACHE_CHECK_INTERVAL = 2.0
+
+    # Processes per worker rendering the validator's figures in parallel;
+    # 0 renders them one after the other in the request thread
+    FIGURE_WORKERS = 2
+
+    # Reference templates are re-checked for changes this often
+    TEMPLATE_CHECK_INTERVAL = 2.0
+
+    # Admission control for validations, per worker. Requests wait at most
+    # VALIDATION_QUEUE_TIMEOUT seconds for a slot, and plots are skipped if
+    # less than VALIDATION_PLOT_BUDGET of the VALIDATION_DEADLINE remains.
+    VALIDATION_MAX_INFLIGHT = 2
+    VALIDATION_QUEUE_TIMEOUT = 2.0
+    VALIDATION_DEADLINE = 20.0
+    VALIDATION_PLOT_BUDGET = 2.0
+    VALIDATION_RETRY_AFTER = 5
+
+    # Gzip-compressed uploads may decompress to at most this many bytes,
+    # and this many times their compressed size
+    UPLOAD_MAX_DECOMPRESSED_SIZE = 16 << 20
+    UPLOAD_MAX_COMPRESSION_RATIO = 100
+
+    # ASGI entry point (asgi.py): parser processes (None for one per CPU),
+    # database threads, and largest accepted upload in bytes
+    ASGI_CPU_WORKERS = None
+    ASGI_DB_THREADS = 8
+    ASGI_MAX_UPLOAD_SIZE = 1 << 20
+
+    # Queue and uploads shared by the web and `python manage.py worker`
+    # processes, which must run on the same host
+    JOB_QUEUE_PATH = os.environ.get(
+        "JOB_QUEUE_PATH", os.path.join(basedir, "jobs.sqlite3")
+    )
+    JOB_UPLOAD_DIR = os.environ.get(
+        "JOB_UPLOAD_DIR", os.path.join(basedir, "uploads", "jobs")
+    )
+
+    # Memory-mappable arrays of every stored set, see population.py
+    POPULATION_DIR = os.path.join(basedir, "population")
 
 
 class ProductionConfig(Config):
@@ -21,12 +85,31 @@ class ProductionConfig(Config):
 class StagingConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
+    PROFILING_ENABLED = True
 
 
 class DevelopmentConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
+    PROFILING_ENABLED = True
+    # Without DATABASE_URL, an embedded SQLite file in the repository
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        "DATABASE_URL", "sqlite:///" + os.path.join(basedir, "afids.sqlite3")
+    )
 
 
 class TestingConfig(Config):
     TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get(
+        "DATABASE_URL",
+        "sqlite:///" + os.path.join(tempfile.gettempdir(), "afids-test.db"),
+    )
+    # Jobs submitted by tests stay out of the repository
+    JOB_QUEUE_PATH = os.environ.get(
+        "JOB_QUEUE_PATH",
+        os.path.join(tempfile.gettempdir(), "afids-test-jobs.sqlite3"),
+    )
+    JOB_UPLOAD_DIR = os.environ.get(
+        "JOB_UPLOAD_DIR",
+        os.path.join(tempfile.gettempdir(), "afids-test-jobs"),
+    )
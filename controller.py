@@ -1,25 +1,113 @@
 """Route requests with Flask."""
 
-import os
-import io
+import functools
+import hashlib
 import json
-import math
+import os
+import sqlite3
+import uuid
 from datetime import datetime, timezone
 
-from flask import Flask, render_template, request
+import numpy as np
+from flask import (
+    Flask,
+    abort,
+    g,
+    jsonify,
+    render_template,
+    request,
+    send_file,
+    url_for,
+)
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
 
-from visualizations import generate_3d_scatter, generate_histogram
-from model_auto import Average, csv_to_json, InvalidFcsvError
-
+from admission import AdmissionController, Overloaded, RequestTimer
+from compression import (
+    accepts_gzip,
+    compress_response,
+    DecompressionError,
+    DecompressRequests,
+    gzip_bytes,
+)
+from visualizations import (
+    PLOTLYJS_VERSION,
+    FigurePool,
+    generate_3d_scatter,
+    generate_histogram,
+    plotlyjs_bundle,
+)
+from model_auto import (
+    Average,
+    DEFAULT_PROTOCOL,
+    fcsv_schema,
+    InvalidFcsvError,
+    parse_upload,
+    PROTOCOLS,
+    SCHEMA_VERSION,
+)
+from jobs import JOB_HANDLERS, JobQueue
+from page_cache import PageCache
+from population import AGGREGATES_FILE, AggregatesFile, coordinate_columns
+from profiling import profile_request
+from qc_metrics import afids_metrics
+from static_assets import StaticAssets
+from template_store import TemplateStore
 
 app = Flask(__name__)
 
 app.config.from_object(os.environ["APP_SETTINGS"])
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["DATABASE_URL"]
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+if not app.config["SQLALCHEMY_DATABASE_URI"]:
+    # Never fall back to a file on a deployment's throwaway disk
+    raise RuntimeError(
+        "DATABASE_URL must be set with {settings}".format(
+            settings=os.environ["APP_SETTINGS"]
+        )
+    )
+if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgres"):
+    # Let psycopg2 fold bulk inserts into multi-row VALUES statements
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"executemany_mode": "values"}
+elif app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "connect_args": {
+            "timeout": app.config.get("SQLITE_BUSY_TIMEOUT", 30),
+            # Connections come from the pool, never shared between threads
+            "check_same_thread": False,
+        }
+    }
 db = SQLAlchemy(app)
 
+# Values per IN (...) query; older SQLite builds allow 999 parameters
+SQL_IN_CHUNK_SIZE = 500
+
+# Applied to every new SQLite connection. WAL lets readers run alongside
+# the single writer; with it, NORMAL sync is durable across app crashes.
+# Foreign keys are off by default in SQLite, which would skip the cascade
+# from fid_db to template_distances.
+SQLITE_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("foreign_keys", "ON"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", "-20000"),
+)
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Configure SQLite connections; other databases are left alone."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(
+                "PRAGMA {name}={value}".format(name=name, value=value)
+            )
+        cursor.close()
+
 
 class FiducialSet(db.Model):
     """SQL model for a set of AFIDs."""
@@ -27,6 +115,15 @@ class FiducialSet(db.Model):
     __tablename__ = "fid_db"
 
     id = db.Column(db.Integer, primary_key=True)
+    created = db.Column(
+        db.DateTime(timezone=True),
+        index=True,
+        default=lambda: datetime.now(timezone.utc),
+    )
+    template = db.Column(db.String(64), index=True)
+    protocol = db.Column(db.String(16), index=True)
+    source = db.Column(db.String(255))
+    content_hash = db.Column(db.String(64), unique=True)
     c = [
         "AC",
         "PC",
@@ -70,6 +167,115 @@ class FiducialSet(db.Model):
     def __repr__(self):
         return "<id {}>".format(self.id)
 
+    @classmethod
+    def columns_from_afids(cls, afids, **metadata):
+        """Map a parsed AfidsSet, and any metadata, to column values."""
+        columns = {
+            "created": datetime.now(timezone.utc),
+            "protocol": afids.protocol.key,
+            "content_hash": afids.content_hash(),
+        }
+        columns.update(metadata)
+        for base, coords in zip(cls.c, afids.coords.tolist()):
+            for axis, value in zip(("x", "y", "z"), coords):
+                columns["{base}_{axis}".format(base=base, axis=axis)] = value
+
+        return columns
+
+    @classmethod
+    def coords_from_columns(cls, rows):
+        """Coordinates of column dicts as an (N, 32, 3) array."""
+        return np.array(
+            [
+                [
+                    [
+                        row["{base}_{axis}".format(base=base, axis=axis)]
+                        for axis in ("x", "y", "z")
+                    ]
+                    for base in cls.c
+                ]
+                for row in rows
+            ],
+            dtype=float,
+        ).reshape(-1, len(cls.c), 3)
+
+    @classmethod
+    def ids_by_hash(cls, hashes):
+        """Map the content hashes already stored to their set ids.
+
+        Hashes are looked up in chunks, to stay within SQLite's limit on
+        the number of parameters of a statement.
+        """
+        ids = {}
+        for start in range(0, len(hashes), SQL_IN_CHUNK_SIZE):
+            ids.update(
+                db.session.query(cls.content_hash, cls.id)
+                .filter(
+                    cls.content_hash.in_(
+                        hashes[start : start + SQL_IN_CHUNK_SIZE]
+                    )
+                )
+                .all()
+            )
+        return ids
+
+    @classmethod
+    def insert_new(cls, rows):
+        """Insert column dicts, skipping sets that are already stored.
+
+        Duplicates are found by content hash, through its unique index,
+        and the rest are inserted with a single executemany. Distances of
+        the new sets to every template are stored in the same
+        transaction.
+
+        Returns
+        -------
+        list of bool
+            Whether each row was inserted.
+        """
+        for attempt in range(2):
+            hashes = [row["content_hash"] for row in rows]
+            seen = set(cls.ids_by_hash(hashes))
+            inserted = []
+            new_rows = []
+            for content_hash, row in zip(hashes, rows):
+                inserted.append(content_hash not in seen)
+                if content_hash not in seen:
+                    seen.add(content_hash)
+                    new_rows.append(row)
+
+            try:
+                if new_rows:
+                    db.session.execute(cls.__table__.insert(), new_rows)
+                    ids = cls.ids_by_hash(
+                        [row["content_hash"] for row in new_rows]
+                    )
+                    TemplateDistance.insert_for(
+                        [ids[row["content_hash"]] for row in new_rows],
+                        cls.coords_from_columns(new_rows),
+                        template_store.items(),
+                    )
+                db.session.commit()
+                return inserted
+            except IntegrityError:
+                # Another request stored one of the sets meanwhile
+                db.session.rollback()
+                if attempt:
+                    raise
+
+    def describe(self):
+        """Produce a dict of the metadata and each coordinate column."""
+        described = {
+            "id": self.id,
+            "created": self.created.isoformat() if self.created else None,
+            "template": self.template,
+            "protocol": self.protocol,
+            "source": self.source,
+        }
+        described.update(self.serialize())
+
+        return described
+
     def serialize(self):
         """Produce a dict of each column."""
         serialized = {
@@ -174,23 +380,297 @@ class FiducialSet(db.Model):
         return serialized
 
 
+def float_or_none(value):
+    """A float, or None for NaN, as SQL has no portable NaN."""
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+class TemplateDistance(db.Model):
+    """SQL model for the per-AFID distances of a set to a template.
+
+    Rows are added when sets are stored, and for existing sets when a
+    template is added, by `python manage.py backfill_distances`.
+    """
+
+    __tablename__ = "template_distances"
+
+    set_id = db.Column(
+        db.Integer,
+        db.ForeignKey("fid_db.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    template = db.Column(db.String(64), primary_key=True, index=True)
+    mean_distance = db.Column(db.Float())
+
+    for base in FiducialSet.c:
+        exec("%s = %s" % (base, "db.Column(db.Float())"))
+
+    def __repr__(self):
+        return "<set {} to {}>".format(self.set_id, self.template)
+
+    @classmethod
+    def insert_for(cls, set_ids, coords, templates):
+        """Insert the distances of sets to templates, without committing.
+
+        Parameters
+        ----------
+        set_ids : list of int
+            Ids of the sets.
+        coords : numpy.ndarray, shape (N, 32, 3)
+            Coordinates of the sets.
+        templates : list of tuple
+            (name, model_auto.AfidsSet) of each template.
+        """
+        rows = []
+        for name, template_afids in templates:
+            if template_afids.coords.shape != coords.shape[1:]:
+                continue
+
+            distances = np.sqrt(
+                ((coords - template_afids.coords) ** 2).sum(axis=2)
+            )
+            for set_id, set_distances in zip(set_ids, distances):
+                row = {
+                    "set_id": int(set_id),
+                    "template": name,
+                    "mean_distance": float_or_none(set_distances.mean()),
+                }
+                for base, distance in zip(FiducialSet.c, set_distances):
+                    row[base] = float_or_none(distance)
+                rows.append(row)
+
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def backfill(cls, template, template_afids, batch_size=1000):
+        """Store distances to a template for sets that lack them.
+
+        Sets are read in id order, in batches of their coordinate
+        columns, and each batch is committed.
+
+        Returns
+        -------
+        int
+            Number of sets backfilled.
+        """
+        missing = ~(
+            db.session.query(cls.set_id)
+            .filter(cls.set_id == FiducialSet.id, cls.template == template)
+            .exists()
+        )
+        query = (
+            db.session.query(FiducialSet.id, *coordinate_columns(FiducialSet))
+            .filter(missing)
+            .order_by(FiducialSet.id)
+        )
+
+        num_backfilled = 0
+        last_id = None
+        while True:
+            batch = query
+            if last_id is not None:
+                batch = batch.filter(FiducialSet.id > last_id)
+            rows = batch.limit(batch_size).all()
+            if not rows:
+                break
+
+            cls.insert_for(
+                [row[0] for row in rows],
+                np.array([row[1:] for row in rows], dtype=float).reshape(
+                    -1, len(FiducialSet.c), 3
+                ),
+                [(template, template_afids)],
+            )
+            db.session.commit()
+            num_backfilled += len(rows)
+            last_id = rows[-1][0]
+
+        return num_backfilled
+
+
 # Relative path of directory for uploaded files
 UPLOAD_DIR = "uploads/"
 AFIDS_HUMAN_DIR = "afids-templates/human/"
 
 app.config["UPLOAD_FOLDER"] = UPLOAD_DIR
-app.secret_key = "MySecretKey"
 
-if not os.path.isdir(UPLOAD_DIR):
-    os.mkdir(UPLOAD_DIR)
+# Several workers may start at once
+os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # Allowed file types for file upload
-ALLOWED_EXTENSIONS = set(["fcsv", "csv"])
+ALLOWED_EXTENSIONS = set(["fcsv", "csv", "mrk.json"])
 
 
 def allowed_file(filename):
-    """Does filename have the right extension?"""
-    return "." in filename and filename.rsplit(".", 1)[1] in ALLOWED_EXTENSIONS
+    """Does filename have the right extension, optionally with .gz?"""
+    if filename.lower().endswith(".gz"):
+        filename = filename[:-3]
+    return "." in filename and (
+        filename.rsplit(".", 1)[1] in ALLOWED_EXTENSIONS
+        or ".".join(filename.rsplit(".", 2)[1:]) in ALLOWED_EXTENSIONS
+    )
+
+
+app.after_request(compress_response)
+
+# Request bodies may be sent gzip-encoded, e.g. by sites on slow links
+app.wsgi_app = DecompressRequests(
+    app.wsgi_app,
+    app.config["UPLOAD_MAX_DECOMPRESSED_SIZE"],
+    app.config["UPLOAD_MAX_COMPRESSION_RATIO"],
+)
+# Outermost, so validation deadlines count from when a request came in
+app.wsgi_app = RequestTimer(app.wsgi_app)
+
+
+@app.errorhandler(DecompressionError)
+def undecodable_request(err):
+    """Reject a gzip-encoded request body that cannot be decompressed."""
+    return (
+        err.message,
+        413 if err.too_large else 400,
+        {"Content-Type": "text/plain"},
+    )
+
+
+# Plotly bundles are immutable for a given version, so cache them for a year
+PLOTLYJS_MAX_AGE = 365 * 24 * 60 * 60
+
+
+@functools.lru_cache(maxsize=1)
+def plotlyjs_bundle_gzip():
+    """The Plotly bundle, gzipped once per worker."""
+    return gzip_bytes(plotlyjs_bundle(), 9)
+
+
+@app.context_processor
+def inject_plotlyjs_version():
+    """Make the Plotly bundle version available to every template."""
+    return dict(plotlyjs_version=PLOTLYJS_VERSION)
+
+
+@app.route("/js/plotly-<version>.min.js")
+def plotlyjs(version):
+    """Serve the locally bundled Plotly library, gzipped when possible."""
+    if version != PLOTLYJS_VERSION:
+        abort(404)
+
+    body = plotlyjs_bundle()
+    headers = {
+        "Cache-Control": "public, max-age={max_age}, immutable".format(
+            max_age=PLOTLYJS_MAX_AGE
+        ),
+        "Vary": "Accept-Encoding",
+    }
+    if accepts_gzip():
+        body = plotlyjs_bundle_gzip()
+        headers["Content-Encoding"] = "gzip"
+
+    return app.response_class(
+        body, mimetype="application/javascript", headers=headers
+    )
+
+
+static_assets = StaticAssets(app.static_folder)
+
+
+@app.context_processor
+def inject_asset_url():
+    """Let templates link to static files by their fingerprinted URL."""
+
+    def asset_url(filename):
+        url_name = static_assets.url_name(filename)
+        prefix = app.config.get("ASSET_URL_PREFIX")
+        if prefix:
+            return "{prefix}/{url_name}".format(
+                prefix=prefix.rstrip("/"), url_name=url_name
+            )
+        return url_for("asset", filename=url_name)
+
+    return dict(asset_url=asset_url)
+
+
+@app.route("/assets/<path:filename>")
+def asset(filename):
+    """Serve a static file by its fingerprinted name."""
+    response = static_assets.response(filename)
+    if response is None:
+        abort(404)
+    return response
+
+
+@functools.lru_cache(maxsize=1)
+def fcsv_schema_json():
+    """The fcsv schema as JSON, and its digest, built once per worker."""
+    body = json.dumps(fcsv_schema(), sort_keys=True).encode("utf-8")
+    return body, hashlib.sha256(body).hexdigest()
+
+
+@app.context_processor
+def inject_schema_version():
+    """Let templates link to the fcsv schema of this version."""
+    return dict(schema_version=SCHEMA_VERSION)
+
+
+@app.route("/schema/v<int:version>/fcsv.json")
+def fcsv_schema_route(version):
+    """Serve the structural rules of fcsv files, for the validator page.
+
+    The schema only changes between deployments, so clients revalidate it
+    by its ETag rather than download it again.
+    """
+    if version != SCHEMA_VERSION:
+        abort(404)
+
+    body, digest = fcsv_schema_json()
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(digest)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+page_cache = PageCache(app.config.get("PAGE_CACHE_CHECK_INTERVAL", 2.0))
+
+# Bound concurrent validations per worker, so page views are not starved
+validation_admission = AdmissionController(
+    app.config.get("VALIDATION_MAX_INFLIGHT", 2),
+    app.config.get("VALIDATION_QUEUE_TIMEOUT", 2.0),
+    app.config.get("VALIDATION_DEADLINE", 20.0),
+    app.config.get("VALIDATION_RETRY_AFTER", 5),
+)
+
+
+# Where stored sets placed each AFID, by template and protocol; written by
+# `python manage.py export_population`
+population_aggregates = AggregatesFile(
+    os.path.join(app.config["POPULATION_DIR"], AGGREGATES_FILE)
+)
+
+# The scatter plot and histogram of a validation render side by side
+figure_pool = FigurePool(app.config.get("FIGURE_WORKERS", 2))
+
+
+@app.errorhandler(Overloaded)
+def overloaded(err):
+    """Turn away a request quickly when the server is saturated."""
+    return (
+        "Server busy, please retry in {retry_after} seconds".format(
+            retry_after=err.retry_after
+        ),
+        503,
+        {"Retry-After": str(err.retry_after), "Content-Type": "text/plain"},
+    )
+
+
+@app.route("/status/validation")
+def validation_status():
+    """Report in-flight validations in this worker, for autoscaling."""
+    response = jsonify(validation_admission.stats())
+    response.cache_control.no_store = True
+    return response
 
 
 # Routes to web pages / application
@@ -198,25 +678,40 @@ def allowed_file(filename):
 @app.route("/")
 def index():
     """Render the static index page."""
-    return render_template("index.html")
+    return page_cache.response("index", lambda: render_template("index.html"))
 
 
 # Contact
 @app.route("/contact.html")
 def contact():
     """Render the static contact page."""
-    return render_template("contact.html")
+    return page_cache.response(
+        "contact", lambda: render_template("contact.html")
+    )
 
 
 # Login
 @app.route("/login.html")
 def login():
     """Render the static login page."""
-    return render_template("login.html")
+    return page_cache.response("login", lambda: render_template("login.html"))
+
+
+# Parsed once per worker; files added to the directory appear on their own
+template_store = TemplateStore(
+    AFIDS_HUMAN_DIR, "human", app.config.get("TEMPLATE_CHECK_INTERVAL", 2.0)
+)
+
+
+def list_human_templates():
+    """List the names of the available human templates."""
+    return template_store.names()
 
 
 # Validator
 @app.route("/validator.html", methods=["GET", "POST"])
+@profile_request
+@validation_admission.limit()
 def validator():
     """Present the validator form, or validate an AFIDs set."""
     form = Average(request.form)
@@ -226,29 +721,31 @@ def validator():
     indices = []
     distances = []
     labels = []
-    template_data_j = None
-    human_templates = []
-    for human_dir in os.listdir(AFIDS_HUMAN_DIR):
-        if "sub" in human_dir:
-            human_dir = human_dir[4:]
-
-        human_templates.append(human_dir.split("_")[0])
+    template_afids = None
 
     timestamp = str(
         datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S %Z")
     )
     if not request.method == "POST":
-        return render_template(
-            "validator.html",
-            form=form,
-            result=result,
-            human_templates=human_templates,
-            template_data_j=template_data_j,
-            index=indices,
-            labels=labels,
-            distances=distances,
+        # The form only changes with the templates and the template files
+        return page_cache.response(
+            "validator",
+            lambda: render_template(
+                "validator.html",
+                form=form,
+                result=result,
+                human_templates=list_human_templates(),
+                protocols=PROTOCOLS.values(),
+                template_afids=template_afids,
+                index=indices,
+                labels=labels,
+                distances=distances,
+            ),
+            [AFIDS_HUMAN_DIR],
         )
 
+    human_templates = list_human_templates()
+
     if not request.files:
         result = "<br>".join([result, msg])
 
@@ -257,7 +754,8 @@ def validator():
             form=form,
             result=result,
             human_templates=human_templates,
-            template_data_j=template_data_j,
+            protocols=PROTOCOLS.values(),
+            template_afids=template_afids,
             index=indices,
             labels=labels,
             distances=distances,
@@ -276,15 +774,26 @@ def validator():
             form=form,
             result=result,
             human_templates=human_templates,
-            template_data_j=template_data_j,
+            protocols=PROTOCOLS.values(),
+            template_afids=template_afids,
             index=indices,
             labels=labels,
             distances=distances,
         )
 
+    # An empty or "auto" protocol is detected from the file itself
+    protocol = request.form.get("protocol", "auto")
+    if protocol == "auto":
+        protocol = None
+
     try:
-        user_data = csv_to_json(
-            io.StringIO(upload.stream.read().decode("utf-8"))
+        user_afids = parse_upload(
+            upload.stream,
+            upload.filename,
+            protocol,
+            upload.headers.get("Content-Encoding"),
+            app.config["UPLOAD_MAX_DECOMPRESSED_SIZE"],
+            app.config["UPLOAD_MAX_COMPRESSION_RATIO"],
         )
     except InvalidFcsvError as err:
         result = "Invalid file: {err_msg} ({time_stamp})".format(
@@ -295,19 +804,20 @@ def validator():
             form=form,
             result=result,
             human_templates=human_templates,
-            template_data_j=template_data_j,
+            protocols=PROTOCOLS.values(),
+            template_afids=template_afids,
             index=indices,
             labels=labels,
             distances=distances,
         )
 
-    result = "Valid file ({time_stamp})".format(time_stamp=timestamp)
-    user_data_j = json.loads(user_data)
+    result = "Valid file ({time_stamp})<br>{protocol} protocol".format(
+        time_stamp=timestamp, protocol=user_afids.protocol.name
+    )
 
     fid_template = request.form["fid_template"]
 
     if fid_template == "Validate .fcsv file structure":
-        result = "Valid file  ({time_stamp})".format(time_stamp=timestamp)
         result = "<br>".join([result, msg])
 
         return render_template(
@@ -315,7 +825,8 @@ def validator():
             form=form,
             result=result,
             human_templates=human_templates,
-            template_data_j=template_data_j,
+            protocols=PROTOCOLS.values(),
+            template_afids=template_afids,
             index=indices,
             labels=labels,
             distances=distances,
@@ -324,164 +835,309 @@ def validator():
     msg = fid_template + " selected"
 
     # Need to pull from correct folder when more templates are added
-    if fid_template in human_templates:
-        template_file_path = os.path.join(
-            AFIDS_HUMAN_DIR, "sub-" + str(fid_template) + "_afids.fcsv"
+    template_afids = template_store.get(fid_template)
+    if template_afids is None:
+        result = "<br>".join([result, "Unknown template " + fid_template])
+
+        return render_template(
+            "validator.html",
+            form=form,
+            result=result,
+            human_templates=human_templates,
+            protocols=PROTOCOLS.values(),
+            template_afids=template_afids,
+            index=indices,
+            labels=labels,
+            distances=distances,
         )
 
-    template_file = open(template_file_path, "r")
-
-    template_data = csv_to_json(template_file)
-    template_data_j = json.loads(template_data)
-
-    fiducial_set = FiducialSet(
-        AC_x=user_data_j["1"]["x"],
-        AC_y=user_data_j["1"]["y"],
-        AC_z=user_data_j["1"]["z"],
-        PC_x=user_data_j["2"]["x"],
-        PC_y=user_data_j["2"]["y"],
-        PC_z=user_data_j["2"]["z"],
-        ICS_x=user_data_j["3"]["x"],
-        ICS_y=user_data_j["3"]["y"],
-        ICS_z=user_data_j["3"]["z"],
-        PMJ_x=user_data_j["4"]["x"],
-        PMJ_y=user_data_j["4"]["y"],
-        PMJ_z=user_data_j["4"]["z"],
-        SIPF_x=user_data_j["5"]["x"],
-        SIPF_y=user_data_j["5"]["y"],
-        SIPF_z=user_data_j["5"]["z"],
-        RSLMS_x=user_data_j["6"]["x"],
-        RSLMS_y=user_data_j["6"]["y"],
-        RSLMS_z=user_data_j["6"]["z"],
-        LSLMS_x=user_data_j["7"]["x"],
-        LSLMS_y=user_data_j["7"]["y"],
-        LSLMS_z=user_data_j["7"]["z"],
-        RILMS_x=user_data_j["8"]["x"],
-        RILMS_y=user_data_j["8"]["y"],
-        RILMS_z=user_data_j["8"]["z"],
-        LILMS_x=user_data_j["9"]["x"],
-        LILMS_y=user_data_j["9"]["y"],
-        LILMS_z=user_data_j["9"]["z"],
-        CUL_x=user_data_j["10"]["x"],
-        CUL_y=user_data_j["10"]["y"],
-        CUL_z=user_data_j["10"]["z"],
-        IMS_x=user_data_j["11"]["x"],
-        IMS_y=user_data_j["11"]["y"],
-        IMS_z=user_data_j["11"]["z"],
-        RMB_x=user_data_j["12"]["x"],
-        RMB_y=user_data_j["12"]["y"],
-        RMB_z=user_data_j["12"]["z"],
-        LMB_x=user_data_j["13"]["x"],
-        LMB_y=user_data_j["13"]["y"],
-        LMB_z=user_data_j["13"]["z"],
-        PG_x=user_data_j["14"]["x"],
-        PG_y=user_data_j["14"]["y"],
-        PG_z=user_data_j["14"]["z"],
-        RLVAC_x=user_data_j["15"]["x"],
-        RLVAC_y=user_data_j["15"]["y"],
-        RLVAC_z=user_data_j["15"]["z"],
-        LLVAC_x=user_data_j["16"]["x"],
-        LLVAC_y=user_data_j["16"]["y"],
-        LLVAC_z=user_data_j["16"]["z"],
-        RLVPC_x=user_data_j["17"]["x"],
-        RLVPC_y=user_data_j["17"]["y"],
-        RLVPC_z=user_data_j["17"]["z"],
-        LLVPC_x=user_data_j["18"]["x"],
-        LLVPC_y=user_data_j["18"]["y"],
-        LLVPC_z=user_data_j["18"]["z"],
-        GENU_x=user_data_j["19"]["x"],
-        GENU_y=user_data_j["19"]["y"],
-        GENU_z=user_data_j["19"]["z"],
-        SPLE_x=user_data_j["20"]["x"],
-        SPLE_y=user_data_j["20"]["y"],
-        SPLE_z=user_data_j["20"]["z"],
-        RALTH_x=user_data_j["21"]["x"],
-        RALTH_y=user_data_j["21"]["y"],
-        RALTH_z=user_data_j["21"]["z"],
-        LALTH_x=user_data_j["22"]["x"],
-        LALTH_y=user_data_j["22"]["y"],
-        LALTH_z=user_data_j["22"]["z"],
-        RSAMTH_x=user_data_j["23"]["x"],
-        RSAMTH_y=user_data_j["23"]["y"],
-        RSAMTH_z=user_data_j["23"]["z"],
-        LSAMTH_x=user_data_j["24"]["x"],
-        LSAMTH_y=user_data_j["24"]["y"],
-        LSAMTH_z=user_data_j["24"]["z"],
-        RIAMTH_x=user_data_j["25"]["x"],
-        RIAMTH_y=user_data_j["25"]["y"],
-        RIAMTH_z=user_data_j["25"]["z"],
-        LIAMTH_x=user_data_j["26"]["x"],
-        LIAMTH_y=user_data_j["26"]["y"],
-        LIAMTH_z=user_data_j["26"]["z"],
-        RIGO_x=user_data_j["27"]["x"],
-        RIGO_y=user_data_j["27"]["y"],
-        RIGO_z=user_data_j["27"]["z"],
-        LIGO_x=user_data_j["28"]["x"],
-        LIGO_y=user_data_j["28"]["y"],
-        LIGO_z=user_data_j["28"]["z"],
-        RVOH_x=user_data_j["29"]["x"],
-        RVOH_y=user_data_j["29"]["y"],
-        RVOH_z=user_data_j["29"]["z"],
-        LVOH_x=user_data_j["30"]["x"],
-        LVOH_y=user_data_j["30"]["y"],
-        LVOH_z=user_data_j["30"]["z"],
-        ROSF_x=user_data_j["31"]["x"],
-        ROSF_y=user_data_j["31"]["y"],
-        ROSF_z=user_data_j["31"]["z"],
-        LOSF_x=user_data_j["32"]["x"],
-        LOSF_y=user_data_j["32"]["y"],
-        LOSF_z=user_data_j["32"]["z"],
-    )
     if request.form.get("db_checkbox"):
-        db.session.add(fiducial_set)
-        db.session.commit()
-        print("fiducial set added")
+        columns = FiducialSet.columns_from_afids(
+            user_afids, template=fid_template, source=upload.filename[:255]
+        )
+        if FiducialSet.insert_new([columns])[0]:
+            print("fiducial set added")
+        else:
+            print("fiducial set already stored, not added again")
     else:
         print("DB option unchecked, user data not saved")
 
-    for element in template_data_j:
-        indices.append(int(element) - 1)
-
-        coordinate_name = template_data_j[element]["desc"]
-
-        template_x = float(template_data_j[element]["x"])
-        template_y = float(template_data_j[element]["y"])
-        template_z = float(template_data_j[element]["z"])
-
-        user_x = float(user_data_j[element]["x"])
-        user_y = float(user_data_j[element]["y"])
-        user_z = float(user_data_j[element]["z"])
-
-        diff = math.sqrt(
-            (template_x - user_x) ** 2
-            + (template_y - user_y) ** 2
-            + (template_z - user_z) ** 2
-        )
-        diff = float("{0:.5f}".format(diff))
-
-        labels.append(coordinate_name)
-        distances.append(diff)
+    indices = list(range(len(template_afids)))
+    labels = list(template_afids.descs)
+    distances = [
+        round(float(diff), 5)
+        for diff in user_afids.distances_to(template_afids)
+    ]
 
     result = "<br>".join([result, msg])
+    metrics = afids_metrics(user_afids)
 
-    scatter_html = generate_3d_scatter(template_data_j, user_data_j)
-    histogram_html = generate_histogram(template_data_j, user_data_j)
+    # Plots are optional; skip them rather than overrun the deadline
+    scatter_html = ""
+    histogram_html = ""
+    if g.deadline.remaining() >= app.config.get("VALIDATION_PLOT_BUDGET", 2.0):
+        scatter_html, histogram_html = figure_pool.render(
+            (
+                generate_3d_scatter,
+                template_afids,
+                user_afids,
+                population_aggregates.get(
+                    fid_template, user_afids.protocol.key
+                ),
+            ),
+            (generate_histogram, template_afids, user_afids),
+        )
+    else:
+        result = "<br>".join([result, "Plots skipped: server busy"])
 
     return render_template(
         "validator.html",
         form=form,
         result=result,
         human_templates=human_templates,
-        template_data_j=template_data_j,
+        protocols=PROTOCOLS.values(),
+        template_afids=template_afids,
         index=indices,
         labels=labels,
         distances=distances,
+        metrics=metrics,
         timestamp=timestamp,
         scatter_html=scatter_html,
         histogram_html=histogram_html,
     )
 
 
+# Jobs for sources too large to validate or import within a request
+job_queue = JobQueue(app.config["JOB_QUEUE_PATH"])
+JOB_UPLOAD_DIR = app.config["JOB_UPLOAD_DIR"]
+
+
+def job_error(message, status=400):
+    """Build a JSON error response for the job endpoints."""
+    return jsonify(error=message), status
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """Queue a validation or import of an archive or long-format csv."""
+    kind = request.form.get("kind", "validate")
+    if kind not in JOB_HANDLERS:
+        return job_error("Unknown job kind {kind}".format(kind=kind))
+
+    fid_template = request.form.get("fid_template")
+    if kind == "validate" and fid_template not in list_human_templates():
+        return job_error("Unknown template {name}".format(name=fid_template))
+
+    upload = request.files.get("filename")
+    if not (upload and upload.filename):
+        return job_error("No file uploaded")
+
+    os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+    filename = secure_filename(upload.filename)
+    path = os.path.abspath(
+        os.path.join(
+            JOB_UPLOAD_DIR,
+            "{token}_{name}".format(token=uuid.uuid4().hex, name=filename),
+        )
+    )
+    upload.save(path)
+
+    protocol = request.form.get("protocol", "auto")
+    job_id = job_queue.submit(
+        kind,
+        {
+            "path": path,
+            "filename": filename,
+            "protocol": None if protocol == "auto" else protocol,
+            "template": fid_template,
+        },
+    )
+
+    status_url = url_for("job_status", job_id=job_id)
+    response = jsonify(id=job_id, status_url=status_url)
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return response
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """Report the status, progress and result of a job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return job_error("No such job", 404)
+
+    del job["payload"]
+    if job["status"] == "done" and job["result"].get("result_file"):
+        job["result_url"] = url_for("job_result", job_id=job_id)
+
+    response = jsonify(job)
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    """Download the per-AFID distances written by a validation job."""
+    job = job_queue.get(job_id)
+    if job is None or job["status"] != "done":
+        return job_error("No result for this job", 404)
+
+    result_file = job["result"].get("result_file")
+    if not result_file:
+        return job_error("No result file for this job", 404)
+
+    return send_file(
+        os.path.join(os.path.dirname(job["payload"]["path"]), result_file),
+        mimetype="text/csv",
+        as_attachment=True,
+    )
+
+
+# Largest page of sets returned by /sets
+SETS_PAGE_LIMIT = 1000
+
+
+# Accepted forms of since and until; a date and time may have a UTC
+# offset, "Z" or "+05:00", and is otherwise taken to be in UTC
+ISO_DATETIME_FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+)
+
+
+def parse_iso_datetime(value):
+    """Parse an ISO 8601 date, or date and time, as a UTC datetime.
+
+    The whole value must match one of ISO_DATETIME_FORMATS; otherwise a
+    ValueError is raised.
+    """
+    for date_format in ISO_DATETIME_FORMATS:
+        try:
+            parsed = datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        if parsed.tzinfo is None:
+            return parsed.replace(tzinfo=timezone.utc)
+        return parsed.astimezone(timezone.utc)
+
+    raise ValueError(
+        "{value} is not an ISO 8601 date or time".format(value=value)
+    )
+
+
+def find_sets(args):
+    """Stored sets matching query arguments, filtered through the indexes.
+
+    Filters are template, protocol, since and until (upload time, in
+    UTC). Results are ordered by id and paged with after and limit.
+
+    Parameters
+    ----------
+    args : mapping of str to str
+        The query arguments.
+
+    Returns
+    -------
+    sets : list of dict
+        The matching sets, as from FiducialSet.describe.
+    after : int or None
+        The after argument for the next page, or None on the last page.
+
+    Raises
+    ------
+    ValueError
+        If an argument is malformed.
+    """
+    query = FiducialSet.query
+    for column in ("template", "protocol"):
+        value = args.get(column)
+        if value is not None:
+            query = query.filter(getattr(FiducialSet, column) == value)
+
+    try:
+        if args.get("since") is not None:
+            since = parse_iso_datetime(args["since"])
+            query = query.filter(FiducialSet.created >= since)
+        if args.get("until") is not None:
+            until = parse_iso_datetime(args["until"])
+            query = query.filter(FiducialSet.created < until)
+    except ValueError as err:
+        raise ValueError("since and until must be ISO 8601 dates") from err
+
+    try:
+        if args.get("after") is not None:
+            query = query.filter(FiducialSet.id > int(args["after"]))
+        limit = min(int(args.get("limit", 100)), SETS_PAGE_LIMIT)
+    except ValueError as err:
+        raise ValueError("after and limit must be integers") from err
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    fiducial_sets = query.order_by(FiducialSet.id).limit(limit).all()
+    next_after = fiducial_sets[-1].id if len(fiducial_sets) == limit else None
+
+    return [fset.describe() for fset in fiducial_sets], next_after
+
+
+@app.route("/sets")
+def query_sets():
+    """Stored sets, filtered on their indexed metadata."""
+    try:
+        fiducial_sets, next_after = find_sets(request.args)
+    except ValueError as err:
+        abort(400, str(err))
+
+    return jsonify(sets=fiducial_sets, after=next_after)
+
+
+@app.route("/distances/<template>")
+def template_distances(template):
+    """Per-AFID distance summary of the stored sets to a template.
+
+    Only sets of one protocol are summarized, the protocol argument or
+    else DEFAULT_PROTOCOL; sets stored before protocols were recorded
+    count as DEFAULT_PROTOCOL.
+    """
+    protocol = request.args.get("protocol", DEFAULT_PROTOCOL)
+    if protocol not in PROTOCOLS:
+        abort(400, "Unknown protocol {key}".format(key=protocol))
+
+    columns = [getattr(TemplateDistance, base) for base in FiducialSet.c]
+    summary = (
+        db.session.query(
+            func.count(TemplateDistance.set_id),
+            func.avg(TemplateDistance.mean_distance),
+            *[func.avg(column) for column in columns],
+            *[func.max(column) for column in columns]
+        )
+        .join(FiducialSet, FiducialSet.id == TemplateDistance.set_id)
+        .filter(TemplateDistance.template == template)
+        .filter(
+            func.coalesce(FiducialSet.protocol, DEFAULT_PROTOCOL) == protocol
+        )
+        .one()
+    )
+
+    num_afids = len(FiducialSet.c)
+    return jsonify(
+        template=template,
+        protocol=protocol,
+        count=summary[0],
+        mean_distance=summary[1],
+        afids={
+            base: {
+                "mean": summary[2 + index],
+                "max": summary[2 + num_afids + index],
+            }
+            for index, base in enumerate(FiducialSet.c)
+        },
+    )
+
+
 @app.route("/getall")
 def get_all():
     """Dump all AFIDs sets in the database."""
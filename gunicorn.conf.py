@@ -0,0 +1,19 @@
+"""Gunicorn settings for the web process.
+
+Defaults to threaded workers: requests mostly wait on uploads, the
+database and the figure pool, and a thread costs far less memory than a
+process. Every setting can be overridden from the environment, e.g.
+``GUNICORN_WORKER_CLASS=sync`` to go back to one request per process.
+"""
+
+import os
+
+bind = "0.0.0.0:{port}".format(port=os.environ.get("PORT", "8000"))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+# Validations past VALIDATION_MAX_INFLIGHT per worker wait for a slot, so
+# extra threads mostly serve pages and static files
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+# The app sets up its pools lazily, so each worker builds its own
+preload_app = False
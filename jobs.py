@@ -0,0 +1,360 @@
+"""SQLite-backed queue for long-running validation and import jobs."""
+
+import contextlib
+import csv
+import json
+import logging
+import os
+import sqlite3
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+import zlib
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+
+class JobError(Exception):
+    """Exception raised when a job fails for a reason to show its submitter.
+
+    Attributes:
+        message -- explanation of why the job failed
+    """
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+
+
+class JobQueue:
+    """A durable job queue in a single SQLite file.
+
+    Any number of web and worker processes can share the file; claiming a
+    job is a single write transaction, so each job runs once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """Open a connection per operation, as processes share the file."""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, kind, payload):
+        """Queue a job, returning its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs"
+                " (id, kind, payload, status, created, updated)"
+                " VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now),
+            )
+        return job_id
+
+    def claim(self):
+        """Mark the oldest queued job as running and return it, or None."""
+        with self._connect() as conn:
+            # Take the write lock up front, so two workers cannot both
+            # select the same job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued'"
+                    " ORDER BY created LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'running', updated = ?"
+                        " WHERE id = ?",
+                        (time.time(), row["id"]),
+                    )
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+        if row is None:
+            return None
+
+        return self._to_dict(row, status="running")
+
+    def _update(self, job_id, **columns):
+        """Set columns of a job, refreshing its updated time."""
+        columns["updated"] = time.time()
+        assignments = ", ".join(
+            "{column} = ?".format(column=column) for column in columns
+        )
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET {assignments} WHERE id = ?".format(
+                    assignments=assignments
+                ),
+                list(columns.values()) + [job_id],
+            )
+
+    def report_progress(self, job_id, progress):
+        """Record a running job's progress, as a JSON-serializable dict."""
+        self._update(job_id, progress=json.dumps(progress))
+
+    def complete(self, job_id, result):
+        """Mark a job as done with its result."""
+        self._update(job_id, status="done", result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        """Mark a job as failed with an error message."""
+        self._update(job_id, status="failed", error=error)
+
+    def heartbeat(self, job_id):
+        """Mark a running job as still alive."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET updated = ?"
+                " WHERE id = ? AND status = 'running'",
+                (time.time(), job_id),
+            )
+
+    def requeue_stale(self, timeout):
+        """Requeue running jobs not updated for timeout seconds.
+
+        Recovers jobs whose worker died; workers send a heartbeat while
+        they run a job, so a live job is never requeued. Returns the
+        number requeued.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued'"
+                " WHERE status = 'running' AND updated < ?",
+                (time.time() - timeout,),
+            ).rowcount
+
+    def get(self, job_id):
+        """Return a job as a dict, or None if there is no such job."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._to_dict(row)
+
+    @staticmethod
+    def _to_dict(row, **overrides):
+        """Convert a row to a dict, decoding the JSON columns."""
+        job = dict(row)
+        for column in ("payload", "progress", "result"):
+            if job[column] is not None:
+                job[column] = json.loads(job[column])
+        job.update(overrides)
+        return job
+
+
+def run_worker(
+    queue, handlers, poll_interval=1.0, stale_timeout=600, once=False
+):
+    """Claim and run jobs until interrupted.
+
+    Parameters
+    ----------
+    queue : JobQueue
+        The queue to take jobs from.
+    handlers : dict
+        Map of job kind to a callable taking (queue, job) and returning a
+        JSON-serializable result.
+    poll_interval : float, optional
+        Seconds to sleep when the queue is empty.
+    stale_timeout : float, optional
+        Seconds without a heartbeat after which a running job is
+        requeued; a heartbeat is sent four times as often.
+    once : bool, optional
+        Return as soon as the queue is empty, instead of polling.
+    """
+    while True:
+        queue.requeue_stale(stale_timeout)
+        job = queue.claim()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        handler = handlers.get(job["kind"])
+        if handler is None:
+            queue.fail(
+                job["id"],
+                "Unknown job kind {kind}".format(kind=job["kind"]),
+            )
+            continue
+
+        _run_job(queue, job, handler, stale_timeout / 4)
+
+
+def _run_job(queue, job, handler, heartbeat_interval):
+    """Run a claimed job, sending heartbeats until it completes or fails.
+
+    Only the messages of JobErrors are shown to the submitter; other
+    errors are logged with their traceback.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(heartbeat_interval):
+            try:
+                queue.heartbeat(job["id"])
+            except sqlite3.Error:
+                logger.warning(
+                    "Missed a heartbeat of job {job_id}".format(
+                        job_id=job["id"]
+                    ),
+                    exc_info=True,
+                )
+
+    heart = threading.Thread(target=beat, daemon=True)
+    heart.start()
+    try:
+        result = handler(queue, job)
+    except JobError as err:
+        queue.fail(job["id"], err.message)
+    except Exception:
+        logger.exception(
+            "Job {job_id} ({kind}) failed".format(
+                job_id=job["id"], kind=job["kind"]
+            )
+        )
+        queue.fail(job["id"], "Internal error while running the job")
+    else:
+        queue.complete(job["id"], result)
+    finally:
+        stop.set()
+        heart.join()
+
+
+@contextlib.contextmanager
+def _reading_source():
+    """Report unreadable sources as JobErrors."""
+    try:
+        yield
+    except ValueError as err:
+        # Raised by iter_sources for files that are not archives
+        raise JobError(
+            "The upload is not a zip or tar archive or a long-format csv"
+        ) from err
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, zlib.error) as err:
+        raise JobError("The archive is damaged") from err
+
+
+def _source_name(payload):
+    """Name of a job's upload in its results, which clients see.
+
+    Results show the file name the upload was saved under, not its path
+    on the server.
+    """
+    return payload.get("filename") or os.path.basename(payload["path"])
+
+
+def import_job(queue, job):
+    """Import a directory, archive or long-format csv into the database."""
+    from bulk_import import import_fcsv
+
+    payload = job["payload"]
+    with _reading_source():
+        num_imported, rejected = import_fcsv(
+            payload["path"],
+            protocol=payload.get("protocol"),
+            jobs=1,
+            name=_source_name(payload),
+            progress=lambda progress: queue.report_progress(
+                job["id"], progress
+            ),
+        )
+    return {
+        "num_imported": num_imported,
+        "num_rejected": len(rejected),
+        "rejected": rejected[:100],
+    }
+
+
+def validate_job(queue, job):
+    """Compare every set in a source against a template.
+
+    Per-AFID distances of each valid set are written to a csv next to the
+    uploaded source; the result lists the invalid sets.
+    """
+    from bulk_import import iter_results
+    from controller import template_store
+
+    payload = job["payload"]
+    template_afids = template_store.get(payload["template"])
+    if template_afids is None:
+        raise JobError(
+            "Unknown template {name}".format(name=payload["template"])
+        )
+
+    result_path = payload["path"] + ".distances.csv"
+    num_valid = 0
+    rejected = []
+    with _reading_source(), open(result_path, "w", newline="") as result_file:
+        writer = csv.writer(result_file)
+        writer.writerow(["name"] + list(template_afids.protocol.abbrevs))
+        for name, afids, error in iter_results(
+            payload["path"],
+            payload.get("protocol"),
+            name=_source_name(payload),
+        ):
+            if error is not None:
+                rejected.append((name, error))
+            else:
+                num_valid += 1
+                writer.writerow(
+                    [name]
+                    + [
+                        "{0:.5f}".format(distance)
+                        for distance in afids.distances_to(template_afids)
+                    ]
+                )
+
+            if (num_valid + len(rejected)) % 100 == 0:
+                queue.report_progress(
+                    job["id"],
+                    {"processed": num_valid + len(rejected)},
+                )
+
+    return {
+        "num_valid": num_valid,
+        "num_rejected": len(rejected),
+        "rejected": rejected[:100],
+        "result_file": os.path.basename(result_path),
+    }
+
+
+JOB_HANDLERS = {"import": import_job, "validate": validate_job}
@@ -1,18 +1,147 @@
 """Flask database management script."""
 
+import multiprocessing
 import os
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from controller import app, db
+from bulk_import import import_fcsv
+from controller import (
+    app,
+    db,
+    FiducialSet,
+    population_aggregates,
+    template_store,
+    TemplateDistance,
+)
+from jobs import JOB_HANDLERS, JobQueue, run_worker
+from model_auto import PROTOCOLS
+from population import (
+    aggregate_by_template,
+    AGGREGATES_FILE,
+    export_parquet,
+    PopulationStore,
+    save_aggregates,
+    sync_population,
+)
+from reports import write_reports
 
 app.config.from_object(os.environ["APP_SETTINGS"])
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ["DATABASE_URL"]
 
-migrate = Migrate(app, db)
+# Batch operations rebuild tables on SQLite, which cannot alter them
+migrate = Migrate(app, db, render_as_batch=True)
 manager = Manager(app)
 
 manager.add_command("db", MigrateCommand)
 
+
+@manager.option("source", help="Directory, zip or tar archive of fcsv files")
+@manager.option(
+    "-b", "--batch-size", dest="batch_size", type=int, default=1000
+)
+@manager.option("-j", "--jobs", dest="jobs", type=int, default=None)
+@manager.option("-p", "--protocol", dest="protocol", default=None)
+def import_dir(source, batch_size, jobs, protocol):
+    """Validate and store every AFIDs file in a directory or archive."""
+    num_imported, rejected = import_fcsv(source, batch_size, jobs, protocol)
+    for name, reason in rejected:
+        print("Skipped {name}: {reason}".format(name=name, reason=reason))
+    print(
+        "Imported {num_imported} sets, skipped {num_rejected} files".format(
+            num_imported=num_imported, num_rejected=len(rejected)
+        )
+    )
+
+
+@manager.option("-p", "--parquet", dest="parquet", default=None)
+def export_population(parquet):
+    """Append new sets to the population arrays and update aggregates.
+
+    Also writes the arrays to Parquet, if a path is given.
+    """
+    store = PopulationStore(app.config["POPULATION_DIR"])
+    num_appended = sync_population(store)
+    print(
+        "Appended {num_appended} sets, {num_sets} in {directory}".format(
+            num_appended=num_appended,
+            num_sets=len(store),
+            directory=store.directory,
+        )
+    )
+    save_aggregates(
+        os.path.join(store.directory, AGGREGATES_FILE),
+        aggregate_by_template(),
+    )
+    if parquet:
+        export_parquet(store, parquet, FiducialSet.c)
+        print("Wrote {parquet}".format(parquet=parquet))
+
+
+@manager.option("-t", "--template", dest="template", default=None)
+@manager.option(
+    "-b", "--batch-size", dest="batch_size", type=int, default=1000
+)
+def backfill_distances(template, batch_size):
+    """Store distances to templates for sets stored before they were added."""
+    for name, template_afids in template_store.items():
+        if template is None or name == template:
+            num_backfilled = TemplateDistance.backfill(
+                name, template_afids, batch_size
+            )
+            print(
+                "Backfilled {num_backfilled} sets for {name}".format(
+                    num_backfilled=num_backfilled, name=name
+                )
+            )
+
+
+@manager.option("source", help="Directory, archive or long-format csv")
+@manager.option("out_dir", help="Directory to write the reports to")
+@manager.option("-t", "--template", dest="template", required=True)
+@manager.option("-j", "--jobs", dest="jobs", type=int, default=None)
+@manager.option("-p", "--protocol", dest="protocol", default=None)
+def reports(source, out_dir, template, jobs, protocol):
+    """Write a standalone HTML QC report for every AFIDs set in a source."""
+    template_afids = template_store.get(template)
+    if template_afids is None:
+        print("Unknown template {name}".format(name=template))
+        return
+
+    written, rejected = write_reports(
+        source,
+        out_dir,
+        template,
+        template_afids,
+        {key: population_aggregates.get(template, key) for key in PROTOCOLS},
+        protocol,
+        jobs,
+    )
+    for name, reason in rejected:
+        print("Skipped {name}: {reason}".format(name=name, reason=reason))
+    print(
+        "Wrote {num_reports} reports to {out_dir}".format(
+            num_reports=len(written), out_dir=out_dir
+        )
+    )
+
+
+def _run_worker():
+    """Run one job worker until interrupted."""
+    run_worker(JobQueue(app.config["JOB_QUEUE_PATH"]), JOB_HANDLERS)
+
+
+@manager.option("-n", "--processes", dest="processes", type=int, default=None)
+def worker(processes):
+    """Run job worker processes, one per CPU by default."""
+    workers = [
+        multiprocessing.Process(target=_run_worker)
+        for _ in range(processes or multiprocessing.cpu_count())
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
 if __name__ == "__main__":
     manager.run()
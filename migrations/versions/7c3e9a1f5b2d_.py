@@ -0,0 +1,41 @@
+"""Add indexed metadata to fid_db
+
+Revision ID: 7c3e9a1f5b2d
+Revises: d0a243e71ea2
+Create Date: 2026-10-19 10:12:41.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9a1f5b2d'
+down_revision = 'd0a243e71ea2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('fid_db', sa.Column('created', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('fid_db', sa.Column('template', sa.String(length=64), nullable=True))
+    op.add_column('fid_db', sa.Column('protocol', sa.String(length=16), nullable=True))
+    op.add_column('fid_db', sa.Column('source', sa.String(length=255), nullable=True))
+    op.add_column('fid_db', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_fid_db_created'), 'fid_db', ['created'], unique=False)
+    op.create_index(op.f('ix_fid_db_template'), 'fid_db', ['template'], unique=False)
+    op.create_index(op.f('ix_fid_db_protocol'), 'fid_db', ['protocol'], unique=False)
+    op.create_index(op.f('ix_fid_db_content_hash'), 'fid_db', ['content_hash'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('fid_db', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_fid_db_content_hash'))
+        batch_op.drop_index(batch_op.f('ix_fid_db_protocol'))
+        batch_op.drop_index(batch_op.f('ix_fid_db_template'))
+        batch_op.drop_index(batch_op.f('ix_fid_db_created'))
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('source')
+        batch_op.drop_column('protocol')
+        batch_op.drop_column('template')
+        batch_op.drop_column('created')
@@ -0,0 +1,64 @@
+"""Add template_distances
+
+Revision ID: b41d8e6c2a90
+Revises: 7c3e9a1f5b2d
+Create Date: 2026-10-19 14:37:05.226184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41d8e6c2a90'
+down_revision = '7c3e9a1f5b2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('template_distances',
+    sa.Column('set_id', sa.Integer(), nullable=False),
+    sa.Column('template', sa.String(length=64), nullable=False),
+    sa.Column('mean_distance', sa.Float(), nullable=True),
+    sa.Column('AC', sa.Float(), nullable=True),
+    sa.Column('PC', sa.Float(), nullable=True),
+    sa.Column('ICS', sa.Float(), nullable=True),
+    sa.Column('PMJ', sa.Float(), nullable=True),
+    sa.Column('SIPF', sa.Float(), nullable=True),
+    sa.Column('RSLMS', sa.Float(), nullable=True),
+    sa.Column('LSLMS', sa.Float(), nullable=True),
+    sa.Column('RILMS', sa.Float(), nullable=True),
+    sa.Column('LILMS', sa.Float(), nullable=True),
+    sa.Column('CUL', sa.Float(), nullable=True),
+    sa.Column('IMS', sa.Float(), nullable=True),
+    sa.Column('RMB', sa.Float(), nullable=True),
+    sa.Column('LMB', sa.Float(), nullable=True),
+    sa.Column('PG', sa.Float(), nullable=True),
+    sa.Column('RLVAC', sa.Float(), nullable=True),
+    sa.Column('LLVAC', sa.Float(), nullable=True),
+    sa.Column('RLVPC', sa.Float(), nullable=True),
+    sa.Column('LLVPC', sa.Float(), nullable=True),
+    sa.Column('GENU', sa.Float(), nullable=True),
+    sa.Column('SPLE', sa.Float(), nullable=True),
+    sa.Column('RALTH', sa.Float(), nullable=True),
+    sa.Column('LALTH', sa.Float(), nullable=True),
+    sa.Column('RSAMTH', sa.Float(), nullable=True),
+    sa.Column('LSAMTH', sa.Float(), nullable=True),
+    sa.Column('RIAMTH', sa.Float(), nullable=True),
+    sa.Column('LIAMTH', sa.Float(), nullable=True),
+    sa.Column('RIGO', sa.Float(), nullable=True),
+    sa.Column('LIGO', sa.Float(), nullable=True),
+    sa.Column('RVOH', sa.Float(), nullable=True),
+    sa.Column('LVOH', sa.Float(), nullable=True),
+    sa.Column('ROSF', sa.Float(), nullable=True),
+    sa.Column('LOSF', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['set_id'], ['fid_db.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('set_id', 'template')
+    )
+    op.create_index(op.f('ix_template_distances_template'), 'template_distances', ['template'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_template_distances_template'), table_name='template_distances')
+    op.drop_table('template_distances')
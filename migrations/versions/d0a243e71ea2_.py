@@ -113,94 +113,95 @@ def upgrade():
 
 def downgrade():
     # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_column('fid_db', 'SPLE_z')
-    op.drop_column('fid_db', 'SPLE_y')
-    op.drop_column('fid_db', 'SPLE_x')
-    op.drop_column('fid_db', 'SIPF_z')
-    op.drop_column('fid_db', 'SIPF_y')
-    op.drop_column('fid_db', 'SIPF_x')
-    op.drop_column('fid_db', 'RVOH_z')
-    op.drop_column('fid_db', 'RVOH_y')
-    op.drop_column('fid_db', 'RVOH_x')
-    op.drop_column('fid_db', 'RSLMS_z')
-    op.drop_column('fid_db', 'RSLMS_y')
-    op.drop_column('fid_db', 'RSLMS_x')
-    op.drop_column('fid_db', 'RSAMTH_z')
-    op.drop_column('fid_db', 'RSAMTH_y')
-    op.drop_column('fid_db', 'RSAMTH_x')
-    op.drop_column('fid_db', 'ROSF_z')
-    op.drop_column('fid_db', 'ROSF_y')
-    op.drop_column('fid_db', 'ROSF_x')
-    op.drop_column('fid_db', 'RMB_z')
-    op.drop_column('fid_db', 'RMB_y')
-    op.drop_column('fid_db', 'RMB_x')
-    op.drop_column('fid_db', 'RLVPC_z')
-    op.drop_column('fid_db', 'RLVPC_y')
-    op.drop_column('fid_db', 'RLVPC_x')
-    op.drop_column('fid_db', 'RLVAC_z')
-    op.drop_column('fid_db', 'RLVAC_y')
-    op.drop_column('fid_db', 'RLVAC_x')
-    op.drop_column('fid_db', 'RILMS_z')
-    op.drop_column('fid_db', 'RILMS_y')
-    op.drop_column('fid_db', 'RILMS_x')
-    op.drop_column('fid_db', 'RIGO_z')
-    op.drop_column('fid_db', 'RIGO_y')
-    op.drop_column('fid_db', 'RIGO_x')
-    op.drop_column('fid_db', 'RIAMTH_z')
-    op.drop_column('fid_db', 'RIAMTH_y')
-    op.drop_column('fid_db', 'RIAMTH_x')
-    op.drop_column('fid_db', 'RALTH_z')
-    op.drop_column('fid_db', 'RALTH_y')
-    op.drop_column('fid_db', 'RALTH_x')
-    op.drop_column('fid_db', 'PMJ_z')
-    op.drop_column('fid_db', 'PMJ_y')
-    op.drop_column('fid_db', 'PMJ_x')
-    op.drop_column('fid_db', 'PG_z')
-    op.drop_column('fid_db', 'PG_y')
-    op.drop_column('fid_db', 'PG_x')
-    op.drop_column('fid_db', 'LVOH_z')
-    op.drop_column('fid_db', 'LVOH_y')
-    op.drop_column('fid_db', 'LVOH_x')
-    op.drop_column('fid_db', 'LSLMS_z')
-    op.drop_column('fid_db', 'LSLMS_y')
-    op.drop_column('fid_db', 'LSLMS_x')
-    op.drop_column('fid_db', 'LSAMTH_z')
-    op.drop_column('fid_db', 'LSAMTH_y')
-    op.drop_column('fid_db', 'LSAMTH_x')
-    op.drop_column('fid_db', 'LOSF_z')
-    op.drop_column('fid_db', 'LOSF_y')
-    op.drop_column('fid_db', 'LOSF_x')
-    op.drop_column('fid_db', 'LMB_z')
-    op.drop_column('fid_db', 'LMB_y')
-    op.drop_column('fid_db', 'LMB_x')
-    op.drop_column('fid_db', 'LLVPC_z')
-    op.drop_column('fid_db', 'LLVPC_y')
-    op.drop_column('fid_db', 'LLVPC_x')
-    op.drop_column('fid_db', 'LLVAC_z')
-    op.drop_column('fid_db', 'LLVAC_y')
-    op.drop_column('fid_db', 'LLVAC_x')
-    op.drop_column('fid_db', 'LILMS_z')
-    op.drop_column('fid_db', 'LILMS_y')
-    op.drop_column('fid_db', 'LILMS_x')
-    op.drop_column('fid_db', 'LIGO_z')
-    op.drop_column('fid_db', 'LIGO_y')
-    op.drop_column('fid_db', 'LIGO_x')
-    op.drop_column('fid_db', 'LIAMTH_z')
-    op.drop_column('fid_db', 'LIAMTH_y')
-    op.drop_column('fid_db', 'LIAMTH_x')
-    op.drop_column('fid_db', 'LALTH_z')
-    op.drop_column('fid_db', 'LALTH_y')
-    op.drop_column('fid_db', 'LALTH_x')
-    op.drop_column('fid_db', 'IMS_z')
-    op.drop_column('fid_db', 'IMS_y')
-    op.drop_column('fid_db', 'IMS_x')
-    op.drop_column('fid_db', 'ICS_z')
-    op.drop_column('fid_db', 'ICS_y')
-    op.drop_column('fid_db', 'ICS_x')
-    op.drop_column('fid_db', 'GENU_z')
-    op.drop_column('fid_db', 'GENU_y')
-    op.drop_column('fid_db', 'GENU_x')
-    op.drop_column('fid_db', 'CUL_z')
-    op.drop_column('fid_db', 'CUL_y')
-    op.drop_column('fid_db', 'CUL_x')
+    with op.batch_alter_table('fid_db', schema=None) as batch_op:
+        batch_op.drop_column('SPLE_z')
+        batch_op.drop_column('SPLE_y')
+        batch_op.drop_column('SPLE_x')
+        batch_op.drop_column('SIPF_z')
+        batch_op.drop_column('SIPF_y')
+        batch_op.drop_column('SIPF_x')
+        batch_op.drop_column('RVOH_z')
+        batch_op.drop_column('RVOH_y')
+        batch_op.drop_column('RVOH_x')
+        batch_op.drop_column('RSLMS_z')
+        batch_op.drop_column('RSLMS_y')
+        batch_op.drop_column('RSLMS_x')
+        batch_op.drop_column('RSAMTH_z')
+        batch_op.drop_column('RSAMTH_y')
+        batch_op.drop_column('RSAMTH_x')
+        batch_op.drop_column('ROSF_z')
+        batch_op.drop_column('ROSF_y')
+        batch_op.drop_column('ROSF_x')
+        batch_op.drop_column('RMB_z')
+        batch_op.drop_column('RMB_y')
+        batch_op.drop_column('RMB_x')
+        batch_op.drop_column('RLVPC_z')
+        batch_op.drop_column('RLVPC_y')
+        batch_op.drop_column('RLVPC_x')
+        batch_op.drop_column('RLVAC_z')
+        batch_op.drop_column('RLVAC_y')
+        batch_op.drop_column('RLVAC_x')
+        batch_op.drop_column('RILMS_z')
+        batch_op.drop_column('RILMS_y')
+        batch_op.drop_column('RILMS_x')
+        batch_op.drop_column('RIGO_z')
+        batch_op.drop_column('RIGO_y')
+        batch_op.drop_column('RIGO_x')
+        batch_op.drop_column('RIAMTH_z')
+        batch_op.drop_column('RIAMTH_y')
+        batch_op.drop_column('RIAMTH_x')
+        batch_op.drop_column('RALTH_z')
+        batch_op.drop_column('RALTH_y')
+        batch_op.drop_column('RALTH_x')
+        batch_op.drop_column('PMJ_z')
+        batch_op.drop_column('PMJ_y')
+        batch_op.drop_column('PMJ_x')
+        batch_op.drop_column('PG_z')
+        batch_op.drop_column('PG_y')
+        batch_op.drop_column('PG_x')
+        batch_op.drop_column('LVOH_z')
+        batch_op.drop_column('LVOH_y')
+        batch_op.drop_column('LVOH_x')
+        batch_op.drop_column('LSLMS_z')
+        batch_op.drop_column('LSLMS_y')
+        batch_op.drop_column('LSLMS_x')
+        batch_op.drop_column('LSAMTH_z')
+        batch_op.drop_column('LSAMTH_y')
+        batch_op.drop_column('LSAMTH_x')
+        batch_op.drop_column('LOSF_z')
+        batch_op.drop_column('LOSF_y')
+        batch_op.drop_column('LOSF_x')
+        batch_op.drop_column('LMB_z')
+        batch_op.drop_column('LMB_y')
+        batch_op.drop_column('LMB_x')
+        batch_op.drop_column('LLVPC_z')
+        batch_op.drop_column('LLVPC_y')
+        batch_op.drop_column('LLVPC_x')
+        batch_op.drop_column('LLVAC_z')
+        batch_op.drop_column('LLVAC_y')
+        batch_op.drop_column('LLVAC_x')
+        batch_op.drop_column('LILMS_z')
+        batch_op.drop_column('LILMS_y')
+        batch_op.drop_column('LILMS_x')
+        batch_op.drop_column('LIGO_z')
+        batch_op.drop_column('LIGO_y')
+        batch_op.drop_column('LIGO_x')
+        batch_op.drop_column('LIAMTH_z')
+        batch_op.drop_column('LIAMTH_y')
+        batch_op.drop_column('LIAMTH_x')
+        batch_op.drop_column('LALTH_z')
+        batch_op.drop_column('LALTH_y')
+        batch_op.drop_column('LALTH_x')
+        batch_op.drop_column('IMS_z')
+        batch_op.drop_column('IMS_y')
+        batch_op.drop_column('IMS_x')
+        batch_op.drop_column('ICS_z')
+        batch_op.drop_column('ICS_y')
+        batch_op.drop_column('ICS_x')
+        batch_op.drop_column('GENU_z')
+        batch_op.drop_column('GENU_y')
+        batch_op.drop_column('GENU_x')
+        batch_op.drop_column('CUL_z')
+        batch_op.drop_column('CUL_y')
+        batch_op.drop_column('CUL_x')
     # ### end Alembic commands ###
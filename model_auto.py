@@ -1,16 +1,31 @@
 """Utilities for parsing AFIDs files."""
 
 import csv
+import hashlib
+import io
+import itertools
 import json
+import logging
 import math
 import re
 
+import numpy as np
 import wtforms as wtf
 
 from pkg_resources import parse_version
 
-EXPECTED_LABELS = [str(x + 1) for x in range(32)]
-EXPECTED_DESCS = [
+from compression import (
+    DecompressionError,
+    gzip_text_reader,
+    MAX_COMPRESSION_RATIO,
+    MAX_DECOMPRESSED_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Each landmark is listed as its accepted descriptions: the full name
+# first, then any aliases, with the abbreviation last.
+AFIDS_LANDMARKS = [
     ["AC"],
     ["PC"],
     ["infracollicular sulcus", "ICS"],
@@ -36,7 +51,7 @@ EXPECTED_DESCS = [
     ["R superior AM temporal horn", "RSAMTH"],
     ["L superior AM temporal horn", "LSAMTH"],
     ["R inferior AM temporal horn", "RIAMTH"],
-    ["L inferior AM temporal horn", "RIAMTH"],
+    ["L inferior AM temporal horn", "LIAMTH"],
     ["R indusium griseum origin", "RIGO"],
     ["L indusium griseum origin", "LIGO"],
     ["R ventral occipital horn", "RVOH"],
@@ -45,8 +60,122 @@ EXPECTED_DESCS = [
     ["L olfactory sulcal fundus", "LOSF"],
 ]
 
+# Declarative protocol definitions. Each protocol is compiled once, at
+# import, into the lookup tables used while parsing. The AC-PC distance
+# range (in mm) is used to tell apart protocols with the same landmarks.
+PROTOCOL_DEFINITIONS = [
+    {
+        "key": "human",
+        "name": "Human",
+        "landmarks": AFIDS_LANDMARKS,
+        "acpc_range": (18.0, 40.0),
+    },
+    {
+        "key": "nhp",
+        "name": "Non-human primate",
+        "landmarks": AFIDS_LANDMARKS,
+        "acpc_range": (5.0, 18.0),
+    },
+]
+
+
+def normalize_desc(desc):
+    """Normalize a landmark description for comparison."""
+    return " ".join(desc.lower().split())
+
+
+class Protocol:
+    """A landmark protocol compiled into lookup tables.
+
+    Attributes:
+        key -- short identifier of the protocol
+        name -- human-readable name of the protocol
+        labels -- expected row labels, in order
+        descs -- canonical (full) description of each landmark
+        abbrevs -- abbreviation of each landmark
+        num_rows -- expected number of rows
+        canonical -- map of label to canonical description
+        aliases -- map of label to its normalized accepted descriptions
+        acpc_range -- plausible (min, max) AC-PC distance, or None
+    """
+
+    def __init__(self, key, name, landmarks, acpc_range=None):
+        self.key = key
+        self.name = name
+        self.labels = tuple(str(x + 1) for x in range(len(landmarks)))
+        self.descs = tuple(aliases[0] for aliases in landmarks)
+        self.abbrevs = tuple(aliases[-1] for aliases in landmarks)
+        self.num_rows = len(landmarks)
+        self.canonical = dict(zip(self.labels, self.descs))
+        self.aliases = {
+            label: frozenset(normalize_desc(alias) for alias in aliases)
+            for label, aliases in zip(self.labels, landmarks)
+        }
+        self.acpc_range = acpc_range
+
+    def __repr__(self):
+        return "<Protocol {}>".format(self.key)
+
+    def plausible_acpc(self, distance):
+        """Is an AC-PC distance plausible for this protocol?"""
+        if self.acpc_range is None:
+            return True
+        return self.acpc_range[0] <= distance <= self.acpc_range[1]
+
+
+def compile_protocols(definitions):
+    """Compile protocol definitions into protocols and a shared lookup.
+
+    The lookup maps each (label, normalized description) pair to the keys
+    of every protocol accepting it, so a row is checked against all
+    protocols with a single dict lookup.
+    """
+    protocols = {}
+    lookup = {}
+    for definition in definitions:
+        protocol = Protocol(**definition)
+        protocols[protocol.key] = protocol
+        for label, aliases in protocol.aliases.items():
+            for alias in aliases:
+                lookup[(label, alias)] = lookup.get(
+                    (label, alias), frozenset()
+                ) | frozenset([protocol.key])
+
+    return protocols, lookup
+
+
+PROTOCOLS, _DESC_LOOKUP = compile_protocols(PROTOCOL_DEFINITIONS)
+DEFAULT_PROTOCOL = "human"
+
+EXPECTED_LABELS = list(PROTOCOLS[DEFAULT_PROTOCOL].labels)
+EXPECTED_DESCS = [list(aliases) for aliases in AFIDS_LANDMARKS]
 EXPECTED_MAP = dict(zip(EXPECTED_LABELS, EXPECTED_DESCS))
 
+# Structure of Slicer markups fiducial files: a header of three lines, the
+# first giving the file version, then one row per landmark
+FCSV_MIN_VERSION = "4.6"
+FCSV_HEADER_LINES = 3
+# Some fields are irrelevant, but we know they should be there
+FCSV_FIELDS = (
+    "id",
+    "x",
+    "y",
+    "z",
+    "ow",
+    "ox",
+    "oy",
+    "oz",
+    "vis",
+    "sel",
+    "lock",
+    "label",
+    "desc",
+    "associatedNodeID",
+)
+
+# Bumped whenever the layout of fcsv_schema() changes
+SCHEMA_VERSION = 1
+
 
 class Average(wtf.Form):
     """wtforms class for choosing an input file."""
@@ -67,6 +196,157 @@ class InvalidFcsvError(Exception):
         self.message = message
 
 
+class AfidsSet:
+    """A validated set of AFIDs, in protocol order.
+
+    Attributes:
+        protocol -- the Protocol the set was validated against
+        coords -- (num_rows, 3) array of float coordinates
+    """
+
+    __slots__ = ("protocol", "coords")
+
+    def __init__(self, protocol, coords):
+        self.protocol = protocol
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+
+    def __reduce__(self):
+        # Protocols are module-level singletons, so pickle only the key
+        return (_unpickle_afids_set, (self.protocol.key, self.coords))
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __repr__(self):
+        return "<AfidsSet {} ({} AFIDs)>".format(self.protocol.key, len(self))
+
+    @property
+    def labels(self):
+        """Row labels, in order."""
+        return self.protocol.labels
+
+    @property
+    def descs(self):
+        """Canonical description of each AFID, in order."""
+        return self.protocol.descs
+
+    def distances_to(self, other):
+        """Euclidean distance between each pair of corresponding AFIDs."""
+        return np.sqrt(((self.coords - other.coords) ** 2).sum(axis=1))
+
+    def content_hash(self):
+        """SHA-256 of the protocol and coordinates, to spot duplicates."""
+        digest = hashlib.sha256(self.protocol.key.encode("utf-8"))
+        digest.update(np.ascontiguousarray(self.coords, dtype="<f8").tobytes())
+        return digest.hexdigest()
+
+    def to_dict(self):
+        """The set in the csv_to_json layout, with coordinates as strings.
+
+        Each coordinate is the repr of its parsed float, the shortest string
+        that reads back as the same value, rather than the text of the
+        source file: "3" and "3.00" are both written as "3.0".
+        """
+        return {
+            label: {
+                "desc": desc,
+                "x": repr(float(x)),
+                "y": repr(float(y)),
+                "z": repr(float(z)),
+            }
+            for label, desc, (x, y, z) in zip(
+                self.labels, self.descs, self.coords
+            )
+        }
+
+    def to_json(self):
+        """Serialize the set as the JSON string csv_to_json returns."""
+        return json.dumps(
+            self.to_dict(), sort_keys=False, indent=4, separators=(",", ": ")
+        )
+
+
+def _unpickle_afids_set(key, coords):
+    """Rebuild an AfidsSet pickled by AfidsSet.__reduce__."""
+    return AfidsSet(PROTOCOLS[key], coords)
+
+
+def get_protocol(key):
+    """Look up a compiled protocol by its key."""
+    try:
+        return PROTOCOLS[key]
+    except KeyError as no_protocol:
+        raise InvalidFcsvError(
+            "Unknown protocol {key}".format(key=key)
+        ) from no_protocol
+
+
+def _detect_protocol(candidates, coords):
+    """Choose among protocols that accept every row of a file.
+
+    Protocols sharing the same landmarks, like the human and non-human
+    primate ones, are told apart only by the AC-PC distance. A distance
+    that no candidate finds plausible falls back to DEFAULT_PROTOCOL, if
+    it is a candidate, with a warning; otherwise the first candidate, in
+    definition order, wins.
+    """
+    if len(candidates) > 1:
+        acpc = math.sqrt(
+            sum((ac - pc) ** 2 for ac, pc in zip(coords["1"], coords["2"]))
+        )
+        for protocol in candidates:
+            if protocol.plausible_acpc(acpc):
+                return protocol
+
+        fallback = PROTOCOLS[DEFAULT_PROTOCOL]
+        if fallback not in candidates:
+            fallback = candidates[0]
+        logger.warning(
+            "AC-PC distance {acpc:.1f} mm fits no protocol; "
+            "assuming {name}".format(acpc=acpc, name=fallback.name)
+        )
+        return fallback
+
+    return candidates[0]
+
+
+def _initial_candidates(protocol):
+    """Keys of the protocols a file may match, before reading any rows."""
+    if protocol is None:
+        return frozenset(PROTOCOLS)
+    return frozenset([get_protocol(protocol).key])
+
+
+def _match_row(candidates, row_label, row_desc):
+    """Narrow the candidate protocols to those accepting a row."""
+    matches = candidates & _DESC_LOOKUP.get(
+        (row_label, normalize_desc(row_desc)), frozenset()
+    )
+    if not matches:
+        raise InvalidFcsvError(
+            "Row label {row_label} does not ".format(row_label=row_label)
+            + "match row description {row_desc}".format(row_desc=row_desc)
+        )
+
+    return matches
+
+
+def _build_afids_set(candidates, rows):
+    """Build an AfidsSet from validated rows, choosing the protocol."""
+    candidates = [
+        PROTOCOLS[key]
+        for key in PROTOCOLS
+        if key in candidates and PROTOCOLS[key].num_rows == len(rows)
+    ]
+    if not candidates:
+        # Incorrect number of rows
+        raise InvalidFcsvError("Too few rows")
+
+    detected = _detect_protocol(candidates, rows)
+
+    return AfidsSet(detected, [rows[label] for label in detected.labels])
+
+
 def _skip_first(seq, num):
     """ Internal function to skip rows from beginning """
     for i, item in enumerate(seq):
@@ -127,11 +407,18 @@ def parse_fcsv_float(value, field, label):
     return parsed_value
 
 
-def csv_to_json(in_csv):
-    """ Parse .fscv / .csv files and write to json object """
+def parse_fcsv(in_csv, protocol=None):
+    """Parse and validate an .fcsv / .csv file into an AfidsSet.
+
+    protocol is the key of the protocol to validate against; if None, it
+    is detected from the file.
+    """
 
     # Read CSV
-    json_data = {}
+    rows = {}
+
+    candidates = _initial_candidates(protocol)
+    max_rows = max(PROTOCOLS[key].num_rows for key in candidates)
 
     # Assuming versions are always in the form x.y
     parsed_version = None
@@ -142,68 +429,40 @@ def csv_to_json(in_csv):
             "Missing or invalid header in fiducial file"
         ) from no_match
 
-    if parse_version(parsed_version) < parse_version("4.6"):
+    if parse_version(parsed_version) < parse_version(FCSV_MIN_VERSION):
         raise InvalidFcsvError(
             "Markups fiducial file version "
             + "{parsed_version} too low".format(parsed_version=parsed_version)
         )
 
-    in_csv.seek(0, 0)
-
-    # Some fields are irrelevant, but we know they should be there
-    fields = (
-        "id",
-        "x",
-        "y",
-        "z",
-        "ow",
-        "ox",
-        "oy",
-        "oz",
-        "vis",
-        "sel",
-        "lock",
-        "label",
-        "desc",
-        "associatedNodeID",
-    )
-
-    # Read csv file and dump to json object
-    expected_label = 1
-    for row in _skip_first(csv.DictReader(in_csv, fields), 3):
-        if expected_label > 32:
+    # Read csv file and dump to json object. The version line was read
+    # already, so skip the remaining header lines; the file is read once,
+    # front to back, so it may be a stream.
+    num_rows = 0
+    for row in _skip_first(
+        csv.DictReader(in_csv, FCSV_FIELDS), FCSV_HEADER_LINES - 1
+    ):
+        if num_rows >= max_rows:
             raise InvalidFcsvError("Too many rows")
 
         row_label = parse_fcsv_field(row, "label")
 
-        expected_label += 1
+        num_rows += 1
         row_desc = parse_fcsv_field(row, "desc", row_label)
-        if not any(
-            x.lower() == row_desc.lower() for x in EXPECTED_MAP[row_label]
-        ):
-            raise InvalidFcsvError(
-                "Row label {row_label} does not ".format(row_label=row_label)
-                + "match row description {row_desc}".format(row_desc=row_desc)
-            )
-
-        # Ensure the full FID name is used
-        row_desc = EXPECTED_MAP[row_label][0]
+        candidates = _match_row(candidates, row_label, row_desc)
 
         row_x = parse_fcsv_field(row, "x", row_label, parsed_version)
-        parse_fcsv_float(row_x, "x", row_label)
+        row_x = parse_fcsv_float(row_x, "x", row_label)
         row_y = parse_fcsv_field(row, "y", row_label, parsed_version)
-        parse_fcsv_float(row_y, "y", row_label)
+        row_y = parse_fcsv_float(row_y, "y", row_label)
         row_z = parse_fcsv_field(row, "z", row_label, parsed_version)
-        parse_fcsv_float(row_z, "z", row_label)
+        row_z = parse_fcsv_float(row_z, "z", row_label)
 
-        missing_fields = 0
-        for value in row.values():
-            if value is None:
-                # The fcsv is missing values
-                missing_fields += 1
-
-        num_columns = len(row) - missing_fields
-        if num_columns != 14:
+        # Missing values are None, extra ones are listed under None
+        num_columns = sum(
+            value is not None for key, value in row.items() if key is not None
+        ) + len(row.get(None, ()))
+        if num_columns != len(FCSV_FIELDS):
             raise InvalidFcsvError(
                 "Incorrect number of columns "
                 "({num_columns}) in row {row_label}".format(
@@ -211,21 +470,267 @@ def csv_to_json(in_csv):
                 )
             )
 
-        json_data[row_label] = {
-            "desc": row_desc,
-            "x": row_x,
-            "y": row_y,
-            "z": row_z,
-        }
+        rows[row_label] = (row_x, row_y, row_z)
 
-    if len(json_data) < 32:
-        # Incorrect number of rows
-        raise InvalidFcsvError("Too few rows")
+    return _build_afids_set(candidates, rows)
 
-    # Sort dict based on fid number
-    json_data = dict(sorted(list(json_data.items()), key=lambda k: int(k[0])))
-    json_data = json.dumps(
-        json_data, sort_keys=False, indent=4, separators=(",", ": ")
-    )
 
-    return json_data
+# Slicer markups coordinate systems, and the sign flip to RAS for each
+MRK_JSON_COORDINATE_SYSTEMS = {"RAS": (1, 1, 1), "LPS": (-1, -1, 1)}
+
+
+def parse_mrk_json(in_json, protocol=None):
+    """Parse and validate a Slicer .mrk.json markups file into an AfidsSet.
+
+    Control points are checked against the protocol like fcsv rows, with
+    the control point label and description standing in for the fcsv
+    label and desc columns.
+    """
+    try:
+        markups = json.load(in_json)["markups"]
+    except (ValueError, KeyError, TypeError) as no_markups:
+        raise InvalidFcsvError(
+            "Missing or invalid markups in markups file"
+        ) from no_markups
+    # Valid JSON may still have any type where an object or list belongs
+    if (
+        not isinstance(markups, list)
+        or not markups
+        or not isinstance(markups[0], dict)
+    ):
+        raise InvalidFcsvError("Missing or invalid markups in markups file")
+    if len(markups) > 1:
+        raise InvalidFcsvError("Markups file has more than one markup")
+    markup = markups[0]
+
+    # The coordinate system applies to the whole file, so resolve it once
+    coordinate_system = markup.get("coordinateSystem", "LPS")
+    try:
+        flip = MRK_JSON_COORDINATE_SYSTEMS[coordinate_system]
+    except (KeyError, TypeError) as bad_system:
+        raise InvalidFcsvError(
+            "Unsupported coordinate system {coordinate_system}".format(
+                coordinate_system=coordinate_system
+            )
+        ) from bad_system
+
+    rows = {}
+    candidates = _initial_candidates(protocol)
+    max_rows = max(PROTOCOLS[key].num_rows for key in candidates)
+    points = markup.get("controlPoints", [])
+    if not isinstance(points, list):
+        raise InvalidFcsvError("Invalid control points in markups file")
+    for num_rows, point in enumerate(points):
+        if num_rows >= max_rows:
+            raise InvalidFcsvError("Too many rows")
+        if not isinstance(point, dict):
+            raise InvalidFcsvError(
+                "Control point {num} is not an object".format(num=num_rows + 1)
+            )
+
+        row_label = point.get("label")
+        if row_label is None:
+            raise InvalidFcsvError("Row has no value label")
+        row_label = str(row_label)
+
+        row_desc = point.get("description")
+        if not isinstance(row_desc, str):
+            raise InvalidFcsvError(
+                "Row {label} has no value desc".format(label=row_label)
+            )
+        candidates = _match_row(candidates, row_label, row_desc)
+
+        position = point.get("position")
+        if not isinstance(position, list) or len(position) != 3:
+            raise InvalidFcsvError(
+                "Row {label} has no valid position".format(label=row_label)
+            )
+
+        rows[row_label] = tuple(
+            sign * parse_fcsv_float(str(value), field, row_label)
+            for sign, value, field in zip(flip, position, ("x", "y", "z"))
+        )
+
+    return _build_afids_set(candidates, rows)
+
+
+# Columns every long-format file must have; any others are ignored
+LONG_CSV_FIELDS = ("subject", "label", "desc", "x", "y", "z")
+
+
+def _parse_long_rows(subject_rows, protocol):
+    """Validate the rows of one subject in a long-format file."""
+    rows = {}
+    candidates = _initial_candidates(protocol)
+    max_rows = max(PROTOCOLS[key].num_rows for key in candidates)
+    for num_rows, row in enumerate(subject_rows):
+        if num_rows >= max_rows:
+            raise InvalidFcsvError("Too many rows")
+
+        row_label = parse_fcsv_field(row, "label")
+        row_desc = parse_fcsv_field(row, "desc", row_label)
+        candidates = _match_row(candidates, row_label, row_desc)
+
+        rows[row_label] = tuple(
+            parse_fcsv_float(
+                parse_fcsv_field(row, field, row_label), field, row_label
+            )
+            for field in ("x", "y", "z")
+        )
+
+    return _build_afids_set(candidates, rows)
+
+
+def iter_long_csv(in_csv, protocol=None):
+    """Stream per-subject AFIDs sets out of a long-format csv.
+
+    The file has a header row naming at least the LONG_CSV_FIELDS columns,
+    then one row per subject per AFID, in RAS coordinates. Each subject's
+    rows must be contiguous. Rows are read in a single pass, holding only
+    the current subject in memory.
+
+    Yields
+    ------
+    subject : str
+        The subject's identifier.
+    afids : AfidsSet or None
+        The subject's AFIDs, or None if they are invalid.
+    error : str or None
+        Why the subject's AFIDs are invalid, or None if they are valid.
+    """
+    reader = csv.DictReader(in_csv)
+    missing = [
+        field
+        for field in LONG_CSV_FIELDS
+        if field not in (reader.fieldnames or [])
+    ]
+    if missing:
+        raise InvalidFcsvError(
+            "Missing columns {missing} in long-format file".format(
+                missing=", ".join(missing)
+            )
+        )
+
+    seen = set()
+    for subject, subject_rows in itertools.groupby(
+        reader, key=lambda row: row["subject"]
+    ):
+        if subject in seen:
+            yield subject, None, (
+                "Rows of subject {subject} are not contiguous".format(
+                    subject=subject
+                )
+            )
+            continue
+        seen.add(subject)
+
+        try:
+            yield subject, _parse_long_rows(subject_rows, protocol), None
+        except InvalidFcsvError as err:
+            yield subject, None, err.message
+
+
+def parse_afids(in_file, filename, protocol=None):
+    """Parse an AFIDs file of any supported format, chosen by filename."""
+    if filename.lower().endswith(".mrk.json"):
+        return parse_mrk_json(in_file, protocol)
+    return parse_fcsv(in_file, protocol)
+
+
+def parse_upload(
+    stream,
+    filename,
+    protocol=None,
+    content_encoding=None,
+    max_size=MAX_DECOMPRESSED_SIZE,
+    max_ratio=MAX_COMPRESSION_RATIO,
+):
+    """Parse an uploaded AFIDs file, which may be gzip-compressed.
+
+    Files named ``*.gz``, or sent with a gzip content encoding, are
+    decompressed as they are parsed, within the given size and ratio
+    limits. Every problem is raised as an InvalidFcsvError.
+
+    Parameters
+    ----------
+    stream : binary file-like
+        The uploaded file.
+    filename : str
+        The file's name; its extension picks the format.
+    protocol : str, optional
+        Protocol key to validate against; detected if None.
+    content_encoding : str, optional
+        The upload's Content-Encoding, if any.
+    max_size, max_ratio : int, optional
+        Limits on the decompressed size, see compression.GzipReader.
+
+    Returns
+    -------
+    AfidsSet
+    """
+    compressed = (content_encoding or "").strip().lower() == "gzip"
+    if filename.lower().endswith(".gz"):
+        filename = filename[:-3]
+        compressed = True
+
+    try:
+        if compressed:
+            in_file = gzip_text_reader(stream, max_size, max_ratio)
+        else:
+            in_file = io.StringIO(stream.read().decode("utf-8"))
+        return parse_afids(in_file, filename, protocol)
+    except DecompressionError as err:
+        raise InvalidFcsvError(err.message) from err
+    except UnicodeDecodeError as err:
+        raise InvalidFcsvError("Not UTF-8 text") from err
+
+
+def fcsv_schema():
+    """The structural rules of fcsv files, as plain data.
+
+    This is what parse_fcsv checks before looking at coordinates: the
+    minimum file version, the number of header lines, the fields of each
+    row and the rows every protocol accepts. It is served to the
+    validator page, which screens files with it before uploading them.
+
+    Returns
+    -------
+    dict
+        ``schema_version``, the ``fcsv`` layout and the ``protocols``, in
+        definition order. Each protocol lists its rows in order, with the
+        canonical description and the accepted ones, normalized as by
+        normalize_desc.
+    """
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "fcsv": {
+            "min_version": FCSV_MIN_VERSION,
+            "header_lines": FCSV_HEADER_LINES,
+            "fields": list(FCSV_FIELDS),
+            "coordinates": ["x", "y", "z"],
+        },
+        "protocols": [
+            {
+                "key": protocol.key,
+                "name": protocol.name,
+                "num_rows": protocol.num_rows,
+                "rows": [
+                    {
+                        "label": label,
+                        "desc": protocol.canonical[label],
+                        "aliases": sorted(protocol.aliases[label]),
+                    }
+                    for label in protocol.labels
+                ],
+            }
+            for protocol in PROTOCOLS.values()
+        ],
+    }
+
+
+def csv_to_json(in_csv, protocol=None):
+    """ Parse .fscv / .csv files and write to json object
+
+    Coordinates are written as in AfidsSet.to_dict.
+    """
+    return parse_fcsv(in_csv, protocol).to_json()
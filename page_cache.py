@@ -0,0 +1,153 @@
+"""In-process cache of rendered pages, with HTTP validators."""
+
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app, request
+
+from compression import accepts_gzip, gzip_bytes
+
+
+def fingerprint(paths):
+    """Fingerprint files and directories by their size and mtime.
+
+    Directories are walked, so files added to or removed from them
+    change the fingerprint too.
+
+    Returns
+    -------
+    fingerprint : tuple
+        Comparable fingerprint of every path.
+    last_modified : float
+        Latest mtime among the paths.
+    """
+    stats = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                stats.append((root, os.stat(root).st_mtime_ns, 0))
+                for name in sorted(files):
+                    file_stat = os.stat(os.path.join(root, name))
+                    stats.append(
+                        (
+                            os.path.join(root, name),
+                            file_stat.st_mtime_ns,
+                            file_stat.st_size,
+                        )
+                    )
+        elif os.path.exists(path):
+            file_stat = os.stat(path)
+            stats.append((path, file_stat.st_mtime_ns, file_stat.st_size))
+
+    last_modified = max((stat[1] for stat in stats), default=0) / 1e9
+    return tuple(stats), last_modified
+
+
+class CachedPage:
+    """A rendered page, ready to be sent.
+
+    Attributes:
+        body -- the page, as UTF-8 bytes
+        gzip_body -- the gzipped page
+        etag -- hash of the body, used as a weak ETag
+        last_modified -- latest mtime of anything the page depends on
+        fingerprint -- fingerprint of the page's dependencies
+    """
+
+    __slots__ = ("body", "gzip_body", "etag", "last_modified", "fingerprint")
+
+    def __init__(self, body, last_modified, page_fingerprint):
+        self.body = body.encode("utf-8")
+        self.gzip_body = gzip_bytes(self.body)
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.last_modified = datetime.fromtimestamp(
+            int(last_modified), timezone.utc
+        )
+        self.fingerprint = page_fingerprint
+
+
+class PageCache:
+    """Cache of rendered pages, invalidated when their files change.
+
+    Dependencies are only re-checked once every ``check_interval``
+    seconds, so a cached page is served without touching the disk.
+    """
+
+    def __init__(self, check_interval=2.0):
+        self.check_interval = check_interval
+        self._pages = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Drop every cached page."""
+        with self._lock:
+            self._pages = {}
+            self._checked = {}
+
+    def get(self, key, render, dependencies):
+        """Return the cached page for key, rendering it if stale.
+
+        Parameters
+        ----------
+        key : str
+            Name of the page.
+        render : callable
+            Renders the page as a str.
+        dependencies : list of str
+            Files and directories the page is rendered from.
+
+        Returns
+        -------
+        CachedPage
+        """
+        page = self._pages.get(key)
+        now = time.monotonic()
+        if (
+            page is not None
+            and now - self._checked.get(key, 0) < self.check_interval
+        ):
+            return page
+
+        page_fingerprint, last_modified = fingerprint(dependencies)
+        if page is None or page.fingerprint != page_fingerprint:
+            page = CachedPage(render(), last_modified, page_fingerprint)
+            with self._lock:
+                self._pages[key] = page
+        self._checked[key] = now
+
+        return page
+
+    def response(self, key, render, dependencies=()):
+        """Build a conditional response for a cached page.
+
+        The template folder is always a dependency. Requests carrying a
+        matching If-None-Match or If-Modified-Since get a 304.
+        """
+        app = current_app
+        if not app.config.get("PAGE_CACHE_ENABLED", True):
+            return app.make_response(render())
+
+        page = self.get(
+            key,
+            render,
+            [os.path.join(app.root_path, app.template_folder)]
+            + list(dependencies),
+        )
+        gzipped = accepts_gzip()
+        response = app.response_class(
+            page.gzip_body if gzipped else page.body, mimetype="text/html"
+        )
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        response.set_etag(page.etag, weak=True)
+        response.last_modified = page.last_modified
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+
+        return response.make_conditional(request)
@@ -0,0 +1,424 @@
+"""On-disk, memory-mappable arrays of every stored AFIDs set.
+
+The population is kept as two ``.npy`` files in one directory: an
+``(N, 32, 3)`` float64 array of coordinates, and an ``(N,)`` int64 array
+of the matching ``fid_db`` ids. The headers are written with a fixed size,
+so new sets are appended in place and only the shape in the header is
+rewritten. Both files open zero-copy with ``numpy.load(mmap_mode="r")``.
+"""
+
+import ast
+import os
+import threading
+import time
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+NUM_AFIDS = 32
+COORDS_FILE = "afids.npy"
+IDS_FILE = "ids.npy"
+AGGREGATES_FILE = "aggregates.npz"
+
+# Room for any realistic shape in the header dict, padded with spaces
+NPY_HEADER_SIZE = 128
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def _write_header(out_file, dtype, shape):
+    """Write a fixed-size version 1.0 .npy header at the start of a file."""
+    header = repr(
+        {
+            "descr": np.dtype(dtype).str,
+            "fortran_order": False,
+            "shape": tuple(shape),
+        }
+    )
+    header_len = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2
+    header = header.ljust(header_len - 1) + "\n"
+    if len(header) != header_len:
+        raise ValueError(
+            "Shape {shape} does not fit the header".format(shape=shape)
+        )
+
+    out_file.seek(0)
+    out_file.write(NPY_MAGIC)
+    out_file.write(header_len.to_bytes(2, "little"))
+    out_file.write(header.encode("latin1"))
+
+
+def _read_shape(in_file):
+    """Read the shape from a fixed-size .npy header."""
+    in_file.seek(len(NPY_MAGIC) + 2)
+    header = in_file.read(NPY_HEADER_SIZE - len(NPY_MAGIC) - 2)
+    return ast.literal_eval(header.decode("latin1"))["shape"]
+
+
+class PopulationStore:
+    """Append-only coordinate and id arrays for the stored AFIDs sets.
+
+    Attributes:
+        directory -- directory holding the .npy files
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.coords_path = os.path.join(directory, COORDS_FILE)
+        self.ids_path = os.path.join(directory, IDS_FILE)
+
+    def _create(self):
+        """Create empty arrays, if they do not exist yet."""
+        os.makedirs(self.directory, exist_ok=True)
+        for path, dtype, shape in (
+            (self.coords_path, "<f8", (0, NUM_AFIDS, 3)),
+            (self.ids_path, "<i8", (0,)),
+        ):
+            if not os.path.exists(path):
+                with open(path, "wb") as out_file:
+                    _write_header(out_file, dtype, shape)
+
+    def __len__(self):
+        if not os.path.exists(self.ids_path):
+            return 0
+
+        with open(self.coords_path, "rb") as coords_file, open(
+            self.ids_path, "rb"
+        ) as ids_file:
+            # An interrupted append can leave one file longer
+            return min(_read_shape(coords_file)[0], _read_shape(ids_file)[0])
+
+    def last_id(self):
+        """The id of the most recently appended set, or None."""
+        num_sets = len(self)
+        if not num_sets:
+            return None
+        return int(self.open()[0][num_sets - 1])
+
+    def append(self, ids, coords):
+        """Append sets to the end of the arrays.
+
+        Parameters
+        ----------
+        ids : array_like of int, shape (M,)
+            Database ids of the sets, increasing.
+        coords : array_like of float, shape (M, 32, 3)
+            Coordinates of the sets.
+        """
+        ids = np.ascontiguousarray(ids, dtype="<i8")
+        coords = np.ascontiguousarray(coords, dtype="<f8").reshape(
+            -1, NUM_AFIDS, 3
+        )
+        if len(ids) != len(coords):
+            raise ValueError("ids and coords have different lengths")
+
+        if not len(ids):
+            return
+
+        self._create()
+        num_sets = len(self)
+        for path, dtype, data in (
+            (self.coords_path, "<f8", coords),
+            (self.ids_path, "<i8", ids),
+        ):
+            row_size = data.nbytes // len(data)
+            with open(path, "r+b") as out_file:
+                # Data first, so the header never covers unwritten rows
+                out_file.seek(NPY_HEADER_SIZE + num_sets * row_size)
+                out_file.write(data.tobytes())
+                out_file.truncate()
+                _write_header(
+                    out_file, dtype, (num_sets + len(data),) + data.shape[1:]
+                )
+
+    def open(self, mmap_mode="r"):
+        """Open the ids and coordinates without reading them into memory.
+
+        Returns
+        -------
+        ids : numpy.memmap, shape (N,)
+        coords : numpy.memmap, shape (N, 32, 3)
+        """
+        if not os.path.exists(self.ids_path):
+            return (
+                np.empty((0,), dtype="<i8"),
+                np.empty((0, NUM_AFIDS, 3), dtype="<f8"),
+            )
+
+        num_sets = len(self)
+        ids = np.load(self.ids_path, mmap_mode=mmap_mode)
+        coords = np.load(self.coords_path, mmap_mode=mmap_mode)
+        return ids[:num_sets], coords[:num_sets]
+
+
+def coordinate_columns(model):
+    """The model's coordinate columns, in (AFID, axis) order."""
+    return [
+        getattr(model, "{base}_{axis}".format(base=base, axis=axis))
+        for base in model.c
+        for axis in ("x", "y", "z")
+    ]
+
+
+def sync_population(store, batch_size=10000):
+    """Append sets stored since the last sync to a population store.
+
+    Only rows with an id above the store's last id are read, selecting the
+    coordinate columns directly rather than building ORM objects.
+
+    Returns
+    -------
+    int
+        Number of sets appended.
+    """
+    # Deferred, so analysts can open a store without database settings
+    from controller import db, FiducialSet
+
+    query = db.session.query(
+        FiducialSet.id, *coordinate_columns(FiducialSet)
+    ).order_by(FiducialSet.id)
+    last_id = store.last_id()
+
+    num_appended = 0
+    while True:
+        batch = query
+        if last_id is not None:
+            batch = batch.filter(FiducialSet.id > last_id)
+        rows = batch.limit(batch_size).all()
+        if not rows:
+            break
+
+        # Missing coordinates become NaN
+        store.append(
+            [row[0] for row in rows],
+            np.array([row[1:] for row in rows], dtype="<f8"),
+        )
+        num_appended += len(rows)
+        last_id = rows[-1][0]
+
+    return num_appended
+
+
+def export_parquet(store, path, labels, batch_size=100000):
+    """Write a population store to a columnar Parquet file.
+
+    Parameters
+    ----------
+    store : PopulationStore
+        The store to export.
+    path : str
+        Path of the Parquet file to write.
+    labels : list of str
+        AFID abbreviations, naming the ``<label>_<axis>`` columns.
+    batch_size : int, optional
+        Number of sets per row group.
+    """
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow to be installed")
+
+    names = ["id"] + [
+        "{label}_{axis}".format(label=label, axis=axis)
+        for label in labels
+        for axis in ("x", "y", "z")
+    ]
+    schema = pa.schema(
+        [pa.field("id", pa.int64())]
+        + [pa.field(name, pa.float64()) for name in names[1:]]
+    )
+
+    ids, coords = store.open()
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, len(ids), batch_size):
+            flat = coords[start : start + batch_size].reshape(
+                -1, NUM_AFIDS * 3
+            )
+            columns = [pa.array(ids[start : start + batch_size])] + [
+                pa.array(flat[:, col]) for col in range(flat.shape[1])
+            ]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+
+class LandmarkAggregates:
+    """Where the sets of one template and protocol placed each AFID.
+
+    Attributes:
+        count -- (32,) number of sets placing each AFID
+        centroid -- (32, 3) mean position of each AFID
+        covariance -- (32, 3, 3) covariance of each AFID's position
+    """
+
+    __slots__ = ("count", "centroid", "covariance")
+
+    def __init__(self, count, centroid, covariance):
+        self.count = count
+        self.centroid = centroid
+        self.covariance = covariance
+
+    @classmethod
+    def from_sums(cls, count, sums, outer_sums):
+        """Aggregates from running counts, sums and sums of outer products."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            centroid = sums / count[:, np.newaxis]
+            covariance = (
+                outer_sums
+                - count[:, np.newaxis, np.newaxis]
+                * np.einsum("ai,aj->aij", centroid, centroid)
+            ) / (count[:, np.newaxis, np.newaxis] - 1)
+
+        return cls(count, centroid, covariance)
+
+
+def _accumulate(sums, coords):
+    """Add (M, 32, 3) coordinates to [count, sums, outer sums] in place."""
+    valid = ~np.isnan(coords).any(axis=2)
+    coords = np.where(valid[:, :, np.newaxis], coords, 0)
+    sums[0] += valid.sum(axis=0)
+    sums[1] += coords.sum(axis=0)
+    sums[2] += np.einsum("nai,naj->aij", coords, coords)
+
+
+def aggregate_by_template(batch_size=10000):
+    """Compute LandmarkAggregates of the stored sets of each template.
+
+    Sets are grouped by protocol as well as template, since human and
+    non-human primate sets share landmarks but not their scale. Sets
+    stored before the protocol was recorded count as DEFAULT_PROTOCOL.
+    Rows are read in batches of the coordinate columns, as in
+    sync_population; sets stored without a template are left out.
+
+    Returns
+    -------
+    dict of (str, str) to LandmarkAggregates
+        Aggregates by (template, protocol key).
+    """
+    from controller import db, FiducialSet
+    from model_auto import DEFAULT_PROTOCOL
+
+    query = (
+        db.session.query(
+            FiducialSet.id,
+            FiducialSet.template,
+            db.func.coalesce(FiducialSet.protocol, DEFAULT_PROTOCOL),
+            *coordinate_columns(FiducialSet)
+        )
+        .filter(FiducialSet.template.isnot(None))
+        .order_by(FiducialSet.id)
+    )
+
+    sums = {}
+    last_id = None
+    while True:
+        batch = query
+        if last_id is not None:
+            batch = batch.filter(FiducialSet.id > last_id)
+        rows = batch.limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        groups = [tuple(row[1:3]) for row in rows]
+        coords = np.array([row[3:] for row in rows], dtype="<f8").reshape(
+            -1, NUM_AFIDS, 3
+        )
+        for key in set(groups):
+            _accumulate(
+                sums.setdefault(
+                    key,
+                    [
+                        np.zeros(NUM_AFIDS),
+                        np.zeros((NUM_AFIDS, 3)),
+                        np.zeros((NUM_AFIDS, 3, 3)),
+                    ],
+                ),
+                coords[np.array([group == key for group in groups])],
+            )
+
+    return {
+        key: LandmarkAggregates.from_sums(*group_sums)
+        for key, group_sums in sums.items()
+    }
+
+
+def save_aggregates(path, aggregates):
+    """Write aggregates by (template, protocol) to .npz, atomically."""
+    keys = sorted(aggregates)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out_file:
+        np.savez(
+            out_file,
+            templates=np.array([key[0] for key in keys], dtype=str),
+            protocols=np.array([key[1] for key in keys], dtype=str),
+            count=np.array([aggregates[key].count for key in keys]),
+            centroid=np.array([aggregates[key].centroid for key in keys]),
+            covariance=np.array([aggregates[key].covariance for key in keys]),
+        )
+    os.replace(tmp_path, path)
+
+
+def load_aggregates(path):
+    """Read aggregates by (template, protocol) written by save_aggregates.
+
+    Files written before aggregates were split by protocol mix protocols,
+    so they are read as empty until export_population rewrites them.
+    """
+    with np.load(path) as data:
+        if "protocols" not in data:
+            return {}
+        return {
+            (str(template), str(protocol)): LandmarkAggregates(
+                data["count"][index],
+                data["centroid"][index],
+                data["covariance"][index],
+            )
+            for index, (template, protocol) in enumerate(
+                zip(data["templates"], data["protocols"])
+            )
+        }
+
+
+class AggregatesFile:
+    """Aggregates by template and protocol, reloaded when rewritten.
+
+    The file's mtime is checked at most every ``check_interval``
+    seconds, so reading aggregates in a request is a dict lookup.
+    """
+
+    def __init__(self, path, check_interval=10.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._aggregates = {}
+        self._mtime = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Reload the file if it changed since it was last read."""
+        now = time.monotonic()
+        if (
+            self._checked is not None
+            and now - self._checked < self.check_interval
+        ):
+            return
+
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self._aggregates = (
+                    {} if mtime is None else load_aggregates(self.path)
+                )
+                self._mtime = mtime
+            self._checked = now
+
+    def get(self, template, protocol):
+        """The LandmarkAggregates of a template and protocol, or None."""
+        self._refresh()
+        return self._aggregates.get((template, protocol))
@@ -0,0 +1,155 @@
+"""Opt-in per-request CPU and memory profiling."""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from flask import current_app, request
+
+# tracemalloc is process-wide, so requests are profiled one at a time
+_profiling_lock = threading.Lock()
+
+
+def profiling_requested():
+    """Is profiling enabled in the config and asked for by this request?"""
+    if not current_app.config.get("PROFILING_ENABLED", False):
+        return False
+
+    return bool(request.headers.get(current_app.config["PROFILE_HEADER"]))
+
+
+def _profile_name(tag):
+    """Build a unique, filesystem-safe name for a profile."""
+    name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    tag = re.sub(r"[^A-Za-z0-9_-]", "", tag)[:32]
+    if tag and tag.lower() not in ("1", "true", "yes"):
+        name = "_".join([name, tag])
+
+    return name
+
+
+def write_profile(profile_dir, name, profiler, snapshot, summary, top=25):
+    """Write a cProfile dump and a human-readable summary to disk.
+
+    Parameters
+    ----------
+    profile_dir : str
+        Directory to write the profile files to.
+    name : str
+        Base name of the profile files.
+    profiler : cProfile.Profile
+        Profiler that was active during the request.
+    snapshot : tracemalloc.Snapshot
+        Allocations traced during the request.
+    summary : list of str
+        Lines describing the request, written at the top of the summary.
+    top : int, optional
+        Number of functions and allocation sites to list.
+
+    Returns
+    -------
+    str
+        Path of the written summary.
+    """
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(profile_dir, name + ".prof"))
+
+    cpu_stats = io.StringIO()
+    pstats.Stats(profiler, stream=cpu_stats).sort_stats(
+        "cumulative"
+    ).print_stats(top)
+
+    summary_path = os.path.join(profile_dir, name + ".txt")
+    with open(summary_path, "w") as summary_file:
+        summary_file.write("\n".join(summary) + "\n\n")
+        summary_file.write(
+            "Top {top} functions by cumulative time\n".format(top=top)
+        )
+        summary_file.write(cpu_stats.getvalue())
+        summary_file.write("\nTop {top} allocation sites\n".format(top=top))
+        for stat in snapshot.statistics("lineno")[:top]:
+            summary_file.write(str(stat) + "\n")
+
+    return summary_path
+
+
+def profile_request(view):
+    """Profile a view when the request asks for it.
+
+    The profile is only collected when ``PROFILING_ENABLED`` is set and
+    the request carries the ``PROFILE_HEADER`` header. Otherwise, or while
+    another thread is profiling a request, the view runs untouched.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiling_requested():
+            return view(*args, **kwargs)
+
+        if not _profiling_lock.acquire(blocking=False):
+            return view(*args, **kwargs)
+        try:
+            return _profiled(view, *args, **kwargs)
+        finally:
+            _profiling_lock.release()
+
+    return wrapper
+
+
+def _profiled(view, *args, **kwargs):
+    """Run a view under cProfile and tracemalloc, and write its profile.
+
+    A profile that cannot be written is logged and skipped, so the
+    request still gets the view's response, or its exception.
+    """
+    config = current_app.config
+    name = _profile_name(request.headers[config["PROFILE_HEADER"]])
+    written = False
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        response = profiler.runcall(view, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        summary = [
+            "{method} {path}".format(method=request.method, path=request.path),
+            "Content length: {length}".format(length=request.content_length),
+            "Wall time: {elapsed:.4f} s".format(elapsed=elapsed),
+            "Peak traced memory: {peak:.1f} KiB".format(peak=peak / 1024),
+        ]
+        try:
+            write_profile(
+                config["PROFILE_DIR"],
+                name,
+                profiler,
+                snapshot,
+                summary,
+                config.get("PROFILE_TOP", 25),
+            )
+            written = True
+        except OSError:
+            current_app.logger.exception(
+                "Could not write profile {name}".format(name=name)
+            )
+
+    response = current_app.make_response(response)
+    if written:
+        response.headers["X-Profile-Id"] = name
+    return response
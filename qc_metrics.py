@@ -0,0 +1,166 @@
+"""Derived anatomical measures for the quality control of AFIDs sets.
+
+The index tables are built once, from the landmark order of
+``model_auto.EXPECTED_DESCS``, and every measure is computed for a whole
+``(N, 32, 3)`` batch of sets in one vectorized pass:
+
+- the AC-PC distance;
+- the midsagittal plane, fitted by SVD to the midline AFIDs, and the
+  distance of each of them from it;
+- the asymmetry of each left/right pair: the distance between the right
+  AFID and the left one mirrored in the midsagittal plane.
+"""
+
+import numpy as np
+
+from model_auto import EXPECTED_DESCS
+
+# AFIDs expected on the midsagittal plane
+MIDLINE_ABBREVS = ("AC", "PC", "ICS", "PMJ", "GENU", "SPLE")
+
+
+class QcTables:
+    """Indices of the AFIDs each measure reads.
+
+    Attributes:
+        ac -- index of the AC
+        pc -- index of the PC
+        midline -- indices of the midline AFIDs
+        midline_abbrevs -- abbreviation of each midline AFID
+        pairs -- (num_pairs, 2) indices of the right and left AFID of a pair
+        pair_names -- name of each pair, e.g. RMB/LMB
+    """
+
+    def __init__(self, landmarks, midline_abbrevs=MIDLINE_ABBREVS):
+        abbrevs = [aliases[-1] for aliases in landmarks]
+        index = {abbrev: num for num, abbrev in enumerate(abbrevs)}
+
+        self.ac = index["AC"]
+        self.pc = index["PC"]
+        self.midline = np.array([index[abbrev] for abbrev in midline_abbrevs])
+        self.midline_abbrevs = tuple(midline_abbrevs)
+
+        # A pair is a landmark described as "R ..." and its "L ..." twin
+        by_desc = {aliases[0]: num for num, aliases in enumerate(landmarks)}
+        pairs = [
+            (num, by_desc["L " + aliases[0][2:]])
+            for num, aliases in enumerate(landmarks)
+            if aliases[0].startswith("R ") and "L " + aliases[0][2:] in by_desc
+        ]
+        self.pairs = np.array(pairs, dtype=np.intp).reshape(-1, 2)
+        self.pair_names = tuple(
+            "{right}/{left}".format(right=abbrevs[right], left=abbrevs[left])
+            for right, left in pairs
+        )
+
+
+QC_TABLES = QcTables(EXPECTED_DESCS)
+
+
+def midline_planes(coords, tables=QC_TABLES):
+    """Fit a plane to the midline AFIDs of each set.
+
+    Parameters
+    ----------
+    coords : array_like, shape (N, 32, 3)
+        Coordinates of the sets.
+    tables : QcTables, optional
+        Indices of the AFIDs.
+
+    Returns
+    -------
+    centroid : numpy.ndarray, shape (N, 3)
+        A point on each plane.
+    normal : numpy.ndarray, shape (N, 3)
+        Unit normal of each plane; NaN for sets with missing midline AFIDs.
+    """
+    midline = np.asarray(coords, dtype=np.float64)[:, tables.midline]
+    valid = ~np.isnan(midline).any(axis=(1, 2))
+    centroid = midline.mean(axis=1)
+    centered = np.where(
+        valid[:, np.newaxis, np.newaxis],
+        midline - centroid[:, np.newaxis],
+        0,
+    )
+
+    # The normal is the direction of least variance
+    normal = np.linalg.svd(centered)[2][:, -1]
+    normal[~valid] = np.nan
+
+    return centroid, normal
+
+
+def qc_metrics(coords, tables=QC_TABLES):
+    """Compute every derived measure of one or many sets.
+
+    Parameters
+    ----------
+    coords : array_like, shape (32, 3) or (N, 32, 3)
+        Coordinates of a set, or of a batch of sets.
+    tables : QcTables, optional
+        Indices of the AFIDs.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        ``acpc`` distance, shape () or (N,); ``midline_deviation`` of each
+        midline AFID, shape (6,) or (N, 6); and ``asymmetry`` of each
+        pair, shape (P,) or (N, P). Distances are in the units of the
+        coordinates, and NaN where an AFID they need is missing.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    single = coords.ndim == 2
+    if single:
+        coords = coords[np.newaxis]
+
+    centroid, normal = midline_planes(coords, tables)
+    # Signed distance of every AFID from its set's plane
+    offsets = np.einsum("nij,nj->ni", coords - centroid[:, np.newaxis], normal)
+
+    right = coords[:, tables.pairs[:, 0]]
+    left = coords[:, tables.pairs[:, 1]]
+    mirrored = (
+        left
+        - 2
+        * offsets[:, tables.pairs[:, 1], np.newaxis]
+        * normal[:, np.newaxis]
+    )
+
+    metrics = {
+        "acpc": np.linalg.norm(
+            coords[:, tables.ac] - coords[:, tables.pc], axis=-1
+        ),
+        "midline_deviation": np.abs(offsets[:, tables.midline]),
+        "asymmetry": np.linalg.norm(right - mirrored, axis=-1),
+    }
+    if single:
+        metrics = {name: values[0] for name, values in metrics.items()}
+
+    return metrics
+
+
+def afids_metrics(afids, tables=QC_TABLES):
+    """The derived measures of an AfidsSet, as rounded, labelled values.
+
+    Returns
+    -------
+    dict
+        ``acpc`` distance, and a dict of ``midline_deviation`` by AFID
+        and of ``asymmetry`` by pair.
+    """
+    metrics = qc_metrics(afids.coords, tables)
+    return {
+        "acpc": round(float(metrics["acpc"]), 5),
+        "midline_deviation": dict(
+            zip(
+                tables.midline_abbrevs,
+                [round(float(x), 5) for x in metrics["midline_deviation"]],
+            )
+        ),
+        "asymmetry": dict(
+            zip(
+                tables.pair_names,
+                [round(float(x), 5) for x in metrics["asymmetry"]],
+            )
+        ),
+    }
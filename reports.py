@@ -0,0 +1,291 @@
+"""Standalone HTML quality control reports, rendered offline in bulk.
+
+Each report holds an upload's distances to a template, its derived
+measures and both figures, like the validator's results. Reports load the
+Plotly library from a single bundle written next to them, so they open
+without network access and the bundle is not repeated in every file.
+"""
+
+import functools
+import multiprocessing
+import os
+import re
+import tempfile
+
+import jinja2
+
+from bulk_import import (
+    FCSV_EXTENSIONS,
+    is_long_csv,
+    iter_long_csv_results,
+    iter_sources,
+    parse_source,
+)
+from qc_metrics import afids_metrics
+from visualizations import (
+    generate_3d_scatter,
+    generate_histogram,
+    plotlyjs_bundle,
+    PLOTLYJS_VERSION,
+)
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), "templates")
+INDEX_FILE = "index.html"
+
+
+def plotlyjs_filename():
+    """Name of the Plotly bundle shared by the reports."""
+    return "plotly-{version}.min.js".format(version=PLOTLYJS_VERSION)
+
+
+def report_filenames(names):
+    """Distinct report file names of AFIDs files or subjects.
+
+    Names that report_filename maps to one file, like sub-01.fcsv and
+    sub-01.mrk.json, or a/b.fcsv and a_b.fcsv, get a -2, -3, ... suffix
+    in the order given, and none takes the index's name. File names are
+    compared ignoring case, as on case-insensitive file systems.
+    """
+    filenames = [report_filename(name) for name in names]
+    taken = {filename.lower() for filename in filenames}
+    taken.add(INDEX_FILE.lower())
+    claimed = {INDEX_FILE.lower()}
+
+    unique = []
+    for filename in filenames:
+        if filename.lower() in claimed:
+            stem = filename[: -len(".html")]
+            number = 2
+            while (
+                "{stem}-{number}.html".format(stem=stem, number=number).lower()
+                in taken
+            ):
+                number += 1
+            filename = "{stem}-{number}.html".format(stem=stem, number=number)
+            taken.add(filename.lower())
+        claimed.add(filename.lower())
+        unique.append(filename)
+
+    return unique
+
+
+def report_filename(name):
+    """File name of the report of an AFIDs file or subject."""
+    if name.lower().endswith(".gz"):
+        name = name[:-3]
+    for extension in FCSV_EXTENSIONS:
+        if name.lower().endswith(extension):
+            name = name[: -len(extension)]
+            break
+
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("._") + ".html"
+
+
+@functools.lru_cache(maxsize=1)
+def report_environment():
+    """Jinja environment for the report templates, one per process."""
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR), autoescape=True
+    )
+
+
+def write_plotlyjs(out_dir):
+    """Write the shared Plotly bundle, unless it is already there."""
+    path = os.path.join(out_dir, plotlyjs_filename())
+    if not os.path.isfile(path):
+        tmp_path = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+        with open(tmp_path, "wb") as out_file:
+            out_file.write(plotlyjs_bundle())
+        os.replace(tmp_path, path)
+
+    return path
+
+
+def render_report(name, afids, template_name, template_afids, population):
+    """Render the report of a valid AFIDs set as an HTML page.
+
+    population maps protocol keys to their LandmarkAggregates, or is None.
+    """
+    distances = [
+        round(float(diff), 5) for diff in afids.distances_to(template_afids)
+    ]
+    return (
+        report_environment()
+        .get_template("report.html")
+        .render(
+            name=name,
+            protocol=afids.protocol.name,
+            template=template_name,
+            rows=list(zip(template_afids.descs, distances)),
+            metrics=afids_metrics(afids),
+            scatter_html=generate_3d_scatter(
+                template_afids,
+                afids,
+                population and population.get(afids.protocol.key),
+            ),
+            histogram_html=generate_histogram(template_afids, afids),
+            plotlyjs_src=plotlyjs_filename(),
+        )
+    )
+
+
+def write_report(
+    result,
+    out_dir,
+    template_name,
+    template_afids,
+    population=None,
+    filename=None,
+):
+    """Write the report of one parse result.
+
+    Parameters
+    ----------
+    result : tuple
+        (name, afids, error), as from bulk_import.parse_source.
+    out_dir : str
+        Directory to write the report to.
+    template_name : str
+        Name of the template the set is compared to.
+    template_afids : model_auto.AfidsSet
+        The template's AFIDs.
+    population : dict of str to population.LandmarkAggregates, optional
+        Where the template's stored sets of each protocol placed each
+        AFID, by protocol key; drawn on the 3D scatter of a set of that
+        protocol.
+    filename : str, optional
+        File name to write the report to; by default from
+        report_filename.
+
+    Returns
+    -------
+    name : str
+        The file's or subject's name.
+    filename : str or None
+        The report's file name, or None if the set is invalid.
+    error : str or None
+        Why the set is invalid, or None if it is valid.
+    """
+    name, afids, error = result
+    if afids is None:
+        return name, None, error
+
+    if filename is None:
+        filename = report_filename(name)
+    html = render_report(
+        name, afids, template_name, template_afids, population
+    )
+    with open(os.path.join(out_dir, filename), "w") as out_file:
+        out_file.write(html)
+
+    return name, filename, None
+
+
+def _write_result(args, result):
+    """Write the report of a parse result to a temporary file, in a pool.
+
+    write_reports names the files once every report is written, so that
+    reports whose names clash get distinct files whatever order the pool
+    finishes them in.
+    """
+    if result[1] is None:
+        return result
+
+    fd, path = tempfile.mkstemp(suffix=".tmp", prefix=".", dir=args[0])
+    os.close(fd)
+    return write_report(result, *args, filename=os.path.basename(path))
+
+
+def _write_item(args, item):
+    """Parse a file from iter_sources and write its report, in a pool."""
+    return _write_result(args[1:], parse_source(item, args[0]))
+
+
+def write_index(out_dir, template_name, reports, rejected):
+    """Write an index linking every report and listing invalid sets."""
+    html = (
+        report_environment()
+        .get_template("report_index.html")
+        .render(template=template_name, reports=reports, rejected=rejected)
+    )
+    with open(os.path.join(out_dir, INDEX_FILE), "w") as out_file:
+        out_file.write(html)
+
+
+def write_reports(
+    source,
+    out_dir,
+    template_name,
+    template_afids,
+    population=None,
+    protocol=None,
+    jobs=None,
+):
+    """Write a report for every AFIDs set in a source, and an index.
+
+    Files are parsed and their reports rendered across a process pool.
+
+    Parameters
+    ----------
+    source : str
+        A directory, a zip or tar archive of AFIDs files, or a
+        long-format csv.
+    out_dir : str
+        Directory to write the reports, the index and the Plotly bundle
+        to; created if needed.
+    template_name : str
+        Name of the template the sets are compared to.
+    template_afids : model_auto.AfidsSet
+        The template's AFIDs.
+    population : dict of str to population.LandmarkAggregates, optional
+        Where the template's stored sets of each protocol placed each
+        AFID, by protocol key; drawn on the 3D scatters of sets of that
+        protocol.
+    protocol : str, optional
+        Protocol key to validate against; detected per file if None.
+    jobs : int, optional
+        Number of processes; defaults to the number of CPUs. With 1,
+        reports are rendered in this process.
+
+    Returns
+    -------
+    reports : list of tuple of str
+        (name, filename) of every report written, sorted by name.
+    rejected : list of tuple of str
+        (name, reason) for every invalid file or subject.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    write_plotlyjs(out_dir)
+
+    args = (out_dir, template_name, template_afids, population)
+    if is_long_csv(source):
+        tasks = iter_long_csv_results(source, protocol)
+        render = functools.partial(_write_result, args)
+    else:
+        tasks = iter_sources(source)
+        render = functools.partial(_write_item, (protocol,) + args)
+
+    if jobs == 1:
+        results = list(map(render, tasks))
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = list(pool.imap_unordered(render, tasks, chunksize=4))
+
+    written = sorted(
+        (name, filename) for name, filename, _ in results if filename
+    )
+    reports = []
+    for (name, tmp_filename), filename in zip(
+        written, report_filenames([name for name, _ in written])
+    ):
+        os.replace(
+            os.path.join(out_dir, tmp_filename),
+            os.path.join(out_dir, filename),
+        )
+        reports.append((name, filename))
+    rejected = sorted(
+        (name, error) for name, filename, error in results if not filename
+    )
+    write_index(out_dir, template_name, reports, rejected)
+
+    return reports, rejected
@@ -0,0 +1,288 @@
+/* Screen AFIDs .fcsv files in the browser, before they are uploaded.
+ *
+ * The checks mirror the structural ones of model_auto.parse_fcsv: header
+ * version, rows, columns, labels and descriptions, and coordinates. They
+ * are driven by the schema the server exports, so both apply the same
+ * rules. The server still validates every upload; a file this script
+ * cannot check is submitted as it is.
+ */
+(function () {
+  "use strict";
+
+  // Layout of the schema this script understands
+  var SCHEMA_VERSION = 1;
+  // AFIDs files are a few KiB; anything much larger is left to the server
+  var MAX_CHECKED_SIZE = 1 << 20;
+
+  var PYTHON_FLOAT = /^[+-]?(?:(?:\d(?:_?\d)*)?\.\d(?:_?\d)*|\d(?:_?\d)*\.?)(?:[eE][+-]?\d(?:_?\d)*)?$/;
+  var PYTHON_NON_FINITE = /^[+-]?(?:inf|infinity|nan)$/i;
+
+  function InvalidFcsv(message) {
+    this.message = message;
+  }
+
+  function normalizeDesc(desc) {
+    return desc.toLowerCase().split(/\s+/).filter(Boolean).join(" ");
+  }
+
+  function versionLess(version, minimum) {
+    var parts = version.split(".").map(Number);
+    var minParts = minimum.split(".").map(Number);
+    for (var i = 0; i < Math.max(parts.length, minParts.length); i++) {
+      var part = parts[i] || 0;
+      var minPart = minParts[i] || 0;
+      if (part !== minPart) {
+        return part < minPart;
+      }
+    }
+    return false;
+  }
+
+  // Split text into records as Python's csv module does, dropping blank
+  // lines as csv.DictReader does
+  function parseCsv(text) {
+    var records = [];
+    var record = [];
+    var field = "";
+    var quoted = false;
+    var started = false;
+    for (var i = 0; i < text.length; i++) {
+      var ch = text[i];
+      if (quoted) {
+        if (ch === '"' && text[i + 1] === '"') {
+          field += ch;
+          i++;
+        } else if (ch === '"') {
+          quoted = false;
+        } else {
+          field += ch;
+        }
+      } else if (ch === '"' && field === "") {
+        quoted = true;
+        started = true;
+      } else if (ch === ",") {
+        record.push(field);
+        field = "";
+        started = true;
+      } else if (ch === "\n" || ch === "\r") {
+        if (ch === "\r" && text[i + 1] === "\n") {
+          i++;
+        }
+        if (started || field !== "") {
+          record.push(field);
+          records.push(record);
+        }
+        record = [];
+        field = "";
+        started = false;
+      } else {
+        field += ch;
+        started = true;
+      }
+    }
+    if (started || field !== "") {
+      record.push(field);
+      records.push(record);
+    }
+    return records;
+  }
+
+  function parseCoordinate(value, field, label) {
+    var trimmed = value.trim();
+    if (PYTHON_NON_FINITE.test(trimmed)) {
+      throw new InvalidFcsv(field + " in row " + label + " is not finite");
+    }
+    if (!PYTHON_FLOAT.test(trimmed)) {
+      throw new InvalidFcsv(
+        field + " in row " + label + " is not a real number"
+      );
+    }
+    if (!isFinite(Number(trimmed.replace(/_/g, "")))) {
+      throw new InvalidFcsv(field + " in row " + label + " is not finite");
+    }
+  }
+
+  function rowValue(values, fields, key, label) {
+    var value = values[fields.indexOf(key)];
+    if (value === undefined) {
+      throw new InvalidFcsv(
+        label === undefined
+          ? "Row has no value " + key
+          : "Row " + label + " has no value " + key
+      );
+    }
+    return value;
+  }
+
+  function checkRows(text, schema, protocolKey) {
+    var fcsv = schema.fcsv;
+    var protocols = schema.protocols.filter(function (protocol) {
+      return !protocolKey || protocol.key === protocolKey;
+    });
+    if (!protocols.length) {
+      // An unknown protocol is reported by the server
+      return;
+    }
+
+    var newline = text.indexOf("\n");
+    var header = newline < 0 ? text : text.slice(0, newline);
+    var version = header.match(/\d+\.\d+/);
+    if (!version) {
+      throw new InvalidFcsv("Missing or invalid header in fiducial file");
+    }
+    if (versionLess(version[0], fcsv.min_version)) {
+      throw new InvalidFcsv(
+        "Markups fiducial file version " + version[0] + " too low"
+      );
+    }
+
+    var maxRows = Math.max.apply(
+      null,
+      protocols.map(function (protocol) {
+        return protocol.num_rows;
+      })
+    );
+    var records = parseCsv(newline < 0 ? "" : text.slice(newline + 1)).slice(
+      fcsv.header_lines - 1
+    );
+    var labels = {};
+    var numLabels = 0;
+    for (var num = 0; num < records.length; num++) {
+      if (num >= maxRows) {
+        throw new InvalidFcsv("Too many rows");
+      }
+
+      var values = records[num];
+      var label = rowValue(values, fcsv.fields, "label");
+      var desc = rowValue(values, fcsv.fields, "desc", label);
+      var normalized = normalizeDesc(desc);
+      protocols = protocols.filter(function (protocol) {
+        return protocol.rows.some(function (row) {
+          return row.label === label && row.aliases.indexOf(normalized) >= 0;
+        });
+      });
+      if (!protocols.length) {
+        throw new InvalidFcsv(
+          "Row label " + label + " does not match row description " + desc
+        );
+      }
+
+      fcsv.coordinates.forEach(function (key) {
+        parseCoordinate(rowValue(values, fcsv.fields, key, label), key, label);
+      });
+
+      if (values.length !== fcsv.fields.length) {
+        throw new InvalidFcsv(
+          "Incorrect number of columns (" +
+            values.length +
+            ") in row " +
+            label
+        );
+      }
+
+      if (!Object.prototype.hasOwnProperty.call(labels, label)) {
+        labels[label] = true;
+        numLabels++;
+      }
+    }
+
+    var complete = protocols.some(function (protocol) {
+      return protocol.num_rows === numLabels;
+    });
+    if (!complete) {
+      throw new InvalidFcsv("Too few rows");
+    }
+  }
+
+  // Why an fcsv file is invalid, or null if it passes every check
+  function checkFcsv(text, schema, protocolKey) {
+    try {
+      checkRows(text, schema, protocolKey);
+    } catch (err) {
+      if (err instanceof InvalidFcsv) {
+        return err.message;
+      }
+      throw err;
+    }
+    return null;
+  }
+
+  function isCheckable(file) {
+    var name = file.name.toLowerCase();
+    return (
+      file.size <= MAX_CHECKED_SIZE &&
+      (name.slice(-5) === ".fcsv" || name.slice(-4) === ".csv")
+    );
+  }
+
+  function attach(form) {
+    var output = document.getElementById(
+      form.getAttribute("data-prevalidation-output")
+    );
+    var schema = null;
+    var checked = false;
+
+    fetch(form.getAttribute("data-schema-url"))
+      .then(function (response) {
+        return response.ok ? response.json() : null;
+      })
+      .then(function (loaded) {
+        if (loaded && loaded.schema_version === SCHEMA_VERSION) {
+          schema = loaded;
+        }
+      })
+      .catch(function () {});
+
+    function submitUnchecked() {
+      checked = true;
+      form.submit();
+    }
+
+    form.addEventListener("submit", function (event) {
+      var input = form.querySelector('input[type="file"]');
+      var file = input && input.files && input.files[0];
+      if (checked || !schema || !file || !isCheckable(file)) {
+        return;
+      }
+
+      event.preventDefault();
+      var protocol = form.elements.protocol.value;
+      var reader = new FileReader();
+      reader.onload = function () {
+        var error;
+        try {
+          error = checkFcsv(
+            reader.result,
+            schema,
+            protocol === "auto" ? null : protocol
+          );
+        } catch (err) {
+          submitUnchecked();
+          return;
+        }
+
+        if (error) {
+          output.textContent =
+            "Invalid file: " + error + " (checked before uploading)";
+          output.hidden = false;
+          return;
+        }
+        output.hidden = true;
+        submitUnchecked();
+      };
+      reader.onerror = submitUnchecked;
+      reader.readAsText(file);
+    });
+  }
+
+  if (typeof module !== "undefined" && module.exports) {
+    module.exports = { checkFcsv: checkFcsv, parseCsv: parseCsv };
+  } else {
+    document.addEventListener("DOMContentLoaded", function () {
+      var forms = document.querySelectorAll("form[data-schema-url]");
+      for (var i = 0; i < forms.length; i++) {
+        attach(forms[i]);
+      }
+    });
+  }
+})();
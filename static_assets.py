@@ -0,0 +1,113 @@
+"""Content-fingerprinted static files, cached by clients forever."""
+
+import hashlib
+import mimetypes
+import os
+
+from flask import current_app, request, send_file
+
+from compression import COMPRESSIBLE_MIMETYPES, accepts_gzip, gzip_bytes
+
+# Fingerprinted URLs change whenever their content does
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class Asset:
+    """A static file and its fingerprinted name.
+
+    Attributes:
+        path -- the file's path on disk
+        url_name -- the file's name with its content hash, as served
+        digest -- hex SHA-256 of the file's content
+        mimetype -- the file's mimetype
+        gzip_body -- the gzipped file, for compressible types, else None
+    """
+
+    __slots__ = ("path", "url_name", "digest", "mimetype", "gzip_body")
+
+    def __init__(self, path, filename, compress_level=9):
+        self.path = path
+        self.mimetype = (
+            mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        )
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as in_file:
+            for chunk in iter(lambda: in_file.read(1 << 20), b""):
+                digest.update(chunk)
+        self.digest = digest.hexdigest()
+
+        root, ext = os.path.splitext(filename)
+        self.url_name = "{root}.{digest}{ext}".format(
+            root=root, digest=self.digest[:12], ext=ext
+        )
+
+        self.gzip_body = None
+        if self.mimetype in COMPRESSIBLE_MIMETYPES:
+            with open(path, "rb") as in_file:
+                body = in_file.read()
+            compressed = gzip_bytes(body, compress_level)
+            if len(compressed) < len(body):
+                self.gzip_body = compressed
+
+
+class StaticAssets:
+    """Manifest of a static folder, from file names to fingerprinted names.
+
+    Every file is hashed once, when the manifest is built, and text files
+    are gzipped ahead of time.
+    """
+
+    def __init__(self, folder, compress_level=9):
+        self.folder = folder
+        self._by_filename = {}
+        self._by_url_name = {}
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, folder).replace(os.sep, "/")
+                asset = Asset(path, filename, compress_level)
+                self._by_filename[filename] = asset
+                self._by_url_name[asset.url_name] = asset
+
+    def url_name(self, filename):
+        """Fingerprinted name of a file, relative to the static folder."""
+        return self._by_filename[filename].url_name
+
+    def lookup(self, url_name):
+        """The Asset served under a fingerprinted name, or None."""
+        return self._by_url_name.get(url_name)
+
+    def response(self, url_name):
+        """Serve an asset, with immutable caching and byte ranges.
+
+        Precompressed text is sent to clients accepting gzip; everything
+        else is sent from disk, answering Range requests with a 206.
+        Returns None if there is no such asset.
+        """
+        asset = self.lookup(url_name)
+        if asset is None:
+            return None
+
+        if asset.gzip_body is not None and accepts_gzip():
+            response = current_app.response_class(
+                asset.gzip_body, mimetype=asset.mimetype
+            )
+            response.headers["Content-Encoding"] = "gzip"
+            response.set_etag(asset.digest)
+            response = response.make_conditional(request)
+        else:
+            response = send_file(
+                asset.path, mimetype=asset.mimetype, conditional=True
+            )
+
+        if asset.gzip_body is not None:
+            response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = (
+            "public, max-age={max_age}, immutable".format(
+                max_age=ASSET_MAX_AGE
+            )
+        )
+
+        return response
@@ -0,0 +1,140 @@
+"""Reference templates, parsed once and reloaded when their files change."""
+
+import os
+import threading
+import time
+
+from model_auto import InvalidFcsvError, parse_fcsv
+
+
+def template_name(filename):
+    """Template name of a file, e.g. MNI2009cAsym for sub-MNI2009cAsym_*."""
+    if "sub" in filename:
+        filename = filename[4:]
+
+    return filename.split("_")[0]
+
+
+class TemplateEntry:
+    """A template file and its parsed AFIDs.
+
+    Attributes:
+        path -- the template's fcsv file
+        stat_key -- (mtime_ns, size) of the file when it was parsed
+        afids -- the parsed AfidsSet, or None if the file is invalid
+    """
+
+    __slots__ = ("path", "stat_key", "afids")
+
+    def __init__(self, path, stat_key, afids):
+        self.path = path
+        self.stat_key = stat_key
+        self.afids = afids
+
+
+class TemplateStore:
+    """Parsed templates of a directory, kept in sync with its files.
+
+    Templates are parsed when the store is created. The directory is
+    listed again at most once every ``check_interval`` seconds; only
+    files that were added or whose mtime or size changed are parsed, and
+    the new entries replace the old ones in a single assignment, so
+    readers never see a partly updated store.
+    """
+
+    def __init__(self, directory, protocol="human", check_interval=2.0):
+        self.directory = directory
+        self.protocol = protocol
+        self.check_interval = check_interval
+        self._entries = {}
+        self._checked = None
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def _parse(self, path):
+        """Parse a template file, or None if it is not a valid set."""
+        try:
+            with open(path, "r") as template_file:
+                return parse_fcsv(template_file, self.protocol)
+        except InvalidFcsvError as err:
+            reason = err.message
+        except (OSError, UnicodeDecodeError) as err:
+            reason = str(err)
+
+        print(
+            "Skipping template {path}: {reason}".format(
+                path=path, reason=reason
+            )
+        )
+        return None
+
+    def refresh(self, force=False):
+        """Reload added, changed or removed template files.
+
+        Does nothing if the directory was checked less than
+        ``check_interval`` seconds ago, unless force is set.
+        """
+        if not force and not self._is_stale():
+            return
+
+        with self._lock:
+            # Another thread may have refreshed while this one waited
+            if not force and not self._is_stale():
+                return
+
+            entries = {}
+            for dir_entry in sorted(
+                os.scandir(self.directory), key=lambda entry: entry.name
+            ):
+                if not (
+                    dir_entry.is_file() and dir_entry.name.endswith(".fcsv")
+                ):
+                    continue
+
+                stat = dir_entry.stat()
+                stat_key = (stat.st_mtime_ns, stat.st_size)
+                name = template_name(dir_entry.name)
+                entry = self._entries.get(name)
+                if (
+                    entry is None
+                    or entry.path != dir_entry.path
+                    or entry.stat_key != stat_key
+                ):
+                    entry = TemplateEntry(
+                        dir_entry.path, stat_key, self._parse(dir_entry.path)
+                    )
+                entries[name] = entry
+
+            self._entries = entries
+            self._checked = time.monotonic()
+
+    def _is_stale(self):
+        """Is it time to check the directory again?"""
+        return (
+            self._checked is None
+            or time.monotonic() - self._checked >= self.check_interval
+        )
+
+    def names(self):
+        """Names of the valid templates, sorted."""
+        self.refresh()
+        return [
+            name
+            for name, entry in self._entries.items()
+            if entry.afids is not None
+        ]
+
+    def items(self):
+        """(name, AfidsSet) of each valid template, sorted by name."""
+        self.refresh()
+        return [
+            (name, entry.afids)
+            for name, entry in self._entries.items()
+            if entry.afids is not None
+        ]
+
+    def get(self, name):
+        """The parsed AfidsSet of a template, or None if there is none."""
+        self.refresh()
+        entry = self._entries.get(name)
+        return None if entry is None else entry.afids
@@ -1 +1,13 @@
-pass
+import atexit
+import os
+import shutil
+import tempfile
+
+# A throwaway SQLite database stands in for Postgres in tests of the app
+DB_DIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, DB_DIR, True)
+os.environ.setdefault(
+    'DATABASE_URL', 'sqlite:///' + os.path.join(DB_DIR, 'test.db'))
+os.environ.setdefault('APP_SETTINGS', 'config.TestingConfig')
+os.environ.setdefault('JOB_QUEUE_PATH', os.path.join(DB_DIR, 'jobs.db'))
+os.environ.setdefault('JOB_UPLOAD_DIR', os.path.join(DB_DIR, 'jobs'))
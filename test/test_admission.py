@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from flask import Flask, g
+
+import admission
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_admit_and_release(self):
+        controller = admission.AdmissionController(2, 0.01, 10.0, 5)
+        deadline = controller.acquire()
+
+        self.assertEqual(controller.stats()['in_flight'], 1)
+        self.assertGreater(deadline.remaining(), 9.0)
+
+        controller.release()
+        self.assertEqual(controller.stats()['in_flight'], 0)
+
+    def test_reject_when_full(self):
+        controller = admission.AdmissionController(1, 0.01, 10.0, 7)
+        controller.acquire()
+
+        with self.assertRaises(admission.Overloaded) as cm:
+            controller.acquire()
+
+        self.assertEqual(cm.exception.retry_after, 7)
+        self.assertEqual(controller.stats(), {
+            'in_flight': 1, 'max_inflight': 1, 'waiting': 0, 'rejected': 1})
+
+    def test_waiting_request_admitted(self):
+        controller = admission.AdmissionController(1, 5.0, 10.0, 5)
+        controller.acquire()
+        timer = threading.Timer(0.05, controller.release)
+        timer.start()
+
+        controller.acquire()
+        timer.join()
+        self.assertEqual(controller.stats()['in_flight'], 1)
+
+    def test_deadline(self):
+        self.assertEqual(admission.Deadline(-1.0).remaining(), 0.0)
+
+    def test_deadline_from_arrival(self):
+        deadline = admission.Deadline(10.0, time.time() - 4.0)
+
+        self.assertLess(deadline.remaining(), 6.01)
+        self.assertGreater(deadline.remaining(), 5.0)
+
+
+class TestRequestArrival(unittest.TestCase):
+    def test_parse_request_start(self):
+        self.assertEqual(
+            admission.parse_request_start('t=1600000000.5'), 1600000000.5)
+        self.assertEqual(
+            admission.parse_request_start('1600000000500'), 1600000000.5)
+        self.assertEqual(
+            admission.parse_request_start('t=1600000000500000'),
+            1600000000.5)
+        self.assertIsNone(admission.parse_request_start('soon'))
+
+    def test_earliest(self):
+        now = time.time()
+        environ = {
+            admission.REQUEST_START_KEY: now - 1.0,
+            'HTTP_X_REQUEST_START': 't={0:.3f}'.format(now - 3.0)}
+
+        self.assertAlmostEqual(
+            admission.request_arrival(environ), now - 3.0, places=2)
+
+    def test_skewed_header_ignored(self):
+        now = time.time()
+        for header in ('t={0:.3f}'.format(now + 60.0), 't=1000', 'soon'):
+            with self.subTest(header=header):
+                environ = {admission.REQUEST_START_KEY: now,
+                           'HTTP_X_REQUEST_START': header}
+                self.assertEqual(admission.request_arrival(environ), now)
+        self.assertIsNone(admission.request_arrival({}))
+
+    def test_limit_counts_time_queued(self):
+        app = Flask(__name__)
+        app.wsgi_app = admission.RequestTimer(app.wsgi_app)
+        limiter = admission.AdmissionController(1, 1.0, 10.0, 5)
+
+        @app.route('/', methods=['POST'])
+        @limiter.limit()
+        def view():
+            return '{0:.1f}'.format(g.deadline.remaining())
+
+        # Queued for 4 seconds in front of the app
+        response = app.test_client().post('/', headers={
+            'X-Request-Start': 't={0:.3f}'.format(time.time() - 4.0)})
+        self.assertEqual(response.get_data(as_text=True), '6.0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+
+import numpy as np
+
+import analytics
+
+
+def brute_force_distances(coords):
+    return np.sqrt(
+        ((coords[:, np.newaxis] - coords[np.newaxis]) ** 2).sum(axis=-1))
+
+
+class TestPairwiseDistances(unittest.TestCase):
+    def setUp(self):
+        self.coords = np.random.RandomState(0).normal(size=(23, 32, 3))
+
+    def test_distance_matrix(self):
+        expected = brute_force_distances(self.coords)
+
+        np.testing.assert_allclose(
+            analytics.distance_matrix(self.coords, block_size=5), expected)
+
+    def test_blocks_against_other(self):
+        other = self.coords[:4] + 1.0
+        blocks = list(analytics.iter_distance_blocks(
+            self.coords, other, block_size=10))
+
+        self.assertEqual([(row, col) for row, col, _ in blocks],
+                         [(0, 0), (10, 0), (20, 0)])
+        np.testing.assert_allclose(
+            blocks[0][2][range(4), range(4)], np.full((4, 32), np.sqrt(3)))
+
+    def test_summary(self):
+        distances = brute_force_distances(self.coords)
+        pairs = distances[np.triu_indices(len(self.coords), 1)]
+        summary = analytics.pairwise_distance_summary(
+            self.coords, block_size=4)
+
+        np.testing.assert_array_equal(summary['count'], len(pairs))
+        np.testing.assert_allclose(summary['mean'], pairs.mean(axis=0))
+        np.testing.assert_allclose(summary['std'], pairs.std(axis=0))
+        np.testing.assert_allclose(summary['max'], pairs.max(axis=0))
+
+    def test_summary_skips_missing(self):
+        self.coords[0, 3] = np.nan
+        summary = analytics.pairwise_distance_summary(
+            self.coords, block_size=4)
+
+        self.assertEqual(summary['count'][3], 22 * 21 / 2)
+        self.assertEqual(summary['count'][4], 23 * 22 / 2)
+        self.assertFalse(np.isnan(summary['mean']).any())
+
+
+class TestIcc(unittest.TestCase):
+    def test_perfect_agreement(self):
+        subjects = np.repeat(np.arange(5), 3)
+        coords = np.random.RandomState(0).normal(size=(5, 32, 3))[subjects]
+
+        np.testing.assert_allclose(
+            analytics.icc(coords, subjects, block_size=4), 1.0)
+
+    def test_balanced(self):
+        random = np.random.RandomState(1)
+        subjects = np.repeat(np.arange(4), 3)
+        coords = random.normal(size=(12, 32, 3))
+        icc = analytics.icc(coords, subjects, block_size=5)
+
+        # ICC(1,1) from the one-way ANOVA table of one coordinate
+        values = coords[:, 0, 0].reshape(4, 3)
+        ms_between = 3 * values.mean(axis=1).var(ddof=0) * 4 / 3
+        ms_within = ((values - values.mean(axis=1, keepdims=True)) ** 2
+                     ).sum() / 8
+        expected = (ms_between - ms_within) / (ms_between + 2 * ms_within)
+        self.assertAlmostEqual(icc[0, 0], expected)
+
+    def test_single_subject(self):
+        icc = analytics.icc(np.zeros((3, 32, 3)), ['a', 'a', 'a'])
+
+        self.assertTrue(np.isnan(icc).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
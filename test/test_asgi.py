@@ -0,0 +1,158 @@
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import unittest
+
+import asgi
+import visualizations
+
+
+def call(app, method, path, query=b'', body=b'', chunk_size=1000,
+         headers=()):
+    """Run one request through an ASGI app, returning (status, json)."""
+    chunks = [body[start:start + chunk_size]
+              for start in range(0, len(body), chunk_size)] or [b'']
+    messages = [
+        {'type': 'http.request', 'body': chunk,
+         'more_body': index < len(chunks) - 1}
+        for index, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query, 'headers': list(headers)}
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(app(scope, receive, send))
+    finally:
+        loop.close()
+
+    return sent[0]['status'], json.loads(sent[1]['body'].decode('utf-8'))
+
+
+class TestAsgiApp(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with asgi.flask_app.app_context():
+            asgi.db.create_all()
+
+    @classmethod
+    def tearDownClass(cls):
+        with asgi.flask_app.app_context():
+            asgi.db.drop_all()
+
+    def setUp(self):
+        self.app = asgi.AsgiApp(
+            concurrent.futures.ThreadPoolExecutor(2),
+            concurrent.futures.ThreadPoolExecutor(2))
+        with open('test/resources/valid.fcsv', 'rb') as fcsv:
+            self.fcsv = fcsv.read()
+        self.template = asgi.template_store.names()[0]
+
+    def tearDown(self):
+        self.app.shutdown()
+
+    def test_validate(self):
+        status, data = call(
+            self.app, 'POST', '/api/validate',
+            b'filename=valid.fcsv&template=' + self.template.encode(),
+            self.fcsv)
+
+        self.assertEqual(status, 200)
+        self.assertTrue(data['valid'])
+        self.assertEqual(data['protocol'], 'human')
+        self.assertEqual(len(data['distances']), 32)
+        self.assertNotIn('figures', data)
+
+    def test_process_pool(self):
+        app = asgi.AsgiApp(
+            db_executor=concurrent.futures.ThreadPoolExecutor(1))
+        try:
+            status, data = call(
+                app, 'POST', '/api/validate',
+                b'filename=valid.fcsv&template=' + self.template.encode(),
+                self.fcsv)
+            # Workers are started like the figure pool's, not forked
+            self.assertEqual(
+                app.cpu_executor._mp_context.get_start_method(),
+                visualizations.FIGURE_START_METHOD)
+        finally:
+            app.shutdown()
+
+        self.assertEqual(status, 200)
+        self.assertTrue(data['valid'])
+
+    def test_gzip(self):
+        body = gzip.compress(self.fcsv)
+        for query, headers in (
+                (b'filename=valid.fcsv.gz', ()),
+                (b'filename=valid.fcsv', [(b'content-encoding', b'gzip')])):
+            status, data = call(
+                self.app, 'POST', '/api/validate', query, body,
+                headers=headers)
+            self.assertEqual(status, 200)
+            self.assertTrue(data['valid'])
+
+    def test_gzip_bomb(self):
+        body = gzip.compress(b' ' * (8 << 20))
+        status, data = call(
+            self.app, 'POST', '/api/validate', b'filename=bomb.fcsv.gz', body)
+
+        self.assertEqual(status, 422)
+        self.assertIn('compressed more than', data['error'])
+
+    def test_invalid(self):
+        status, data = call(
+            self.app, 'POST', '/api/validate', b'filename=bad.fcsv',
+            b'not an fcsv\n')
+
+        self.assertEqual(status, 422)
+        self.assertFalse(data['valid'])
+
+    def test_too_large(self):
+        self.app.max_upload_size = 100
+        status, data = call(
+            self.app, 'POST', '/api/validate', b'filename=valid.fcsv',
+            self.fcsv)
+
+        self.assertEqual(status, 413)
+
+    def test_store_and_query(self):
+        query = b'filename=valid.fcsv&store=1&template=' \
+            + self.template.encode()
+        first = call(self.app, 'POST', '/api/validate', query, self.fcsv)
+        second = call(self.app, 'POST', '/api/validate', query, self.fcsv)
+        status, data = call(
+            self.app, 'GET', '/api/sets',
+            b'template=' + self.template.encode())
+
+        self.assertTrue(first[1]['stored'])
+        self.assertFalse(second[1]['stored'])
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['sets']), 1)
+        self.assertEqual(data['sets'][0]['source'], 'valid.fcsv')
+
+    def test_bad_query(self):
+        status, data = call(self.app, 'GET', '/api/sets', b'since=soon')
+
+        self.assertEqual(status, 400)
+        status, data = call(self.app, 'GET', '/api/sets', b'limit=0')
+
+        self.assertEqual(status, 400)
+
+    def test_routes(self):
+        self.assertEqual(
+            call(self.app, 'GET', '/api/templates')[1]['templates'],
+            asgi.template_store.names())
+        self.assertEqual(call(self.app, 'GET', '/api/validate')[0], 405)
+        self.assertEqual(call(self.app, 'GET', '/api/missing')[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import gzip
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+import controller
+from bulk_import import (
+    import_fcsv,
+    iter_sources,
+    parse_source,
+    store_sets,
+)
+from controller import db, FiducialSet
+
+FILES = ('valid.fcsv', 'valid_flip.fcsv', 'too_few_rows.fcsv')
+
+
+class TestSources(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'source')
+        os.makedirs(os.path.join(self.source, 'site'))
+        for name in FILES:
+            shutil.copy(os.path.join('test/resources', name),
+                        os.path.join(self.source, 'site'))
+        with open(os.path.join(self.source, 'notes.txt'), 'w') as notes:
+            notes.write('not an AFIDs file\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected_names(self):
+        return sorted('site/' + name for name in FILES)
+
+    def test_directory(self):
+        items = list(iter_sources(self.source))
+
+        self.assertEqual([name for name, _, _ in items],
+                         self.expected_names())
+        for name, path, data in items:
+            self.assertEqual(path, os.path.join(self.source, name))
+            self.assertIsNone(data)
+
+    def test_zip(self):
+        path = os.path.join(self.tmpdir, 'source.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for name in self.expected_names() + ['notes.txt']:
+                archive.write(os.path.join(self.source, name), name)
+
+        items = list(iter_sources(path))
+
+        self.assertEqual(sorted(name for name, _, _ in items),
+                         self.expected_names())
+        with open('test/resources/valid.fcsv', 'rb') as fcsv:
+            self.assertEqual(dict((name, data) for name, _, data in items)[
+                'site/valid.fcsv'], fcsv.read())
+
+    def test_tar(self):
+        path = os.path.join(self.tmpdir, 'source.tar.gz')
+        with tarfile.open(path, 'w:gz') as archive:
+            archive.add(self.source, 'source')
+
+        items = list(iter_sources(path))
+
+        self.assertEqual(sorted(name for name, _, _ in items),
+                         ['source/' + name for name in self.expected_names()])
+        self.assertTrue(all(path is None for _, path, _ in items))
+
+    def test_not_a_source(self):
+        with self.assertRaises(ValueError):
+            list(iter_sources(os.path.join(self.source, 'notes.txt')))
+
+    def test_parse_source(self):
+        name, afids, error = parse_source(
+            ('valid.fcsv', 'test/resources/valid.fcsv', None))
+        self.assertEqual(name, 'valid.fcsv')
+        self.assertEqual(afids.protocol.key, 'human')
+        self.assertIsNone(error)
+
+        with open('test/resources/too_few_rows.fcsv', 'rb') as fcsv:
+            data = fcsv.read()
+        self.assertEqual(parse_source(('bad.fcsv', None, data)),
+                         ('bad.fcsv', None, 'Too few rows'))
+
+        name, afids, error = parse_source(
+            ('gone.fcsv', os.path.join(self.tmpdir, 'gone.fcsv'), None))
+        self.assertIsNone(afids)
+        self.assertIn('No such file', error)
+
+
+class TestImport(unittest.TestCase):
+    def setUp(self):
+        self.context = controller.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.source = tempfile.mkdtemp()
+        for name in FILES:
+            shutil.copy(os.path.join('test/resources', name), self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_store_sets(self):
+        results = [parse_source((name, path, data))
+                   for name, path, data in iter_sources(self.source)]
+        # valid.fcsv again, under another name
+        results.append(parse_source(
+            ('copy.fcsv', os.path.join(self.source, 'valid.fcsv'), None)))
+        progress = []
+
+        num_imported, rejected = store_sets(
+            results, batch_size=1, progress=progress.append)
+
+        self.assertEqual(num_imported, 2)
+        self.assertEqual(
+            sorted(rejected),
+            [('copy.fcsv', 'Duplicate of a stored set'),
+             ('too_few_rows.fcsv', 'Too few rows')])
+        self.assertEqual(FiducialSet.query.count(), 2)
+        self.assertEqual(
+            sorted(fset.source for fset in FiducialSet.query),
+            ['valid.fcsv', 'valid_flip.fcsv'])
+        # One report per full batch
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(progress[-1]['num_imported'], 2)
+
+    def check_import(self, jobs):
+        num_imported, rejected = import_fcsv(self.source, jobs=jobs)
+
+        self.assertEqual(num_imported, 2)
+        self.assertEqual(rejected, [('too_few_rows.fcsv', 'Too few rows')])
+        self.assertEqual(FiducialSet.query.count(), 2)
+
+        # Importing again stores nothing new
+        num_imported, rejected = import_fcsv(self.source, jobs=jobs)
+        self.assertEqual(num_imported, 0)
+        self.assertEqual(len(rejected), 3)
+
+    def test_import_serial(self):
+        self.check_import(1)
+
+    def test_import_pool(self):
+        self.check_import(2)
+
+    def test_import_long_csv(self):
+        num_imported, rejected = import_fcsv(
+            'test/resources/long_format.csv')
+
+        self.assertEqual(num_imported, 2)
+        self.assertEqual(
+            rejected,
+            [('test/resources/long_format.csv:sub-02',
+              'Row label 2 does not match row description dummy')])
+
+    def test_import_gzipped_files(self):
+        with open(os.path.join(self.source, 'valid.fcsv'), 'rb') as fcsv:
+            data = gzip.compress(fcsv.read())
+        path = os.path.join(self.source, 'cohort.tar')
+        with tarfile.open(path, 'w') as archive:
+            info = tarfile.TarInfo('sub-01.fcsv.gz')
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+
+        self.assertEqual(import_fcsv(path, jobs=1), (1, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
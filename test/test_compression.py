@@ -0,0 +1,84 @@
+import gzip
+import io
+import unittest
+
+import controller
+from compression import DecompressionError, GzipReader, gzip_bytes
+
+
+class TestGzipBytes(unittest.TestCase):
+    def test_reproducible(self):
+        data = b'0123456789' * 1000
+        compressed = gzip_bytes(data)
+
+        self.assertEqual(gzip.decompress(compressed), data)
+        self.assertEqual(gzip_bytes(data), compressed)
+        # The header's mtime field is zero
+        self.assertEqual(compressed[4:8], b'\0\0\0\0')
+
+
+class TestGzipReader(unittest.TestCase):
+    def test_streams(self):
+        data = b'0123456789' * 10000
+        reader = GzipReader(
+            io.BytesIO(gzip.compress(data) + gzip.compress(data)),
+            max_ratio=None, chunk_size=256)
+
+        first = reader.read(1000)
+        # Only a little compressed data is read to produce some output
+        self.assertEqual(first, data[:1000])
+        self.assertLess(reader.bytes_in, 1024)
+        self.assertEqual(first + reader.readall(), data * 2)
+
+    def test_ratio(self):
+        reader = GzipReader(io.BytesIO(gzip.compress(b'\0' * (64 << 20))))
+        with self.assertRaises(DecompressionError) as cm:
+            reader.readall()
+        self.assertTrue(cm.exception.too_large)
+        # Stopped long before decompressing the whole bomb
+        self.assertLess(reader.bytes_out, 4 << 20)
+
+
+class TestGzipRequests(unittest.TestCase):
+    def setUp(self):
+        self.client = controller.app.test_client()
+        with open('test/resources/valid.fcsv', 'rb') as fcsv:
+            self.data = fcsv.read()
+
+    def test_gzip_file(self):
+        response = self.client.post(
+            '/validator.html',
+            data={'filename': (io.BytesIO(gzip.compress(self.data)),
+                               'valid.fcsv.gz'),
+                  'fid_template': 'Validate .fcsv file structure'},
+            content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Valid file', response.get_data(as_text=True))
+
+    def encoded_post(self, body):
+        """POST a multipart body sent with Content-Encoding: gzip."""
+        boundary = 'xyz'
+        form = b''.join([
+            b'--xyz\r\nContent-Disposition: form-data;'
+            b' name="fid_template"\r\n\r\n'
+            b'Validate .fcsv file structure\r\n',
+            b'--xyz\r\nContent-Disposition: form-data; name="filename";'
+            b' filename="valid.fcsv"\r\n\r\n', body, b'\r\n--xyz--\r\n'])
+        return self.client.post(
+            '/validator.html', data=gzip.compress(form),
+            headers={'Content-Encoding': 'gzip'},
+            content_type='multipart/form-data; boundary=' + boundary)
+
+    def test_content_encoding(self):
+        response = self.encoded_post(self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Valid file', response.get_data(as_text=True))
+
+    def test_content_encoding_bomb(self):
+        response = self.encoded_post(b' ' * (32 << 20))
+        self.assertEqual(response.status_code, 413)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+import controller
+import jobs
+from controller import db, FiducialSet
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = jobs.JobQueue(os.path.join(self.tmpdir, 'jobs.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_submit_and_claim(self):
+        first = self.queue.submit('validate', {'path': 'a.zip'})
+        second = self.queue.submit('import', {'path': 'b.zip'})
+
+        job = self.queue.claim()
+        self.assertEqual(job['id'], first)
+        self.assertEqual(job['status'], 'running')
+        self.assertEqual(job['payload'], {'path': 'a.zip'})
+        self.assertEqual(self.queue.claim()['id'], second)
+        self.assertIsNone(self.queue.claim())
+
+    def test_complete_and_fail(self):
+        done = self.queue.submit('validate', {})
+        failed = self.queue.submit('validate', {})
+        self.queue.report_progress(done, {'processed': 100})
+        self.queue.complete(done, {'num_valid': 3})
+        self.queue.fail(failed, 'Broken archive')
+
+        job = self.queue.get(done)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['progress'], {'processed': 100})
+        self.assertEqual(job['result'], {'num_valid': 3})
+        self.assertEqual(self.queue.get(failed)['error'], 'Broken archive')
+        self.assertIsNone(self.queue.get('missing'))
+
+    def test_requeue_stale(self):
+        job_id = self.queue.submit('import', {})
+        self.queue.claim()
+
+        self.assertEqual(self.queue.requeue_stale(60), 0)
+        time.sleep(0.01)
+        self.assertEqual(self.queue.requeue_stale(0), 1)
+        self.assertEqual(self.queue.claim()['id'], job_id)
+
+
+class TestRunWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.queue = jobs.JobQueue(os.path.join(self.tmpdir, 'jobs.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_run_once(self):
+        def double(queue, job):
+            return {'value': job['payload']['value'] * 2}
+
+        def broken(queue, job):
+            raise jobs.JobError('Bad payload')
+
+        def crashing(queue, job):
+            raise KeyError('secret internals')
+
+        ok = self.queue.submit('double', {'value': 21})
+        error = self.queue.submit('broken', {})
+        crash = self.queue.submit('crashing', {})
+        unknown = self.queue.submit('missing', {})
+
+        with self.assertLogs('jobs', 'ERROR') as logs:
+            jobs.run_worker(
+                self.queue,
+                {'double': double, 'broken': broken, 'crashing': crashing},
+                once=True)
+
+        self.assertEqual(self.queue.get(ok)['result'], {'value': 42})
+        self.assertEqual(self.queue.get(error)['status'], 'failed')
+        self.assertEqual(self.queue.get(error)['error'], 'Bad payload')
+        self.assertEqual(self.queue.get(crash)['status'], 'failed')
+        self.assertNotIn('secret', self.queue.get(crash)['error'])
+        self.assertIn('secret internals', logs.output[0])
+        self.assertEqual(
+            self.queue.get(unknown)['error'], 'Unknown job kind missing')
+
+    def test_heartbeat(self):
+        def slow(queue, job):
+            time.sleep(0.3)
+            # Another worker would find the job alive
+            return {'requeued': queue.requeue_stale(0.1)}
+
+        job_id = self.queue.submit('slow', {})
+        jobs.run_worker(
+            self.queue, {'slow': slow}, stale_timeout=0.1, once=True)
+
+        self.assertEqual(self.queue.get(job_id)['result'], {'requeued': 0})
+
+
+
+class TestJobEndpoints(unittest.TestCase):
+    def setUp(self):
+        self.context = controller.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.client = controller.app.test_client()
+
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as out_zip:
+            out_zip.write('test/resources/valid.fcsv', 'sub-01.fcsv')
+            out_zip.write('test/resources/too_few_rows.fcsv', 'sub-02.fcsv')
+        self.archive = archive.getvalue()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def submit(self, data=None, filename='cohort.zip', **form):
+        form['filename'] = (io.BytesIO(
+            self.archive if data is None else data), filename)
+        return self.client.post(
+            '/jobs', data=form, content_type='multipart/form-data')
+
+    def run_jobs(self):
+        jobs.run_worker(controller.job_queue, jobs.JOB_HANDLERS, once=True)
+
+    def test_validate(self):
+        response = self.submit(kind='validate', fid_template='MNI2009cAsym')
+        self.assertEqual(response.status_code, 202)
+        status_url = response.get_json()['status_url']
+        self.assertEqual(response.headers['Location'], status_url)
+        self.assertEqual(
+            self.client.get(status_url).get_json()['status'], 'queued')
+
+        self.run_jobs()
+
+        job = self.client.get(status_url).get_json()
+        self.assertEqual(job['status'], 'done')
+        self.assertNotIn('payload', job)
+        self.assertEqual(job['result']['num_valid'], 1)
+        self.assertEqual(job['result']['rejected'],
+                         [['sub-02.fcsv', 'Too few rows']])
+
+        lines = self.client.get(job['result_url']).get_data(
+            as_text=True).splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['name', 'AC', 'PC'])
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1].split(',')[0], 'sub-01.fcsv')
+
+    def test_import(self):
+        status_url = self.submit(kind='import').get_json()['status_url']
+
+        self.run_jobs()
+
+        job = self.client.get(status_url).get_json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result']['num_imported'], 1)
+        self.assertEqual(job['result']['num_rejected'], 1)
+        self.assertEqual(FiducialSet.query.count(), 1)
+        self.assertEqual(
+            self.client.get(status_url + '/result').status_code, 404)
+
+    def test_long_csv_names(self):
+        with open('test/resources/long_format.csv', 'rb') as in_csv:
+            data = in_csv.read()
+        validate_url = self.submit(
+            data, 'cohort.csv', kind='validate',
+            fid_template='MNI2009cAsym').get_json()['status_url']
+        import_url = self.submit(
+            data, 'cohort.csv', kind='import').get_json()['status_url']
+
+        self.run_jobs()
+        self.run_jobs()
+
+        upload_dir = controller.JOB_UPLOAD_DIR
+        for status_url in (validate_url, import_url):
+            response = self.client.get(status_url)
+            job = response.get_json()
+            self.assertEqual(job['status'], 'done')
+            self.assertEqual(
+                job['result']['rejected'],
+                [['cohort.csv:sub-02',
+                  'Row label 2 does not match row description dummy']])
+            # Names come from the upload, not its path on the server
+            self.assertNotIn(upload_dir, response.get_data(as_text=True))
+
+        result = self.client.get(validate_url + '/result').get_data(
+            as_text=True)
+        self.assertNotIn(upload_dir, result)
+        self.assertEqual(
+            [line.split(',')[0] for line in result.splitlines()[1:]],
+            ['cohort.csv:sub-01', 'cohort.csv:sub-03'])
+        self.assertEqual(
+            sorted(fiducial_set.source
+                   for fiducial_set in FiducialSet.query.all()),
+            ['cohort.csv:sub-01', 'cohort.csv:sub-03'])
+
+    def test_not_an_archive(self):
+        with open('test/resources/valid.fcsv', 'rb') as fcsv:
+            response = self.submit(
+                fcsv.read(), kind='validate', fid_template='MNI2009cAsym')
+        status_url = response.get_json()['status_url']
+
+        self.run_jobs()
+
+        job = self.client.get(status_url).get_json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(
+            job['error'],
+            'The upload is not a zip or tar archive or a long-format csv')
+
+    def test_bad_submissions(self):
+        self.assertEqual(self.submit(kind='delete').status_code, 400)
+        self.assertEqual(
+            self.submit(kind='validate', fid_template='nowhere').status_code,
+            400)
+        response = self.client.post(
+            '/jobs', data={'kind': 'import'},
+            content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['error'], 'No file uploaded')
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/jobs/missing').status_code, 404)
+        self.assertEqual(
+            self.client.get('/jobs/missing/result').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import sqlalchemy
+
+import controller
+from controller import db
+
+try:
+    import flask_migrate
+except ImportError:
+    flask_migrate = None
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'migrations')
+
+
+@unittest.skipIf(flask_migrate is None, 'Flask-Migrate is not installed')
+class TestSqliteMigrations(unittest.TestCase):
+    """Run every migration up and down on a fresh SQLite database."""
+
+    @classmethod
+    def setUpClass(cls):
+        if 'migrate' not in controller.app.extensions:
+            # As manage.py configures it
+            flask_migrate.Migrate(controller.app, db, render_as_batch=True)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.url = 'sqlite:///' + os.path.join(self.tmpdir, 'migrated.db')
+        self.engine = sqlalchemy.create_engine(self.url)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def migrate(self, command, revision):
+        with mock.patch.dict(controller.app.config,
+                             {'SQLALCHEMY_DATABASE_URI': self.url}), \
+                controller.app.app_context():
+            command(directory=MIGRATIONS_DIR, revision=revision)
+
+    def schema(self):
+        """Columns, plain indexes and unique columns of each app table."""
+        inspector = sqlalchemy.inspect(self.engine)
+        schema = {}
+        for table in inspector.get_table_names():
+            if table == 'alembic_version':
+                continue
+            indexes = inspector.get_indexes(table)
+            unique = [index['column_names'] for index in indexes
+                      if index['unique']]
+            unique += [constraint['column_names'] for constraint
+                       in inspector.get_unique_constraints(table)]
+            schema[table] = (
+                sorted(column['name']
+                       for column in inspector.get_columns(table)),
+                sorted(index['name'] for index in indexes
+                       if not index['unique']),
+                sorted(unique))
+        return schema
+
+    def test_upgrade_matches_models(self):
+        self.migrate(flask_migrate.upgrade, 'head')
+
+        # A unique column may be a unique index or a unique constraint
+        expected = {
+            table.name: (
+                sorted(column.name for column in table.columns),
+                sorted(index.name for index in table.indexes
+                       if not index.unique),
+                sorted([column.name for column in constraint.columns]
+                       for constraint in table.constraints
+                       if isinstance(constraint,
+                                     sqlalchemy.UniqueConstraint)))
+            for table in db.metadata.sorted_tables}
+        self.assertEqual(self.schema(), expected)
+
+    def test_downgrade_and_upgrade_again(self):
+        self.migrate(flask_migrate.upgrade, 'head')
+        upgraded = self.schema()
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.text(
+                "INSERT INTO fid_db (id, \"AC_x\", template, content_hash)"
+                " VALUES (1, 1.5, 'MNI2009cAsym', 'abc')"))
+
+        # Downgrades keep the rows, though SQLite rebuilds the table
+        self.migrate(flask_migrate.downgrade, 'd0a243e71ea2')
+        with self.engine.connect() as conn:
+            self.assertEqual(
+                conn.execute(sqlalchemy.text(
+                    'SELECT id, "AC_x" FROM fid_db')).fetchall(),
+                [(1, 1.5)])
+
+        self.migrate(flask_migrate.downgrade, 'base')
+        self.assertEqual(self.schema(), {})
+
+        self.migrate(flask_migrate.upgrade, 'head')
+        self.assertEqual(self.schema(), upgraded)
+
+
+@unittest.skipUnless(os.environ.get('TEST_POSTGRES_URL'),
+                     'TEST_POSTGRES_URL is not set')
+class TestPostgresMigrations(TestSqliteMigrations):
+    """Run every migration up and down on an empty Postgres database."""
+
+    def setUp(self):
+        self.url = os.environ['TEST_POSTGRES_URL']
+        self.engine = sqlalchemy.create_engine(self.url)
+
+    def tearDown(self):
+        self.migrate(flask_migrate.downgrade, 'base')
+        with self.engine.begin() as conn:
+            conn.execute(sqlalchemy.text(
+                'DROP TABLE IF EXISTS alembic_version'))
+        self.engine.dispose()
+
+
+if __name__ == '__main__':
+    unittest.main()
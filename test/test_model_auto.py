@@ -1,3 +1,5 @@
+import gzip
+import io
 import unittest
 import model_auto
 import json
@@ -15,6 +17,162 @@ class TestFcsvValidation(unittest.TestCase):
         self.assertEqual(float(fcsv_data["1"]["x"]), -0.07077182344203692)
         self.assertEqual(float(fcsv_data["1"]["y"]), 0.2548674381652525)
 
+    def test_valid_nhp(self):
+        with open('test/resources/valid_nhp.fcsv', 'r') as fcsv:
+            fcsv_json = model_auto.csv_to_json(fcsv, 'nhp')
+            fcsv_data = json.loads(fcsv_json)
+
+        self.assertEqual(fcsv_data["10"]["desc"], 'Culmen')
+
+    def test_detect_protocol(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            afids = model_auto.parse_fcsv(fcsv)
+        with open('test/resources/valid_nhp.fcsv', 'r') as fcsv:
+            nhp_afids = model_auto.parse_fcsv(fcsv)
+
+        self.assertEqual(afids.protocol.key, 'human')
+        self.assertEqual(nhp_afids.protocol.key, 'nhp')
+
+    def test_implausible_acpc(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            text = fcsv.read()
+
+        for pc in ('-0.1,2.274982,-4.279742', '-0.1,-75.3942,-0.8968918'):
+            with self.subTest(pc=pc):
+                fcsv = io.StringIO(
+                    text.replace('-0.13710872,-25.3942,-0.8968918', pc))
+                with self.assertLogs('model_auto', 'WARNING') as logs:
+                    afids = model_auto.parse_fcsv(fcsv)
+
+                # Neither range fits, so the default is assumed, with a
+                # warning
+                self.assertEqual(afids.protocol.key, 'human')
+                self.assertIn('fits no protocol', logs.output[0])
+
+    def test_parse_fcsv(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            afids = model_auto.parse_fcsv(fcsv)
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            fcsv_data = json.loads(model_auto.csv_to_json(fcsv))
+
+        self.assertEqual(afids.coords.shape, (32, 3))
+        self.assertEqual(afids.descs[2], 'infracollicular sulcus')
+        self.assertEqual(afids.coords[0][0], -0.0759772)
+        self.assertEqual(len(fcsv_data), 32)
+        self.assertEqual(fcsv_data['1'], {
+            'desc': 'AC', 'x': '-0.0759772', 'y': '3.274982',
+            'z': '-4.279742'})
+        self.assertEqual(fcsv_data['2'], {
+            'desc': 'PC', 'x': '-0.13710872', 'y': '-25.3942',
+            'z': '-0.8968918'})
+        self.assertEqual(list(afids.distances_to(afids)), [0.0] * 32)
+
+    def test_json_coordinates(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            text = fcsv.read().replace(
+                ',-0.0759772,3.274982,-4.279742,', ',-0.07597720,3,4.2e1,')
+        fcsv_data = json.loads(model_auto.csv_to_json(io.StringIO(text)))
+
+        # Coordinates are written as parsed, not as spelled in the file
+        self.assertEqual(fcsv_data['1'], {
+            'desc': 'AC', 'x': '-0.0759772', 'y': '3.0', 'z': '42.0'})
+
+    def test_valid_mrk_json(self):
+        with open('test/resources/valid.mrk.json', 'r') as mrk_json:
+            afids = model_auto.parse_afids(mrk_json, 'valid.mrk.json')
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            fcsv_afids = model_auto.parse_fcsv(fcsv)
+
+        self.assertEqual(afids.protocol.key, 'human')
+        self.assertEqual(afids.to_dict(), fcsv_afids.to_dict())
+
+    def test_content_hash(self):
+        with open('test/resources/valid.mrk.json', 'r') as mrk_json:
+            afids = model_auto.parse_afids(mrk_json, 'valid.mrk.json')
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            fcsv_afids = model_auto.parse_fcsv(fcsv)
+        nhp_afids = model_auto.AfidsSet(
+            model_auto.PROTOCOLS['nhp'], fcsv_afids.coords)
+
+        self.assertEqual(len(afids.content_hash()), 64)
+        self.assertEqual(afids.content_hash(), fcsv_afids.content_hash())
+        self.assertNotEqual(
+            nhp_afids.content_hash(), fcsv_afids.content_hash())
+
+    def test_invalid_coord_system_mrk_json(self):
+        with open('test/resources/invalid_coord_system.mrk.json',
+                'r') as mrk_json:
+            with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+                afids = model_auto.parse_mrk_json(mrk_json)
+
+        self.assertEqual(cm.exception.message,
+            'Unsupported coordinate system IJK')
+
+    def test_malformed_mrk_json(self):
+        with open('test/resources/valid.mrk.json', 'r') as mrk_json:
+            valid = json.load(mrk_json)
+
+        def with_markup(**fields):
+            markup = dict(valid['markups'][0], **fields)
+            return {'markups': [markup]}
+
+        def with_point(point):
+            points = valid['markups'][0]['controlPoints']
+            return with_markup(controlPoints=[point] + points[1:])
+
+        point = valid['markups'][0]['controlPoints'][0]
+        cases = [
+            ([1, 2], 'Missing or invalid markups in markups file'),
+            ({'markups': {}}, 'Missing or invalid markups in markups file'),
+            ({'markups': 'abc'}, 'Missing or invalid markups in markups file'),
+            ({'markups': [None]},
+             'Missing or invalid markups in markups file'),
+            (with_markup(coordinateSystem=['LPS']),
+             "Unsupported coordinate system ['LPS']"),
+            (with_markup(controlPoints={}),
+             'Invalid control points in markups file'),
+            (with_point('AC'), 'Control point 1 is not an object'),
+            (with_point(dict(point, description=[])),
+             'Row 1 has no value desc'),
+            (with_point(dict(point, position={})),
+             'Row 1 has no valid position'),
+        ]
+        for data, message in cases:
+            with self.subTest(data=data):
+                with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+                    model_auto.parse_mrk_json(io.StringIO(json.dumps(data)))
+                self.assertEqual(cm.exception.message, message)
+
+    def test_long_csv(self):
+        with open('test/resources/long_format.csv', 'r',
+                newline='') as in_csv:
+            subjects = list(model_auto.iter_long_csv(in_csv))
+
+        self.assertEqual([subject[0] for subject in subjects],
+            ['sub-01', 'sub-02', 'sub-03'])
+        self.assertEqual(subjects[0][1].protocol.key, 'human')
+        self.assertEqual(subjects[0][1].coords[0][0], -0.0759772)
+        self.assertIsNone(subjects[1][1])
+        self.assertEqual(subjects[1][2],
+            'Row label 2 does not match row description dummy')
+        self.assertIsNone(subjects[2][2])
+
+    def test_long_csv_missing_columns(self):
+        with open('test/resources/valid.fcsv', 'r') as in_csv:
+            with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+                list(model_auto.iter_long_csv(in_csv))
+
+        self.assertEqual(cm.exception.message,
+            'Missing columns subject, label, desc, x, y, z in long-format '
+            'file')
+
+    def test_unknown_protocol(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+                fcsv_json = model_auto.csv_to_json(fcsv, 'rodent')
+
+        self.assertEqual(cm.exception.message, 'Unknown protocol rodent')
+
     def test_invalid_version(self):
         with open('test/resources/invalid_version.fcsv', 'r') as fcsv:
             with self.assertRaises(model_auto.InvalidFcsvError) as cm:
@@ -101,5 +259,61 @@ class TestFcsvValidation(unittest.TestCase):
         self.assertEqual(cm.exception.message, 'Too few rows')
 
 
+class TestParseUpload(unittest.TestCase):
+    def setUp(self):
+        with open('test/resources/valid.fcsv', 'rb') as fcsv:
+            self.data = fcsv.read()
+
+    def test_plain(self):
+        afids = model_auto.parse_upload(io.BytesIO(self.data), 'valid.fcsv')
+        self.assertEqual(afids.coords.shape, (32, 3))
+
+    def test_gzip(self):
+        expected = model_auto.parse_upload(
+            io.BytesIO(self.data), 'valid.fcsv')
+        compressed = gzip.compress(self.data)
+
+        afids = model_auto.parse_upload(
+            io.BytesIO(compressed), 'valid.fcsv.gz')
+        self.assertEqual(afids.content_hash(), expected.content_hash())
+        afids = model_auto.parse_upload(
+            io.BytesIO(compressed), 'valid.fcsv', content_encoding='gzip')
+        self.assertEqual(afids.content_hash(), expected.content_hash())
+
+    def test_gzip_mrk_json(self):
+        with open('test/resources/valid.mrk.json', 'rb') as mrk_json:
+            compressed = gzip.compress(mrk_json.read())
+        afids = model_auto.parse_upload(
+            io.BytesIO(compressed), 'valid.mrk.json.gz')
+        self.assertEqual(afids.coords.shape, (32, 3))
+
+    def test_bomb(self):
+        # A valid header, then far more padding than any real file
+        compressed = gzip.compress(self.data[:200] + b' ' * (4 << 20))
+        with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+            model_auto.parse_upload(io.BytesIO(compressed), 'bomb.fcsv.gz')
+        self.assertIn('compressed more than', cm.exception.message)
+
+        with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+            model_auto.parse_upload(
+                io.BytesIO(gzip.compress(self.data)), 'valid.fcsv.gz',
+                max_size=1000)
+        self.assertIn('larger than 1000 bytes', cm.exception.message)
+
+    def test_invalid_gzip(self):
+        compressed = gzip.compress(self.data)
+        for data, message in ((compressed[:-20], 'Truncated gzip data'),
+                              (self.data, 'Invalid gzip data')):
+            with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+                model_auto.parse_upload(io.BytesIO(data), 'valid.fcsv.gz')
+            self.assertEqual(cm.exception.message, message)
+
+    def test_not_utf8(self):
+        with self.assertRaises(model_auto.InvalidFcsvError) as cm:
+            model_auto.parse_upload(
+                io.BytesIO(gzip.compress(b'\xff\xfe' * 100)), 'bad.fcsv.gz')
+        self.assertEqual(cm.exception.message, 'Not UTF-8 text')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import page_cache
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.template = os.path.join(self.directory, 'page.html')
+        with open(self.template, 'w') as out_file:
+            out_file.write('first')
+        self.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self):
+        self.renders += 1
+        with open(self.template, 'r') as in_file:
+            return in_file.read()
+
+    def test_cached(self):
+        cache = page_cache.PageCache(check_interval=0)
+        first = cache.get('page', self.render, [self.directory])
+        second = cache.get('page', self.render, [self.directory])
+
+        self.assertIs(first, second)
+        self.assertEqual(self.renders, 1)
+        self.assertEqual(first.body, b'first')
+
+    def test_invalidated(self):
+        cache = page_cache.PageCache(check_interval=0)
+        first = cache.get('page', self.render, [self.directory])
+        with open(self.template, 'w') as out_file:
+            out_file.write('second, longer')
+        second = cache.get('page', self.render, [self.directory])
+
+        self.assertEqual(self.renders, 2)
+        self.assertEqual(second.body, b'second, longer')
+        self.assertNotEqual(first.etag, second.etag)
+
+    def test_new_file_invalidates(self):
+        cache = page_cache.PageCache(check_interval=0)
+        cache.get('page', self.render, [self.directory])
+        with open(os.path.join(self.directory, 'new.fcsv'), 'w'):
+            pass
+        cache.get('page', self.render, [self.directory])
+
+        self.assertEqual(self.renders, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import controller
+import model_auto
+import population
+from controller import db, FiducialSet
+
+
+class TestPopulationStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = population.PopulationStore(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_empty(self):
+        ids, coords = self.store.open()
+
+        self.assertEqual(len(self.store), 0)
+        self.assertIsNone(self.store.last_id())
+        self.assertEqual(coords.shape, (0, 32, 3))
+
+    def test_append(self):
+        first = np.random.rand(2, 32, 3)
+        second = np.random.rand(3, 32, 3)
+        self.store.append([1, 2], first)
+        size = os.path.getsize(self.store.coords_path)
+        self.store.append([4, 7, 9], second)
+
+        ids, coords = self.store.open()
+        self.assertIsInstance(coords, np.memmap)
+        self.assertEqual(list(ids), [1, 2, 4, 7, 9])
+        self.assertEqual(self.store.last_id(), 9)
+        np.testing.assert_array_equal(coords[:2], first)
+        np.testing.assert_array_equal(coords[2:], second)
+        self.assertEqual(os.path.getsize(self.store.coords_path),
+                         size + second.nbytes)
+
+    def test_plain_npy(self):
+        self.store.append([3], np.ones((1, 32, 3)))
+
+        self.assertEqual(np.load(self.store.coords_path).shape, (1, 32, 3))
+
+    def test_length_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.store.append([1, 2], np.ones((1, 32, 3)))
+
+
+class TestAggregates(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'aggregates.npz')
+        self.coords = np.random.RandomState(0).normal(size=(50, 32, 3))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def aggregate(self, coords):
+        sums = [np.zeros(32), np.zeros((32, 3)), np.zeros((32, 3, 3))]
+        for start in range(0, len(coords), 16):
+            population._accumulate(sums, coords[start:start + 16])
+        return population.LandmarkAggregates.from_sums(*sums)
+
+    def test_from_sums(self):
+        self.coords[0, 5] = np.nan
+        aggregates = self.aggregate(self.coords)
+
+        self.assertEqual(aggregates.count[0], 50)
+        self.assertEqual(aggregates.count[5], 49)
+        np.testing.assert_allclose(
+            aggregates.centroid[0], self.coords[:, 0].mean(axis=0))
+        np.testing.assert_allclose(
+            aggregates.covariance[0], np.cov(self.coords[:, 0].T))
+        np.testing.assert_allclose(
+            aggregates.covariance[5], np.cov(self.coords[1:, 5].T))
+
+    def test_save_and_reload(self):
+        aggregates_file = population.AggregatesFile(
+            self.path, check_interval=0)
+        self.assertIsNone(aggregates_file.get('MNI', 'human'))
+
+        population.save_aggregates(
+            self.path, {('MNI', 'human'): self.aggregate(self.coords),
+                        ('MNI', 'nhp'): self.aggregate(self.coords / 2)})
+        loaded = aggregates_file.get('MNI', 'human')
+
+        np.testing.assert_allclose(
+            loaded.centroid, self.coords.mean(axis=0))
+        np.testing.assert_allclose(
+            aggregates_file.get('MNI', 'nhp').centroid,
+            self.coords.mean(axis=0) / 2)
+        self.assertIs(aggregates_file.get('MNI', 'human'), loaded)
+        self.assertIsNone(aggregates_file.get('PD25', 'human'))
+
+    def test_unsplit_file(self):
+        aggregates = self.aggregate(self.coords)
+        np.savez(self.path, templates=np.array(['MNI']),
+                 count=np.array([aggregates.count]),
+                 centroid=np.array([aggregates.centroid]),
+                 covariance=np.array([aggregates.covariance]))
+
+        # Aggregates mixing protocols are not used
+        self.assertEqual(population.load_aggregates(self.path), {})
+
+
+class TestAggregateByTemplate(unittest.TestCase):
+    def setUp(self):
+        self.context = controller.app.app_context()
+        self.context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_split_by_protocol(self):
+        coords = np.random.RandomState(0).normal(size=(4, 32, 3))
+        protocols = ['human', 'human', 'nhp', None]
+        FiducialSet.insert_new([
+            FiducialSet.columns_from_afids(
+                model_auto.AfidsSet(
+                    model_auto.PROTOCOLS[protocol or 'human'], set_coords),
+                template='MNI', protocol=protocol)
+            for set_coords, protocol in zip(coords, protocols)])
+
+        aggregates = population.aggregate_by_template()
+
+        self.assertEqual(
+            sorted(aggregates), [('MNI', 'human'), ('MNI', 'nhp')])
+        # Sets stored without a protocol count as human
+        self.assertEqual(aggregates['MNI', 'human'].count[0], 3)
+        np.testing.assert_allclose(
+            aggregates['MNI', 'human'].centroid,
+            coords[[0, 1, 3]].mean(axis=0))
+        np.testing.assert_allclose(
+            aggregates['MNI', 'nhp'].centroid, coords[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
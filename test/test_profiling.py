@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask
+
+import profiling
+
+
+class TestProfileRequest(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.app = Flask(__name__)
+        self.app.config.update(
+            PROFILING_ENABLED=True,
+            PROFILE_HEADER='X-AFIDs-Profile',
+            PROFILE_DIR=self.profile_dir,
+            PROFILE_TOP=5)
+
+        @self.app.route('/')
+        @profiling.profile_request
+        def index():
+            return 'x' * sum(range(1000))
+
+        @self.app.route('/fail')
+        @profiling.profile_request
+        def fail():
+            raise ValueError('view failed')
+
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def test_without_header(self):
+        response = self.client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_with_header(self):
+        response = self.client.get(
+            '/', headers={'X-AFIDs-Profile': 'slow upload!'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_data()), sum(range(1000)))
+        name = response.headers['X-Profile-Id']
+        # The tag is kept, stripped of unsafe characters
+        self.assertRegex(name, r'^\d{8}T\d{12}Z_slowupload$')
+        self.assertEqual(sorted(os.listdir(self.profile_dir)),
+                         [name + '.prof', name + '.txt'])
+
+        with open(os.path.join(self.profile_dir, name + '.txt')) as summary:
+            text = summary.read()
+        self.assertTrue(text.startswith('GET /\n'))
+        self.assertIn('Top 5 functions by cumulative time', text)
+        self.assertIn('Peak traced memory', text)
+
+    def test_plain_tag(self):
+        response = self.client.get('/', headers={'X-AFIDs-Profile': '1'})
+
+        self.assertRegex(response.headers['X-Profile-Id'], r'^\d{8}T\d{12}Z$')
+
+    def test_disabled(self):
+        self.app.config['PROFILING_ENABLED'] = False
+        response = self.client.get('/', headers={'X-AFIDs-Profile': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_unwritable(self):
+        # A file where the profile directory should be
+        profile_dir = os.path.join(self.profile_dir, 'file')
+        open(profile_dir, 'w').close()
+        self.app.config['PROFILE_DIR'] = profile_dir
+
+        with self.assertLogs(self.app.logger, 'ERROR'):
+            response = self.client.get(
+                '/', headers={'X-AFIDs-Profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_data()), sum(range(1000)))
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+        # The view's own error is not replaced by the profile's
+        self.app.config['PROPAGATE_EXCEPTIONS'] = True
+        with self.assertLogs(self.app.logger, 'ERROR'):
+            with self.assertRaisesRegex(ValueError, 'view failed'):
+                self.client.get('/fail', headers={'X-AFIDs-Profile': '1'})
+
+    def test_busy(self):
+        # Another thread is profiling a request
+        with profiling._profiling_lock:
+            response = self.client.get(
+                '/', headers={'X-AFIDs-Profile': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+import numpy as np
+
+from model_auto import EXPECTED_DESCS, parse_fcsv
+from qc_metrics import QC_TABLES, QcTables, afids_metrics, qc_metrics
+
+
+def symmetric_set(seed=0):
+    """A random set, symmetric about the plane x = 0."""
+    rng = np.random.RandomState(seed)
+    coords = rng.uniform(-40, 40, (32, 3))
+    coords[QC_TABLES.midline, 0] = 0
+    coords[QC_TABLES.pairs[:, 1]] = (
+        coords[QC_TABLES.pairs[:, 0]] * [-1, 1, 1])
+    return coords
+
+
+def rotation(angle):
+    """Rotation about the z axis."""
+    cos, sin = np.cos(angle), np.sin(angle)
+    return np.array([[cos, -sin, 0], [sin, cos, 0], [0, 0, 1]])
+
+
+class TestQcTables(unittest.TestCase):
+    def test_tables(self):
+        tables = QcTables(EXPECTED_DESCS)
+        self.assertEqual(len(tables.pair_names), 11)
+        self.assertIn('RMB/LMB', tables.pair_names)
+        self.assertIn('RLVAC/LLVAC', tables.pair_names)
+        for right, left in tables.pairs:
+            self.assertTrue(EXPECTED_DESCS[right][0].startswith('R '))
+            self.assertEqual(EXPECTED_DESCS[left][0],
+                             'L ' + EXPECTED_DESCS[right][0][2:])
+        self.assertEqual(
+            [EXPECTED_DESCS[num][-1] for num in tables.midline],
+            ['AC', 'PC', 'ICS', 'PMJ', 'GENU', 'SPLE'])
+
+
+class TestQcMetrics(unittest.TestCase):
+    def test_symmetric_set(self):
+        coords = symmetric_set()
+        metrics = qc_metrics(coords)
+        self.assertAlmostEqual(
+            metrics['acpc'], np.linalg.norm(coords[0] - coords[1]))
+        np.testing.assert_allclose(
+            metrics['midline_deviation'], 0, atol=1e-9)
+        np.testing.assert_allclose(metrics['asymmetry'], 0, atol=1e-9)
+
+    def test_asymmetry(self):
+        coords = symmetric_set()
+        right, left = QC_TABLES.pairs[2]
+        coords[left, 1] += 3
+        metrics = qc_metrics(coords)
+        self.assertAlmostEqual(metrics['asymmetry'][2], 3)
+        np.testing.assert_allclose(
+            np.delete(metrics['asymmetry'], 2), 0, atol=1e-9)
+
+    def test_rigid_motion(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            coords = parse_fcsv(fcsv).coords
+        moved = coords.dot(rotation(0.3).T) + [10, -5, 2]
+        metrics = qc_metrics(coords)
+        for name, values in qc_metrics(moved).items():
+            np.testing.assert_allclose(values, metrics[name], atol=1e-9)
+
+    def test_batch(self):
+        batch = np.stack([symmetric_set(seed) for seed in range(5)])
+        batch[1, 0] = np.nan
+        metrics = qc_metrics(batch)
+        self.assertEqual(metrics['acpc'].shape, (5,))
+        self.assertEqual(metrics['midline_deviation'].shape, (5, 6))
+        self.assertEqual(metrics['asymmetry'].shape, (5, 11))
+
+        self.assertTrue(np.isnan(metrics['acpc'][1]))
+        self.assertTrue(np.isnan(metrics['asymmetry'][1]).all())
+        for num in (0, 2, 3, 4):
+            single = qc_metrics(batch[num])
+            for name, values in single.items():
+                np.testing.assert_allclose(metrics[name][num], values)
+
+    def test_afids_metrics(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            metrics = afids_metrics(parse_fcsv(fcsv))
+        self.assertTrue(18 < metrics['acpc'] < 40)
+        self.assertEqual(list(metrics['midline_deviation']),
+                         list(QC_TABLES.midline_abbrevs))
+        self.assertEqual(list(metrics['asymmetry']),
+                         list(QC_TABLES.pair_names))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import population
+from controller import template_store
+from reports import (
+    plotlyjs_filename, report_filename, report_filenames, write_reports)
+
+TEMPLATE = 'MNI2009cAsym'
+
+
+class TestReportFilename(unittest.TestCase):
+    def test_report_filename(self):
+        self.assertEqual(report_filename('sub-01.fcsv'), 'sub-01.html')
+        self.assertEqual(report_filename('site/sub-01.mrk.json'),
+                         'site_sub-01.html')
+        self.assertEqual(report_filename('cohort.csv:sub 02'),
+                         'cohort.csv_sub_02.html')
+
+    def test_report_filenames(self):
+        self.assertEqual(
+            report_filenames(['a/b.fcsv', 'a_b.fcsv', 'a_b-2.fcsv',
+                              'A_B.mrk.json', 'index.fcsv', 'sub-01.fcsv']),
+            ['a_b.html', 'a_b-3.html', 'a_b-2.html', 'A_B-4.html',
+             'index-2.html', 'sub-01.html'])
+
+
+class TestWriteReports(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.out_dir = os.path.join(tempfile.mkdtemp(), 'reports')
+        for name in ('valid.fcsv', 'valid_flip.fcsv', 'too_few_rows.fcsv'):
+            shutil.copy(os.path.join('test/resources', name), self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(os.path.dirname(self.out_dir))
+
+    def check_reports(self, jobs):
+        reports, rejected = write_reports(
+            self.source, self.out_dir, TEMPLATE,
+            template_store.get(TEMPLATE), jobs=jobs)
+
+        self.assertEqual(
+            reports,
+            [('valid.fcsv', 'valid.html'),
+             ('valid_flip.fcsv', 'valid_flip.html')])
+        self.assertEqual(rejected, [('too_few_rows.fcsv', 'Too few rows')])
+        self.assertEqual(
+            sorted(os.listdir(self.out_dir)),
+            ['index.html', plotlyjs_filename(), 'valid.html',
+             'valid_flip.html'])
+
+        with open(os.path.join(self.out_dir, 'valid.html'), 'r') as report:
+            html = report.read()
+        # Figures load the shared local bundle, not a CDN copy
+        self.assertIn(
+            '<script src="{src}"></script>'.format(src=plotlyjs_filename()),
+            html)
+        self.assertNotIn('cdn.plot.ly', html)
+        self.assertLess(len(html), 200000)
+        self.assertIn('RMB/LMB', html)
+
+        with open(os.path.join(self.out_dir, 'index.html'), 'r') as index:
+            html = index.read()
+        self.assertIn('href="valid_flip.html"', html)
+        self.assertIn('Too few rows', html)
+
+    def check_clashing_names(self, jobs):
+        os.mkdir(os.path.join(self.source, 'valid'))
+        shutil.copy('test/resources/valid.fcsv',
+                    os.path.join(self.source, 'valid', 'flip.fcsv'))
+        shutil.copy('test/resources/valid.mrk.json', self.source)
+        shutil.copy('test/resources/valid.fcsv',
+                    os.path.join(self.source, 'index.fcsv'))
+
+        reports, _ = write_reports(
+            self.source, self.out_dir, TEMPLATE,
+            template_store.get(TEMPLATE), jobs=jobs)
+
+        self.assertEqual(
+            reports,
+            [('index.fcsv', 'index-2.html'),
+             ('valid.fcsv', 'valid.html'),
+             ('valid.mrk.json', 'valid-2.html'),
+             (os.path.join('valid', 'flip.fcsv'), 'valid_flip.html'),
+             ('valid_flip.fcsv', 'valid_flip-2.html')])
+        self.assertEqual(
+            sorted(os.listdir(self.out_dir)),
+            ['index-2.html', 'index.html', plotlyjs_filename(),
+             'valid-2.html', 'valid.html', 'valid_flip-2.html',
+             'valid_flip.html'])
+        with open(os.path.join(self.out_dir, 'valid-2.html'), 'r') as report:
+            self.assertIn('valid.mrk.json', report.read())
+
+    def test_population_of_protocol(self):
+        template_afids = template_store.get(TEMPLATE)
+        coords = np.random.RandomState(0).normal(
+            template_afids.coords, 1.0, size=(20, 32, 3))
+        sums = [np.zeros(32), np.zeros((32, 3)), np.zeros((32, 3, 3))]
+        population._accumulate(sums, coords)
+        aggregates = population.LandmarkAggregates.from_sums(*sums)
+
+        write_reports(
+            self.source, self.out_dir, TEMPLATE, template_afids,
+            {'nhp': aggregates}, jobs=1)
+        with open(os.path.join(self.out_dir, 'valid.html'), 'r') as report:
+            self.assertNotIn('Population spread', report.read())
+
+        write_reports(
+            self.source, self.out_dir, TEMPLATE, template_afids,
+            {'human': aggregates}, jobs=1)
+        with open(os.path.join(self.out_dir, 'valid.html'), 'r') as report:
+            self.assertIn('Population spread', report.read())
+
+    def test_inline(self):
+        self.check_reports(jobs=1)
+
+    def test_pool(self):
+        self.check_reports(jobs=2)
+
+    def test_clashing_names_inline(self):
+        self.check_clashing_names(jobs=1)
+
+    def test_clashing_names_pool(self):
+        self.check_clashing_names(jobs=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
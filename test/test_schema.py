@@ -0,0 +1,82 @@
+import glob
+import json
+import shutil
+import subprocess
+import unittest
+
+import controller
+import model_auto
+
+# Prints, for each fcsv file, why static/js/prevalidate.js rejects it
+CHECK_SCRIPT = '''
+const fs = require('fs');
+const {checkFcsv} = require('./static/js/prevalidate.js');
+const schema = JSON.parse(fs.readFileSync(0, 'utf8'));
+console.log(JSON.stringify(process.argv.slice(1).map(
+    (path) => checkFcsv(fs.readFileSync(path, 'utf8'), schema, null))));
+'''
+
+
+class TestFcsvSchema(unittest.TestCase):
+    def setUp(self):
+        self.client = controller.app.test_client()
+
+    def test_schema(self):
+        schema = model_auto.fcsv_schema()
+
+        self.assertEqual(schema['schema_version'], model_auto.SCHEMA_VERSION)
+        self.assertEqual(schema['fcsv']['min_version'], '4.6')
+        self.assertEqual(len(schema['fcsv']['fields']), 14)
+        self.assertEqual([protocol['key'] for protocol in schema['protocols']],
+                         list(model_auto.PROTOCOLS))
+        rows = schema['protocols'][0]['rows']
+        self.assertEqual(len(rows), 32)
+        self.assertEqual(rows[2], {
+            'label': '3',
+            'desc': 'infracollicular sulcus',
+            'aliases': ['ics', 'infracollicular sulcus']})
+
+    def test_served(self):
+        url = '/schema/v{version}/fcsv.json'.format(
+            version=model_auto.SCHEMA_VERSION)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), model_auto.fcsv_schema())
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+        response = self.client.get(url, headers={
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_version(self):
+        response = self.client.get('/schema/v0/fcsv.json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_validator_links_prevalidation(self):
+        html = self.client.get('/validator.html').get_data(as_text=True)
+
+        self.assertIn('data-schema-url="/schema/v{version}/fcsv.json"'.format(
+            version=model_auto.SCHEMA_VERSION), html)
+        self.assertRegex(html, r'/assets/js/prevalidate\.[0-9a-f]{12}\.js')
+
+    @unittest.skipUnless(shutil.which('node'), 'node is not installed')
+    def test_same_checks_in_browser(self):
+        paths = sorted(glob.glob('test/resources/*.fcsv'))
+        output = subprocess.run(
+            ['node', '-e', CHECK_SCRIPT] + paths,
+            input=json.dumps(model_auto.fcsv_schema()),
+            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+
+        for path, error in zip(paths, json.loads(output.stdout)):
+            with self.subTest(path=path), open(path, 'r') as fcsv:
+                try:
+                    model_auto.parse_fcsv(fcsv)
+                    expected = None
+                except model_auto.InvalidFcsvError as err:
+                    expected = err.message
+                self.assertEqual(error, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from datetime import datetime, timezone
+
+import controller
+import model_auto
+from controller import db, FiducialSet
+
+
+class TestQuerySets(unittest.TestCase):
+    def setUp(self):
+        self.context = controller.app.app_context()
+        self.context.push()
+        db.create_all()
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            afids = model_auto.parse_fcsv(fcsv)
+
+        rows = []
+        for num in range(5):
+            shifted = model_auto.AfidsSet(
+                afids.protocol, afids.coords + [float(num), 0.0, 0.0])
+            rows.append(FiducialSet.columns_from_afids(
+                shifted,
+                template='MNI2009cAsym' if num < 3 else 'other',
+                source='sub-{num}.fcsv'.format(num=num),
+                created=datetime(2020, 1, 1 + num, tzinfo=timezone.utc)))
+        FiducialSet.insert_new(rows)
+        self.ids = [fset.id for fset in FiducialSet.query.order_by(
+            FiducialSet.id)]
+        self.client = controller.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def get(self, query):
+        return self.client.get('/sets?' + query)
+
+    def test_all(self):
+        data = self.get('').get_json()
+
+        self.assertEqual([fset['id'] for fset in data['sets']], self.ids)
+        self.assertIsNone(data['after'])
+        self.assertEqual(data['sets'][0]['source'], 'sub-0.fcsv')
+        self.assertIn('AC_x', data['sets'][0])
+
+    def test_paging(self):
+        first = self.get('limit=2').get_json()
+        second = self.get(
+            'limit=2&after={after}'.format(after=first['after'])).get_json()
+        last = self.get(
+            'limit=2&after={after}'.format(after=second['after'])).get_json()
+
+        self.assertEqual([fset['id'] for fset in first['sets']],
+                         self.ids[:2])
+        self.assertEqual([fset['id'] for fset in second['sets']],
+                         self.ids[2:4])
+        self.assertEqual([fset['id'] for fset in last['sets']],
+                         self.ids[4:])
+        self.assertIsNone(last['after'])
+
+    def test_filters(self):
+        data = self.get('template=MNI2009cAsym&since=2020-01-02').get_json()
+        self.assertEqual([fset['source'] for fset in data['sets']],
+                         ['sub-1.fcsv', 'sub-2.fcsv'])
+
+        data = self.get('until=2020-01-02T00:00:00&protocol=human').get_json()
+        self.assertEqual([fset['source'] for fset in data['sets']],
+                         ['sub-0.fcsv'])
+
+    def test_utc_offset(self):
+        # 2020-01-02T00:00:00 UTC, the upload time of sub-1
+        for since in ('2020-01-02T05:30:00%2B05:30',
+                      '2020-01-01T19:00:00-05:00',
+                      '2020-01-02T00:00:00Z',
+                      '2020-01-02T00:00:00.000000'):
+            with self.subTest(since=since):
+                data = self.get('template=MNI2009cAsym&since=' + since)
+                self.assertEqual(
+                    [fset['source'] for fset in data.get_json()['sets']],
+                    ['sub-1.fcsv', 'sub-2.fcsv'])
+
+        data = self.get('until=2020-01-02T00:00:01%2B00:01').get_json()
+        self.assertEqual([fset['source'] for fset in data['sets']],
+                         ['sub-0.fcsv'])
+
+    def test_bad_values(self):
+        for query in ('since=soon', 'until=2020-13-01', 'after=first',
+                      'since=2020-01-02T00:00:00junk',
+                      # An unencoded + is a space
+                      'since=2020-01-02T00:00:00+05:00',
+                      'since=2020-01-02junk',
+                      'limit=many', 'limit=0', 'limit=-1'):
+            with self.subTest(query=query):
+                self.assertEqual(self.get(query).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from sqlalchemy import text
+
+import controller
+import model_auto
+from controller import db, FiducialSet, TemplateDistance
+
+
+class TestSqliteBackend(unittest.TestCase):
+    def setUp(self):
+        self.context = controller.app.app_context()
+        self.context.push()
+        db.create_all()
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            self.afids = model_auto.parse_fcsv(fcsv)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def pragma(self, name):
+        return db.session.execute(
+            text('PRAGMA {name}'.format(name=name))).scalar()
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('foreign_keys'), 1)
+        # NORMAL
+        self.assertEqual(self.pragma('synchronous'), 1)
+
+    def test_cascade(self):
+        FiducialSet.insert_new([FiducialSet.columns_from_afids(self.afids)])
+        self.assertGreater(TemplateDistance.query.count(), 0)
+
+        db.session.execute(FiducialSet.__table__.delete())
+        db.session.commit()
+        self.assertEqual(TemplateDistance.query.count(), 0)
+
+    def test_many_hashes(self):
+        # More values than older SQLite builds accept in one statement
+        rows = []
+        for num in range(1200):
+            shifted = model_auto.AfidsSet(
+                self.afids.protocol, self.afids.coords + num)
+            rows.append(FiducialSet.columns_from_afids(shifted))
+
+        self.assertEqual(FiducialSet.insert_new(rows), [True] * 1200)
+        self.assertEqual(FiducialSet.insert_new(rows[::100]), [False] * 12)
+        ids = FiducialSet.ids_by_hash(
+            [row['content_hash'] for row in rows] + ['missing'])
+        self.assertEqual(len(ids), 1200)
+
+
+class TestDatabaseUrl(unittest.TestCase):
+    def database_uri(self, settings):
+        """The database URI of the app, without DATABASE_URL."""
+        env = dict(os.environ, APP_SETTINGS=settings)
+        del env['DATABASE_URL']
+        return subprocess.run(
+            [sys.executable, '-c',
+             'import controller;'
+             ' print(controller.app.config["SQLALCHEMY_DATABASE_URI"])'],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+
+    def test_required_in_production(self):
+        for settings in ('config.ProductionConfig', 'config.StagingConfig'):
+            with self.subTest(settings=settings):
+                result = self.database_uri(settings)
+                self.assertNotEqual(result.returncode, 0)
+                self.assertIn('DATABASE_URL must be set', result.stderr)
+
+    def test_sqlite_in_tests(self):
+        result = self.database_uri('config.TestingConfig')
+        self.assertEqual(result.returncode, 0)
+        self.assertTrue(result.stdout.startswith('sqlite:///'))
+
+
+if __name__ == '__main__':
+    unittest.main()
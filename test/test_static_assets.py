@@ -0,0 +1,76 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask, abort
+
+import static_assets
+
+
+class TestStaticAssets(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'css'))
+        self.css = b'body { color: black; }\n' * 50
+        with open(os.path.join(self.directory, 'css', 'site.css'),
+                  'wb') as out_file:
+            out_file.write(self.css)
+        self.video = bytes(range(256)) * 40
+        with open(os.path.join(self.directory, 'clip.mp4'), 'wb') as out_file:
+            out_file.write(self.video)
+
+        self.assets = static_assets.StaticAssets(self.directory)
+        app = Flask(__name__)
+
+        @app.route('/assets/<path:filename>')
+        def asset(filename):
+            response = self.assets.response(filename)
+            if response is None:
+                abort(404)
+            return response
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprinted_name(self):
+        url_name = self.assets.url_name('css/site.css')
+
+        self.assertRegex(url_name, r'^css/site\.[0-9a-f]{12}\.css$')
+        self.assertEqual(self.assets.lookup(url_name).mimetype, 'text/css')
+        self.assertIsNone(self.assets.lookup('css/site.css'))
+
+    def test_precompressed(self):
+        url = '/assets/' + self.assets.url_name('css/site.css')
+        response = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.data), self.css)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        response = self.client.get(url, headers={
+            'Accept-Encoding': 'gzip',
+            'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        url = '/assets/' + self.assets.url_name('clip.mp4')
+        response = self.client.get(url, headers={'Range': 'bytes=100-199'})
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, self.video[100:200])
+        self.assertEqual(response.headers['Content-Range'],
+                         'bytes 100-199/{}'.format(len(self.video)))
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        response.close()
+
+    def test_unknown(self):
+        self.assertEqual(
+            self.client.get('/assets/clip.mp4').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
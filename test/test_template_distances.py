@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+
+import controller
+import model_auto
+from controller import db, FiducialSet, TemplateDistance
+
+
+class TestTemplateDistances(unittest.TestCase):
+    def setUp(self):
+        self.context = controller.app.app_context()
+        self.context.push()
+        db.create_all()
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            self.afids = model_auto.parse_fcsv(fcsv)
+        self.shifted = model_auto.AfidsSet(
+            self.afids.protocol, self.afids.coords + [3.0, 4.0, 0.0])
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_filled_on_insert(self):
+        FiducialSet.insert_new([FiducialSet.columns_from_afids(self.afids)])
+        templates = controller.template_store.items()
+
+        self.assertEqual(TemplateDistance.query.count(), len(templates))
+        name, template_afids = templates[0]
+        row = TemplateDistance.query.filter_by(template=name).one()
+        expected = self.afids.distances_to(template_afids)
+        self.assertAlmostEqual(row.AC, expected[0])
+        self.assertAlmostEqual(row.mean_distance, expected.mean())
+
+    def test_backfill(self):
+        FiducialSet.insert_new([
+            FiducialSet.columns_from_afids(self.afids),
+            FiducialSet.columns_from_afids(self.shifted)])
+
+        self.assertEqual(
+            TemplateDistance.backfill('New', self.afids, batch_size=1), 2)
+        self.assertEqual(TemplateDistance.backfill('New', self.afids), 0)
+        distances = [
+            row.LOSF for row in TemplateDistance.query
+            .filter_by(template='New').order_by(TemplateDistance.set_id)]
+        np.testing.assert_allclose(distances, [0.0, 5.0])
+
+    def test_summary(self):
+        FiducialSet.insert_new([
+            FiducialSet.columns_from_afids(self.afids),
+            FiducialSet.columns_from_afids(self.shifted)])
+        TemplateDistance.backfill('New', self.afids)
+
+        summary = controller.app.test_client().get('/distances/New').json
+        self.assertEqual(summary['count'], 2)
+        self.assertAlmostEqual(summary['afids']['AC']['mean'], 2.5)
+        self.assertAlmostEqual(summary['afids']['AC']['max'], 5.0)
+
+    def test_summary_by_protocol(self):
+        nhp_afids = model_auto.AfidsSet(
+            model_auto.PROTOCOLS['nhp'], self.afids.coords / 2)
+        FiducialSet.insert_new([
+            FiducialSet.columns_from_afids(self.afids),
+            FiducialSet.columns_from_afids(self.shifted, protocol=None),
+            FiducialSet.columns_from_afids(nhp_afids)])
+        TemplateDistance.backfill('New', self.afids)
+        client = controller.app.test_client()
+
+        # Sets stored without a protocol count as human
+        summary = client.get('/distances/New').json
+        self.assertEqual(summary['protocol'], 'human')
+        self.assertEqual(summary['count'], 2)
+        self.assertAlmostEqual(summary['afids']['AC']['max'], 5.0)
+
+        summary = client.get('/distances/New?protocol=nhp').json
+        self.assertEqual(summary['count'], 1)
+        self.assertAlmostEqual(summary['afids']['AC']['mean'], np.linalg.norm(
+            self.afids.coords[0] / 2))
+
+        self.assertEqual(
+            client.get('/distances/New?protocol=dog').status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import template_store
+
+
+class TestTemplateStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copy('test/resources/valid.fcsv',
+                    os.path.join(self.directory, 'sub-First_afids.fcsv'))
+        self.store = template_store.TemplateStore(
+            self.directory, check_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_template_name(self):
+        self.assertEqual(
+            template_store.template_name('sub-MNI2009cAsym_afids.fcsv'),
+            'MNI2009cAsym')
+
+    def test_preloaded(self):
+        self.assertEqual(self.store.names(), ['First'])
+        self.assertEqual(self.store.get('First').coords.shape, (32, 3))
+        self.assertIsNone(self.store.get('Second'))
+
+    def test_added_and_removed(self):
+        first = self.store.get('First')
+        shutil.copy('test/resources/valid.fcsv',
+                    os.path.join(self.directory, 'sub-Second_afids.fcsv'))
+
+        self.assertEqual(self.store.names(), ['First', 'Second'])
+        # Unchanged templates are not parsed again
+        self.assertIs(self.store.get('First'), first)
+
+        os.remove(os.path.join(self.directory, 'sub-First_afids.fcsv'))
+        self.assertEqual(self.store.names(), ['Second'])
+
+    def test_changed(self):
+        path = os.path.join(self.directory, 'sub-First_afids.fcsv')
+        with open(path, 'a') as out_file:
+            out_file.write('\n')
+        os.utime(path, ns=(0, 0))
+
+        self.assertIsNot(self.store.get('First'), None)
+        self.assertEqual(self.store._entries['First'].stat_key[0], 0)
+
+    def test_invalid_skipped(self):
+        with open(os.path.join(self.directory, 'sub-Bad_afids.fcsv'),
+                  'w') as out_file:
+            out_file.write('not an fcsv\n')
+
+        self.assertEqual(self.store.names(), ['First'])
+        self.assertIsNone(self.store.get('Bad'))
+
+    def test_check_interval(self):
+        store = template_store.TemplateStore(
+            self.directory, check_interval=3600)
+        shutil.copy('test/resources/valid.fcsv',
+                    os.path.join(self.directory, 'sub-Second_afids.fcsv'))
+
+        self.assertEqual(store.names(), ['First'])
+        store.refresh(force=True)
+        self.assertEqual(store.names(), ['First', 'Second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import concurrent.futures
+import unittest
+from unittest import mock
+
+import controller
+from model_auto import parse_fcsv
+from visualizations import FigurePool
+
+TEMPLATE = 'MNI2009cAsym'
+UPLOADS = ('test/resources/valid.fcsv', 'test/resources/valid_flip.fcsv')
+
+
+def expected_rows(path):
+    """Table rows the validator shows for an upload."""
+    with open(path, 'r') as user_file:
+        user_afids = parse_fcsv(user_file)
+    template_afids = controller.template_store.get(TEMPLATE)
+    return [
+        '<tr><td>{label}</td><td>{distance}</td></tr>'.format(
+            label=label, distance=round(float(distance), 5))
+        for label, distance in zip(
+            template_afids.descs, user_afids.distances_to(template_afids))]
+
+
+class TestThreadedValidator(unittest.TestCase):
+    def validate(self, path):
+        """POST an upload to the validator from a fresh client."""
+        with open(path, 'rb') as upload:
+            response = controller.app.test_client().post(
+                '/validator.html',
+                data={'filename': (upload, path.split('/')[-1]),
+                      'fid_template': TEMPLATE,
+                      'protocol': 'auto'},
+                content_type='multipart/form-data')
+        return path, response.status_code, response.get_data(as_text=True)
+
+    def check_concurrent_validations(self, figure_pool):
+        expected = {path: expected_rows(path) for path in UPLOADS}
+        self.assertNotEqual(expected[UPLOADS[0]], expected[UPLOADS[1]])
+
+        with mock.patch.object(controller, 'figure_pool', figure_pool):
+            with concurrent.futures.ThreadPoolExecutor(4) as executor:
+                results = list(executor.map(self.validate, UPLOADS * 4))
+
+        for path, status, body in results:
+            self.assertEqual(status, 200)
+            self.assertIn('Valid file', body)
+            for row in expected[path]:
+                self.assertIn(row, body)
+            other = UPLOADS[1] if path == UPLOADS[0] else UPLOADS[0]
+            self.assertFalse(
+                all(row in body for row in expected[other]))
+
+        return [body for _, _, body in results]
+
+    def test_concurrent_validations(self):
+        # Render figures in the request threads, as with no pool workers
+        self.check_concurrent_validations(FigurePool(0))
+
+    def test_concurrent_validations_on_figure_pool(self):
+        # The pool of a threaded web worker, as configured by default
+        figure_pool = FigurePool(controller.app.config['FIGURE_WORKERS'])
+        try:
+            # Start the processes before the first request's deadline
+            figure_pool.render((len, 'warm up'), (len, ''))
+            bodies = self.check_concurrent_validations(figure_pool)
+        finally:
+            figure_pool.shutdown()
+
+        for body in bodies:
+            self.assertIn('"type":"scatter3d"', body)
+            self.assertIn('"type":"histogram"', body)
+
+    def test_concurrent_template_reads(self):
+        store = controller.template_store
+
+        def read(_):
+            store.refresh(force=True)
+            return store.names(), store.get(TEMPLATE) is not None
+
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(read, range(16)))
+
+        for names, found in results:
+            self.assertIn(TEMPLATE, names)
+            self.assertTrue(found)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import io
+import unittest
+from unittest import mock
+
+import controller
+from model_auto import PROTOCOLS
+from visualizations import FigurePool
+
+
+class TestValidatorForm(unittest.TestCase):
+    def setUp(self):
+        self.client = controller.app.test_client()
+
+    def post(self, template):
+        with open('test/resources/valid.fcsv', 'rb') as upload:
+            return self.client.post(
+                '/validator.html',
+                data={'filename': (upload, 'valid.fcsv'),
+                      'fid_template': template,
+                      'protocol': 'auto'},
+                content_type='multipart/form-data')
+
+    def assert_protocols_listed(self, html):
+        for protocol in PROTOCOLS.values():
+            self.assertIn(
+                '<option value="{key}">{name}</option>'.format(
+                    key=protocol.key, name=protocol.name), html)
+
+    def test_form(self):
+        self.assert_protocols_listed(
+            self.client.get('/validator.html').get_data(as_text=True))
+
+    def test_structure_only(self):
+        response = self.post('Validate .fcsv file structure')
+
+        self.assertIn('Valid file', response.get_data(as_text=True))
+        self.assert_protocols_listed(response.get_data(as_text=True))
+
+    def test_compared_to_template(self):
+        with mock.patch.object(controller, 'figure_pool', FigurePool(0)):
+            response = self.post('MNI2009cAsym')
+
+        self.assertIn('MNI2009cAsym selected', response.get_data(as_text=True))
+        self.assert_protocols_listed(response.get_data(as_text=True))
+
+    def test_malformed_mrk_json(self):
+        response = self.client.post(
+            '/validator.html',
+            data={'filename': (io.BytesIO(b'{"markups": ["AC"]}'),
+                               'bad.mrk.json'),
+                  'fid_template': 'Validate .fcsv file structure',
+                  'protocol': 'auto'},
+            content_type='multipart/form-data')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Invalid file: Missing or invalid markups',
+                      response.get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import concurrent.futures
+import threading
+import types
+import unittest
+
+import numpy as np
+
+import model_auto
+import visualizations
+
+
+class TestFigureSnippets(unittest.TestCase):
+    def setUp(self):
+        with open('test/resources/valid.fcsv', 'r') as fcsv:
+            self.ref_afids = model_auto.parse_fcsv(fcsv)
+        with open('test/resources/valid_flip.fcsv', 'r') as fcsv:
+            self.user_afids = model_auto.parse_fcsv(fcsv)
+
+    def test_compact(self):
+        self.assertEqual(
+            visualizations.compact([1.23456, None, -0.00004], 4),
+            [1.2346, None, -0.0])
+
+    def test_snippets_do_not_embed_plotlyjs(self):
+        for generate in (visualizations.generate_3d_scatter,
+                         visualizations.generate_histogram):
+            html = generate(self.ref_afids, self.user_afids)
+            self.assertNotIn('<script src=', html)
+            self.assertNotIn('cdn.plot.ly', html)
+
+    def test_population_overlay(self):
+        centroid = self.ref_afids.coords
+        covariance = np.tile(np.eye(3), (32, 1, 1))
+        count = np.full(32, 100)
+        count[3] = 2
+        population = types.SimpleNamespace(
+            count=count, centroid=centroid, covariance=covariance)
+
+        traces = visualizations.population_traces(
+            population, list(self.ref_afids.descs))
+        vertices, triangles = visualizations.unit_sphere()
+
+        self.assertEqual(len(traces[0].x), 31)
+        self.assertEqual(len(traces[1].x), 31 * len(vertices))
+        self.assertEqual(len(traces[1].i), 31 * len(triangles))
+        self.assertEqual(traces[0].visible, 'legendonly')
+
+        html = visualizations.generate_3d_scatter(
+            self.ref_afids, self.user_afids, population)
+        self.assertIn('"type":"mesh3d"', html)
+
+
+class TestFigurePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = visualizations.FigurePool(
+            2, concurrent.futures.ThreadPoolExecutor)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_render_in_order(self):
+        results = self.pool.render(
+            (str.upper, 'scatter'), (str.upper, 'histogram'), (len, 'abc'))
+
+        self.assertEqual(results, ['SCATTER', 'HISTOGRAM', 3])
+
+    def test_last_figure_inline(self):
+        results = self.pool.render(
+            (threading.get_ident,), (threading.get_ident,))
+
+        self.assertNotEqual(results[0], threading.get_ident())
+        self.assertEqual(results[1], threading.get_ident())
+
+    def test_saturated_renders_inline(self):
+        release = threading.Event()
+        self.pool.max_workers = 1
+        busy = self.pool._submit(release.wait, ())
+
+        results = self.pool.render(
+            (threading.get_ident,), (threading.get_ident,))
+        release.set()
+        busy.result()
+
+        self.assertEqual(results, [threading.get_ident()] * 2)
+
+    def test_no_workers(self):
+        pool = visualizations.FigurePool(0)
+
+        self.assertEqual(pool.render((len, 'ab'), (len, 'abc')), [2, 3])
+        self.assertIsNone(pool._executor)
+
+
+# Held by the test process while figure processes start
+HELD_LOCK = threading.Lock()
+
+
+def held_lock_is_free():
+    """Can a figure process take HELD_LOCK?"""
+    return HELD_LOCK.acquire(timeout=0)
+
+
+class TestFigureProcesses(unittest.TestCase):
+    def test_not_forked(self):
+        pool = visualizations.FigurePool(1)
+        try:
+            with HELD_LOCK:
+                results = pool.render((held_lock_is_free,), (len, 'ab'))
+        finally:
+            pool.shutdown()
+
+        # A forked child would have inherited the lock, held
+        self.assertEqual(results, [True, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,93 @@
 """Utilities for generating AFIDs-related graphics"""
 
+import concurrent.futures
+import functools
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import plotly
 import plotly.graph_objects as go
+from plotly.offline import get_plotlyjs
 
+# Version of the Plotly library the figures are rendered with; it is part
+# of the bundle's URL so that the bundle can be cached indefinitely.
+PLOTLYJS_VERSION = plotly.__version__
 
-def gen_connecting_lines(ref_json, user_json):
+# Population ellipsoids enclose this many standard deviations, and are
+# drawn as a sphere of ELLIPSOID_SEGMENTS meridians and ELLIPSOID_RINGS
+# parallels, so the overlay has a fixed size whatever the population.
+ELLIPSOID_SCALE = 2.0
+ELLIPSOID_SEGMENTS = 8
+ELLIPSOID_RINGS = 3
+# AFIDs placed by fewer sets are not drawn
+POPULATION_MIN_COUNT = 5
+
+# Decimal places kept for coordinates (the hover text shows four) and for
+# distances (the tables and labels show three).
+COORD_DECIMALS = 4
+DISTANCE_DECIMALS = 3
+
+
+@functools.lru_cache(maxsize=1)
+def plotlyjs_bundle():
+    """Return the minified Plotly library as bytes.
+
+    The figure snippets do not embed the library, so the page must load
+    this bundle once before any figure.
+    """
+    return get_plotlyjs().encode("utf-8")
+
+
+def compact(values, ndigits):
+    """Round a list of numbers, keeping None gaps, to shrink figure JSON.
+
+    Parameters
+    ----------
+    values : list of float or None
+        The values to round.
+    ndigits : int
+        Number of decimal places to keep.
+
+    Returns
+    -------
+    list of float or None
+    """
+    return [
+        None if value is None else round(value, ndigits) for value in values
+    ]
+
+
+def figure_to_html(fig):
+    """Render a figure as an HTML snippet that relies on a shared bundle.
+
+    Parameters
+    ----------
+    fig : plotly.graph_objects.Figure
+        The figure to render.
+
+    Returns
+    -------
+    str
+        HTML snippet containing only the figure's div and data.
+    """
+    return fig.to_html(
+        include_plotlyjs=False,
+        full_html=False,
+        config={"displaylogo": False},
+    )
+
+
+def gen_connecting_lines(ref_afids, user_afids):
     """Assemble points from each fcsv into pairs.
 
     Parameters
     ----------
-    ref_json : dict
-        Dictionary of reference AFIDs
-    user_json : dict
-        Dictionary of user-provided AFIDs
+    ref_afids : model_auto.AfidsSet
+        Reference AFIDs
+    user_afids : model_auto.AfidsSet
+        User-provided AFIDs
 
     Returns
     -------
@@ -20,19 +96,13 @@ def gen_connecting_lines(ref_json, user_json):
         AFIDs coordinates.
     """
     connecting_lines = []
-    for ref_entry, user_entry in zip(ref_json.values(), user_json.values()):
+    for ref_entry, user_entry in zip(
+        ref_afids.coords.tolist(), user_afids.coords.tolist()
+    ):
         connecting_lines.append(
             [
-                {
-                    "x": float(ref_entry["x"]),
-                    "y": float(ref_entry["y"]),
-                    "z": float(ref_entry["z"]),
-                },
-                {
-                    "x": float(user_entry["x"]),
-                    "y": float(user_entry["y"]),
-                    "z": float(user_entry["z"]),
-                },
+                dict(zip(("x", "y", "z"), ref_entry)),
+                dict(zip(("x", "y", "z"), user_entry)),
             ]
         )
     return connecting_lines
@@ -92,15 +162,151 @@ def calculate_magnitudes(connecting_lines):
     return (lines_x, lines_y, lines_z, lines_magnitudes)
 
 
-def generate_3d_scatter(ref_json, user_json):
+@functools.lru_cache(maxsize=1)
+def unit_sphere():
+    """Vertices and triangles of a coarse unit sphere.
+
+    Returns
+    -------
+    vertices : numpy.ndarray, shape (V, 3)
+        The poles, then ELLIPSOID_RINGS rings of ELLIPSOID_SEGMENTS points.
+    triangles : numpy.ndarray of int, shape (T, 3)
+        Vertex indices of each triangle.
+    """
+    segments = ELLIPSOID_SEGMENTS
+    rings = ELLIPSOID_RINGS
+    polar = np.pi * np.arange(1, rings + 1) / (rings + 1)
+    azimuth = 2 * np.pi * np.arange(segments) / segments
+    ring_vertices = np.stack(
+        [
+            np.outer(np.sin(polar), np.cos(azimuth)).ravel(),
+            np.outer(np.sin(polar), np.sin(azimuth)).ravel(),
+            np.repeat(np.cos(polar), segments),
+        ],
+        axis=1,
+    )
+    vertices = np.vstack([[[0, 0, 1], [0, 0, -1]], ring_vertices])
+
+    def ring_index(ring, segment):
+        return 2 + ring * segments + segment % segments
+
+    triangles = []
+    for segment in range(segments):
+        triangles.append(
+            [0, ring_index(0, segment), ring_index(0, segment + 1)]
+        )
+        triangles.append(
+            [
+                1,
+                ring_index(rings - 1, segment + 1),
+                ring_index(rings - 1, segment),
+            ]
+        )
+        for ring in range(rings - 1):
+            corners = [
+                ring_index(ring, segment),
+                ring_index(ring + 1, segment),
+                ring_index(ring + 1, segment + 1),
+                ring_index(ring, segment + 1),
+            ]
+            triangles.append(corners[:3])
+            triangles.append([corners[0], corners[2], corners[3]])
+
+    return vertices, np.array(triangles)
+
+
+def population_traces(population, descs):
+    """Traces showing where a population of sets placed each AFID.
+
+    Parameters
+    ----------
+    population : population.LandmarkAggregates
+        Per-AFID centroid and covariance of the stored sets.
+    descs : list of str
+        Description of each AFID.
+
+    Returns
+    -------
+    list of plotly.graph_objects.Scatter3d and Mesh3d
+        The centroids, and one mesh of an ELLIPSOID_SCALE standard
+        deviation ellipsoid around each; both start hidden, and are shown
+        from the legend.
+    """
+    sphere, triangles = unit_sphere()
+    shown = [
+        index
+        for index in range(len(population.count))
+        if population.count[index] >= POPULATION_MIN_COUNT
+        and np.isfinite(population.covariance[index]).all()
+    ]
+
+    if not shown:
+        return []
+
+    vertices = []
+    faces = []
+    for index in shown:
+        eigenvalues, eigenvectors = np.linalg.eigh(
+            population.covariance[index]
+        )
+        axes = eigenvectors * (
+            ELLIPSOID_SCALE * np.sqrt(np.clip(eigenvalues, 0, None))
+        )
+        faces.append(triangles + len(vertices) * len(sphere))
+        vertices.append(population.centroid[index] + sphere.dot(axes.T))
+
+    vertices = np.vstack(vertices)
+    faces = np.vstack(faces)
+
+    centroids = population.centroid[shown]
+    return [
+        go.Scatter3d(
+            x=compact(centroids[:, 0].tolist(), COORD_DECIMALS),
+            y=compact(centroids[:, 1].tolist(), COORD_DECIMALS),
+            z=compact(centroids[:, 2].tolist(), COORD_DECIMALS),
+            mode="markers",
+            marker=dict(size=3, color="rgba(31,119,180,0.9)"),
+            hovertemplate="%{text}",
+            text=[
+                "<b>{0}</b><br>Population mean of {1} sets".format(
+                    descs[index], int(population.count[index])
+                )
+                for index in shown
+            ],
+            name="Population",
+            legendgroup="population",
+            visible="legendonly",
+        ),
+        go.Mesh3d(
+            x=compact(vertices[:, 0].tolist(), 2),
+            y=compact(vertices[:, 1].tolist(), 2),
+            z=compact(vertices[:, 2].tolist(), 2),
+            i=faces[:, 0].tolist(),
+            j=faces[:, 1].tolist(),
+            k=faces[:, 2].tolist(),
+            color="rgb(31,119,180)",
+            opacity=0.15,
+            hoverinfo="skip",
+            name="Population spread",
+            showlegend=False,
+            legendgroup="population",
+            visible="legendonly",
+        ),
+    ]
+
+
+def generate_3d_scatter(ref_afids, user_afids, population=None):
     """Generate an HTML snippet containing a 3D scatter plot.
 
     Parameters
     ----------
-    ref_json : dict
-        Dictionary of reference AFIDs.
-    user_json : dict
-        Dictionary of user-provided AFIDs.
+    ref_afids : model_auto.AfidsSet
+        Reference AFIDs.
+    user_afids : model_auto.AfidsSet
+        User-provided AFIDs.
+    population : population.LandmarkAggregates, optional
+        Aggregates of the sets stored against the template, drawn as an
+        optional overlay.
 
     Returns
     -------
@@ -109,19 +315,19 @@ def generate_3d_scatter(ref_json, user_json):
         between pairs of provided AFIDs.
     """
 
-    connecting_lines = gen_connecting_lines(ref_json, user_json)
+    connecting_lines = gen_connecting_lines(ref_afids, user_afids)
 
     lines_x, lines_y, lines_z, lines_magnitudes = calculate_magnitudes(
         connecting_lines
     )
 
-    ids = [entry["desc"] for entry in ref_json.values()]
+    ids = list(ref_afids.descs)
 
     dset1 = [
         go.Scatter3d(
-            x=[float(i["x"]) for i in ref_json.values()],
-            y=[float(i["y"]) for i in ref_json.values()],
-            z=[float(i["z"]) for i in ref_json.values()],
+            x=compact(ref_afids.coords[:, 0].tolist(), COORD_DECIMALS),
+            y=compact(ref_afids.coords[:, 1].tolist(), COORD_DECIMALS),
+            z=compact(ref_afids.coords[:, 2].tolist(), COORD_DECIMALS),
             showlegend=True,
             mode="markers",
             marker=dict(
@@ -136,9 +342,9 @@ def generate_3d_scatter(ref_json, user_json):
             name="Template AFIDs",
         ),
         go.Scatter3d(
-            x=[float(i["x"]) for i in user_json.values()],
-            y=[float(i["y"]) for i in user_json.values()],
-            z=[float(i["z"]) for i in user_json.values()],
+            x=compact(user_afids.coords[:, 0].tolist(), COORD_DECIMALS),
+            y=compact(user_afids.coords[:, 1].tolist(), COORD_DECIMALS),
+            z=compact(user_afids.coords[:, 2].tolist(), COORD_DECIMALS),
             showlegend=True,
             mode="markers",
             marker=dict(
@@ -153,9 +359,9 @@ def generate_3d_scatter(ref_json, user_json):
             name="Uploaded AFIDs",
         ),
         go.Scatter3d(
-            x=lines_x,
-            y=lines_y,
-            z=lines_z,
+            x=compact(lines_x, COORD_DECIMALS),
+            y=compact(lines_y, COORD_DECIMALS),
+            z=compact(lines_z, COORD_DECIMALS),
             showlegend=False,
             mode="lines",
             hovertemplate="%{text}",
@@ -166,7 +372,7 @@ def generate_3d_scatter(ref_json, user_json):
                 for i in range(len(lines_x))
             ],
             line=dict(
-                color=lines_magnitudes,
+                color=compact(lines_magnitudes, DISTANCE_DECIMALS),
                 colorscale="Bluered",
                 width=8,
                 showscale=True,
@@ -180,6 +386,9 @@ def generate_3d_scatter(ref_json, user_json):
     bigfig.add_trace(dset1[0])
     bigfig.add_trace(dset1[1])
     bigfig.add_trace(dset1[2])
+    if population is not None:
+        for trace in population_traces(population, ids):
+            bigfig.add_trace(trace)
 
     bigfig.update_layout(
         title_text="Euclidean distances from template",
@@ -189,18 +398,18 @@ def generate_3d_scatter(ref_json, user_json):
         legend_orientation="h",
     )
 
-    return bigfig.to_html(include_plotlyjs="cdn", full_html=False)
+    return figure_to_html(bigfig)
 
 
-def generate_histogram(ref_json, user_json):
+def generate_histogram(ref_afids, user_afids):
     """Generate an HTML snippet containing a histogram of distances.
 
     Parameters
     ----------
-    ref_json : dict
-        Dictionary of reference AFIDs.
-    user_json : dict
-        Dictionary of user-provided AFIDs.
+    ref_afids : model_auto.AfidsSet
+        Reference AFIDs.
+    user_afids : model_auto.AfidsSet
+        User-provided AFIDs.
 
     Returns
     -------
@@ -208,10 +417,10 @@ def generate_histogram(ref_json, user_json):
         HTML snippet containing a histogram of the Euclidean distance
         between pairs of provided AFIDs.
     """
-    connecting_lines = gen_connecting_lines(ref_json, user_json)
+    connecting_lines = gen_connecting_lines(ref_afids, user_afids)
     _, _, _, lines_magnitudes = calculate_magnitudes(connecting_lines)
 
-    ids = [entry["desc"] for entry in ref_json.values()]
+    ids = list(ref_afids.descs)
 
     # next figure: histogram of distances
     lines_magnitudes_unique = [
@@ -233,7 +442,7 @@ def generate_histogram(ref_json, user_json):
                 str(i) + "<br>" + str(round(dists_sorted[ix], 3)) + " mm"
                 for ix, i in enumerate(ids_sorted)
             ],
-            marker_color=dists_sorted,
+            marker_color=compact(dists_sorted, DISTANCE_DECIMALS),
             marker_colorscale="Bluered",
             showlegend=False,
         )
@@ -245,7 +454,7 @@ def generate_histogram(ref_json, user_json):
         coloraxis=dict(colorscale="Bluered"),
     )
 
-    return fig4.to_html(include_plotlyjs="cdn", full_html=False)
+    return figure_to_html(fig4)
 
 
 def do_binning(in_data, nbins=6):
@@ -279,3 +488,117 @@ def do_binning(in_data, nbins=6):
         outformatted = str(round(out, 2)) + "-" + str(round(out + interval, 2))
         output.append(outformatted)
     return output
+
+
+# Figure processes are started by a clean server process rather than forked
+# from a web worker, whose other threads may hold locks (logging, the
+# database pool) that a forked child would inherit, held, forever.
+FIGURE_START_METHOD = (
+    "forkserver"
+    if "forkserver" in multiprocessing.get_all_start_methods()
+    else "spawn"
+)
+
+
+def figure_process_pool(max_workers):
+    """A process pool for figures, whose workers are not forked from here.
+
+    Choosing the pool's start method needs Python 3.7.
+    """
+    context = multiprocessing.get_context(FIGURE_START_METHOD)
+    if FIGURE_START_METHOD == "forkserver":
+        # Only takes effect if the fork server is not running yet
+        context.set_forkserver_preload([__name__])
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers, mp_context=context
+    )
+
+
+class FigurePool:
+    """Render independent figures in parallel on a small shared pool.
+
+    Figure building and serialization hold the GIL, so figures are
+    rendered in worker processes. The pool is created on first use, so
+    that each server worker gets its own, and its processes are started
+    with FIGURE_START_METHOD, which is safe from a threaded worker.
+
+    Attributes:
+        max_workers -- number of worker processes; 0 renders inline
+    """
+
+    def __init__(
+        self,
+        max_workers=2,
+        executor_factory=figure_process_pool,
+    ):
+        self.max_workers = max_workers
+        self._executor_factory = executor_factory
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _submit(self, func, args):
+        """Submit a figure to the pool, or return None if it is saturated."""
+        with self._lock:
+            if self._pending >= self.max_workers:
+                return None
+            if self._executor is None:
+                self._executor = self._executor_factory(self.max_workers)
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(func, *args)
+        except RuntimeError:
+            # The pool was shut down or broke; render inline instead
+            with self._lock:
+                self._pending -= 1
+            return None
+
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def render(self, *calls):
+        """Render figures concurrently.
+
+        The last figure, and any that do not fit in the pool, are rendered
+        inline in this thread while the pool works on the others, so a
+        saturated pool costs no more than rendering serially. Put the
+        slowest figure first.
+
+        Parameters
+        ----------
+        *calls : tuple
+            ``(function, arg, ...)`` for each figure, e.g.
+            ``(generate_histogram, ref_afids, user_afids)``.
+
+        Returns
+        -------
+        list of str
+            The HTML snippet of each figure, in the order of the calls.
+        """
+        # The calling thread would otherwise sit idle, so it takes the last
+        futures = [self._submit(call[0], call[1:]) for call in calls[:-1]]
+        futures.append(None)
+        results = [
+            call[0](*call[1:]) if future is None else None
+            for call, future in zip(calls, futures)
+        ]
+        for index, (call, future) in enumerate(zip(calls, futures)):
+            if future is not None:
+                try:
+                    results[index] = future.result()
+                except BrokenProcessPool:
+                    results[index] = call[0](*call[1:])
+
+        return results
+
+    def shutdown(self):
+        """Stop the worker processes, if they were started."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)